@@ -0,0 +1 @@
+# Benchmarks package — run modules from backend/, e.g. `python -m benchmarks.flashcards_due`
@@ -0,0 +1,140 @@
+"""Deterministic synthetic documents for benchmarks.
+
+Text is generated from a fixed vocabulary with a seeded RNG, so a given
+(seed, size) always produces byte-identical files and runs are comparable.
+PDFs are written with PyMuPDF, DOCX with python-docx and images with
+Pillow, all already backend dependencies.
+"""
+
+import random
+from typing import List
+
+_VOCABULARY = (
+    "photosynthesis chlorophyll membrane enzyme substrate catalyst equilibrium "
+    "mitochondria respiration glucose protein ribosome transcription genome "
+    "allele mutation selection population ecosystem biomass nitrogen carbon "
+    "cycle gradient diffusion osmosis potential voltage neuron synapse signal "
+    "receptor hormone insulin pathway regulation feedback homeostasis theory "
+    "experiment hypothesis variable control measurement analysis evidence model"
+).split()
+
+
+def paragraphs(n: int, seed: int = 0, words_per_paragraph: int = 90) -> List[str]:
+    """``n`` pseudo-academic paragraphs of roughly ``words_per_paragraph`` words."""
+    rng = random.Random(seed)
+    out = []
+    for p in range(n):
+        words = [rng.choice(_VOCABULARY) for _ in range(words_per_paragraph)]
+        sentences, i = [], 0
+        while i < len(words):
+            length = rng.randint(8, 18)
+            sentence = " ".join(words[i:i + length])
+            sentences.append(sentence[:1].upper() + sentence[1:] + ".")
+            i += length
+        out.append(f"Section {p + 1}. " + " ".join(sentences))
+    return out
+
+
+def write_txt(path: str, pages: int, seed: int = 0) -> str:
+    """About ``pages`` pages of plain text (FileService splits TXT at ~2000 chars)."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(paragraphs(pages * 3, seed)))
+    return path
+
+
+def table_rows(rows: int, cols: int = 4, seed: int = 0) -> List[List[str]]:
+    """A header row plus ``rows`` rows of one term and ``cols - 1`` numbers."""
+    rng = random.Random(seed)
+    header = [f"Column {c + 1}" for c in range(cols)]
+    return [header] + [
+        [rng.choice(_VOCABULARY) if c == 0 else f"{rng.uniform(0, 1000):.2f}" for c in range(cols)]
+        for _ in range(rows)
+    ]
+
+
+def png_bytes(seed: int = 0, size: int = 240) -> bytes:
+    """A small noisy RGB PNG (Pillow), so images cost real decode/encode work."""
+    import io
+
+    from PIL import Image
+
+    rng = random.Random(seed)
+    img = Image.frombytes("RGB", (size, size), bytes(rng.getrandbits(8) for _ in range(size * size * 3)))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def write_pdf(path: str, pages: int, seed: int = 0, tables: int = 0, images: int = 0) -> str:
+    """A ``pages``-page text PDF, three paragraphs per page.
+
+    ``tables`` / ``images`` are per page: ruled grids of text (what
+    pdfplumber's layout analysis works hardest on) and embedded PNGs.
+    """
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    body = paragraphs(pages * 3, seed)
+    image = png_bytes(seed) if images else None
+    for p in range(pages):
+        page = doc.new_page()
+        width, height = page.rect.width, page.rect.height
+        # Text takes the upper half when there are tables/images, the rest is split between them.
+        usable = height - 108
+        text_h = usable / 2 if tables or images else usable
+        block_h = (usable - text_h) / max(tables + images, 1)
+        top = 54
+        spare = page.insert_textbox(
+            fitz.Rect(54, top, width - 54, top + text_h),
+            "\n\n".join(body[p * 3:p * 3 + 3]),
+            fontsize=9,
+        )
+        if spare < 0:  # PyMuPDF writes nothing when the text does not fit
+            raise ValueError("page text does not fit; lower the paragraph size")
+        top += text_h
+        for t in range(tables):
+            rows = table_rows(8, seed=seed * 1000 + p * 10 + t)
+            row_h = min(14.0, block_h / len(rows))
+            col_w = (width - 108) / len(rows[0])
+            for r, row in enumerate(rows):
+                for c, cell in enumerate(row):
+                    rect = fitz.Rect(54 + c * col_w, top + r * row_h, 54 + (c + 1) * col_w, top + (r + 1) * row_h)
+                    page.draw_rect(rect, width=0.5)
+                    page.insert_textbox(rect + (2, 1, -2, 0), cell, fontsize=7)
+            top += block_h
+        for _ in range(images):
+            side = min(block_h - 6, 160)
+            page.insert_image(fitz.Rect(54, top, 54 + side, top + side), stream=image)
+            top += block_h
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def write_docx(path: str, pages: int, seed: int = 0, tables: int = 0, images: int = 0) -> str:
+    """About ``pages`` pages of DOCX (FileService treats ~20 paragraphs as a page).
+
+    ``tables`` / ``images`` are per page, as in ``write_pdf``.
+    """
+    import io
+
+    from docx import Document
+    from docx.shared import Inches
+
+    doc = Document()
+    body = paragraphs(pages * 20, seed, words_per_paragraph=30)
+    image = png_bytes(seed) if images else None
+    for p in range(pages):
+        doc.add_heading(f"Chapter {p + 1}", level=2)
+        for text in body[p * 20:(p + 1) * 20]:
+            doc.add_paragraph(text)
+        for t in range(tables):
+            rows = table_rows(8, seed=seed * 1000 + p * 10 + t)
+            table = doc.add_table(rows=len(rows), cols=len(rows[0]))
+            for r, row in enumerate(rows):
+                for c, cell in enumerate(row):
+                    table.cell(r, c).text = cell
+        for _ in range(images):
+            doc.add_picture(io.BytesIO(image), width=Inches(2))
+    doc.save(path)
+    return path
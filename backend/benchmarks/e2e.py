@@ -0,0 +1,311 @@
+"""End-to-end API benchmark on a fake, deterministic LLM/embedding provider.
+
+Runs the real FastAPI app in-process (ASGI client, throwaway SQLite and
+Chroma) on the OpenAI code path, with ``benchmarks.fake_provider`` standing
+in for the OpenAI and embedding clients, so latency and throughput of our
+own code (agentic loop, router, limiter, breakers included) can be measured
+without API keys.
+Scenarios, in order:
+
+  index            POST /sessions/{id}/documents   (synthetic PDF, sync path)
+  messages         POST /sessions/{id}/messages    (SSE, search + answer)
+  messages_cards   POST /sessions/{id}/messages    (SSE, flashcards tool)
+  flashcards       POST /flashcards/generate
+  quiz             POST /quiz/generate
+  flashcards_due   GET  /flashcards/due            (cards from messages_cards, made due)
+
+Each reports p50/p95/p99/mean/max latency (ms), throughput (req/s) and
+errors; the run reports RSS (current and peak, MiB). The JSON report is
+meant to be kept and compared: ``--baseline old.json`` prints the change.
+Only the report goes to stdout; logs and progress go to stderr, so
+``python -m benchmarks.e2e > report.json`` works.
+
+Usage (from backend/):
+    python -m benchmarks.e2e [--requests 20] [--concurrency 4] [--pages 20]
+        [--first-token-ms 300] [--tokens-per-sec 80] [--embed-batch-ms 40]
+        [--scenarios index,messages,...] [--output report.json] [--baseline old.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+_tmp = tempfile.mkdtemp(prefix="filegeek-e2e-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp}/bench.db")
+os.environ.setdefault("SYNC_DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("CHROMA_PATH", os.path.join(_tmp, "chroma"))
+os.environ.setdefault("UPLOAD_FOLDER", os.path.join(_tmp, "uploads"))
+# Fake OpenAI only: without Gemini keys nothing can fail over to a real provider.
+os.environ["AI_PROVIDER"] = "openai"
+os.environ["OPENAI_API_KEY"] = "bench"
+os.environ.pop("GOOGLE_API_KEY", None)
+os.environ.pop("GEMINI_API_KEY", None)
+os.environ.setdefault("JWT_SECRET", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+SCENARIOS = ("index", "messages", "messages_cards", "flashcards", "quiz", "flashcards_due")
+FAKE_CDN = "https://utfs.io/f/"
+
+
+def _rss_mib() -> dict:
+    with open("/proc/self/statm") as f:
+        current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"current": round(current / 2**20, 1), "peak": round(peak_kib / 1024, 1)}
+
+
+def _summarize(latencies_ms, errors: int, wall_s: float, concurrency: int) -> dict:
+    ok = sorted(latencies_ms)
+    if len(ok) >= 2:
+        q = statistics.quantiles(ok, n=100, method="inclusive")
+        p50, p95, p99 = q[49], q[94], q[98]
+    else:
+        p50 = p95 = p99 = ok[0] if ok else 0.0
+    return {
+        "requests": len(ok) + errors,
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(len(ok) / wall_s, 2) if wall_s else 0.0,
+        "latency_ms": {
+            "p50": round(p50, 1), "p95": round(p95, 1), "p99": round(p99, 1),
+            "mean": round(statistics.fmean(ok), 1) if ok else 0.0,
+            "max": round(ok[-1], 1) if ok else 0.0,
+        },
+    }
+
+
+async def _measure(make_request, n: int, concurrency: int) -> dict:
+    """Run ``make_request(i)`` n times with at most ``concurrency`` in flight."""
+    sem = asyncio.Semaphore(concurrency)
+    latencies, errors = [], []
+
+    async def one(i):
+        async with sem:
+            start = time.perf_counter()
+            try:
+                r = await make_request(i)
+                ok = r.status_code < 400
+            except Exception as exc:  # a benchmark run should report, not die
+                ok, r = False, exc
+            elapsed = (time.perf_counter() - start) * 1000
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors.append(getattr(r, "status_code", repr(r)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    result = _summarize(latencies, len(errors), time.perf_counter() - start, concurrency)
+    if errors:
+        result["error_samples"] = [str(e) for e in errors[:3]]
+    return result
+
+
+async def _make_due(user_id: int) -> int:
+    """Schedule every generated card for the user as due yesterday."""
+    from sqlalchemy import select
+
+    from database import AsyncSessionLocal
+    from models_async import Flashcard, FlashcardProgress, StudySession
+
+    past = datetime.utcnow() - timedelta(days=1)
+    async with AsyncSessionLocal() as db:
+        cards = (await db.execute(
+            select(Flashcard).join(StudySession, StudySession.id == Flashcard.session_id)
+            .where(StudySession.user_id == user_id)
+        )).scalars().all()
+        db.add_all(
+            FlashcardProgress(
+                session_id=c.session_id, message_id=c.message_id, card_index=c.card_index,
+                card_front=c.front[:255], status="reviewing", ease_factor=2.5,
+                interval_days=1, review_count=1, next_review_date=past,
+            )
+            for c in cards
+        )
+        await db.commit()
+    return len(cards)
+
+
+async def _run(args) -> dict:
+    import httpx
+
+    import main
+    from benchmarks.corpus import write_pdf
+    from database import AsyncSessionLocal, engine, init_db
+    from models_async import User
+    from routers.auth import _create_access_token
+
+    # In-process only: no Celery dispatch, no rate limits, no network download.
+    main._celery_available = False
+    main.limiter.enabled = False
+    source_pdf = write_pdf(os.path.join(_tmp, "source.pdf"), args.pages)
+    main.rag_service.download = lambda url, filepath: shutil.copyfile(source_pdf, filepath)
+
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        user = User(name="Bench", email="bench@example.com", password_hash="x")
+        db.add(user)
+        await db.commit()
+    headers = {"Authorization": f"Bearer {_create_access_token(user)}"}
+
+    report = {"scenarios": {}}
+    rss = {"start": _rss_mib()}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", headers=headers, timeout=None
+    ) as client:
+        async def new_session(title):
+            r = await client.post("/sessions", json={"title": title})
+            return r.json()["session"]["id"]
+
+        # Sessions to index into; the message/generation scenarios spread over them.
+        n_index = args.index_requests
+        sessions = [await new_session(f"Bench {i}") for i in range(max(n_index, 1))]
+
+        async def index(i):
+            return await client.post(
+                f"/sessions/{sessions[i % len(sessions)]}/documents",
+                json={"url": f"{FAKE_CDN}bench-{i}.pdf", "name": f"bench-{i}.pdf"},
+            )
+
+        def message(question):
+            async def send(i):
+                async with client.stream(
+                    "POST", f"/sessions/{sessions[i % len(sessions)]}/messages", json={"question": question},
+                ) as r:
+                    async for _ in r.aiter_lines():
+                        pass
+                    return r
+            return send
+
+        def generate(path, body):
+            async def send(i):
+                return await client.post(path, json={**body, "session_id": sessions[i % len(sessions)]})
+            return send
+
+        async def due(i):
+            return await client.get("/flashcards/due", params={"limit": 100})
+
+        plan = {
+            "index": (index, n_index),
+            "messages": (message("Explain the role of enzymes in respiration"), args.requests),
+            "messages_cards": (message("Make flashcards about membrane transport"), args.requests),
+            "flashcards": (generate("/flashcards/generate", {"topic": "osmosis", "num_cards": 8}), args.requests),
+            "quiz": (generate("/quiz/generate", {"topic": "neurons", "num_questions": 5}), args.requests),
+            "flashcards_due": (due, args.requests),
+        }
+        if "index" not in args.scenarios:
+            # The other scenarios need indexed documents; index unmeasured.
+            for i in range(len(sessions)):
+                await index(i)
+        for name in args.scenarios:
+            if name == "index" and n_index == 0:
+                continue
+            if name == "flashcards_due":
+                report["due_cards"] = await _make_due(user.id)
+            make_request, n = plan[name]
+            report["scenarios"][name] = await _measure(make_request, n, args.concurrency)
+            print(f"  {name:<15} {json.dumps(report['scenarios'][name]['latency_ms'])}", file=sys.stderr)
+
+    rss["end"] = _rss_mib()
+    report["rss_mib"] = rss
+    report["provider_calls"] = dict(main.ai_service.calls)
+    await engine.dispose()
+    return report
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def _compare(report: dict, baseline: dict) -> None:
+    """Print per-scenario change against a previous report."""
+    print(f"\n{'scenario':<15} {'p50':>16} {'p95':>16} {'rps':>16}", file=sys.stderr)
+    for name, cur in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        cells = []
+        for new_v, old_v in (
+            (cur["latency_ms"]["p50"], old["latency_ms"]["p50"]),
+            (cur["latency_ms"]["p95"], old["latency_ms"]["p95"]),
+            (cur["throughput_rps"], old["throughput_rps"]),
+        ):
+            pct = (new_v - old_v) / old_v * 100 if old_v else 0.0
+            cells.append(f"{new_v:>8} ({pct:+5.1f}%)")
+        print(f"{name:<15} " + " ".join(cells), file=sys.stderr)
+
+
+def main():
+    # The app logs to stdout; keep the real stdout for the report and point
+    # everything else written to fd 1 (logging, warnings at exit) at stderr.
+    report_out = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    from benchmarks import fake_provider
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20, help="requests per scenario")
+    parser.add_argument("--index-requests", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=20, help="pages in the synthetic PDF")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--first-token-ms", type=float)
+    parser.add_argument("--tokens-per-sec", type=float)
+    parser.add_argument("--embed-batch-ms", type=float)
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    settings = fake_provider.install(
+        first_token_ms=args.first_token_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        embed_batch_ms=args.embed_batch_ms,
+    )
+    try:
+        report = asyncio.run(_run(args))
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+    report["meta"] = {
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "git": _git_revision(),
+        "python": platform.python_version(),
+        "pages": args.pages,
+        "fake_provider": vars(settings),
+    }
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out, file=report_out, flush=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            _compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
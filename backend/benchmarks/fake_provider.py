@@ -0,0 +1,240 @@
+"""Deterministic stand-in for the OpenAI API, for offline benchmarks.
+
+``FakeAIService`` is the real ``AIService`` (agentic loop, model router,
+provider limiter, circuit breakers, usage accounting) with only its clients
+replaced: ``FakeOpenAI`` / ``FakeAsyncOpenAI`` answer
+``chat.completions.create`` with ``ChatCompletion`` objects shaped like the
+API's, and ``FakeEmbeddings`` implements the LangChain embeddings interface
+used by Chroma. Nothing leaves the process; instead each call sleeps (or, on
+the async client, awaits) for a modelled provider latency:
+
+    LLM call       first_token_ms + output_tokens / tokens_per_sec
+    embeddings     embed_batch_ms per batch of 100 + embed_text_ms per text
+
+The fake model: offered tools and with no tool result in the conversation
+yet, it calls the forced tool (``tool_choice``) or ``search_documents``;
+otherwise it answers from the tool results and the question. Structured
+requests (``response_format``) get items shaped by the schema name. Outputs
+are a pure function of the inputs, so two runs do the same work.
+
+The benchmark runs on the OpenAI code path: set ``AI_PROVIDER=openai`` and
+``OPENAI_API_KEY`` (and unset the Gemini keys, so nothing can fail over to a
+real provider) before importing ``services.ai_service``, then call
+``install()`` before importing ``main`` so the module-level services are
+built on the fake.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings as LCEmbeddings
+from openai.types.chat import ChatCompletion
+
+from services import ai_service as _ai_service
+
+
+@dataclass
+class FakeSettings:
+    first_token_ms: float = 300.0
+    tokens_per_sec: float = 80.0
+    answer_tokens: int = 180
+    embed_batch_ms: float = 40.0
+    embed_text_ms: float = 0.5
+    dim: int = 256
+
+
+settings = FakeSettings()
+
+# Arguments the fake model passes when it calls a tool about ``question``.
+_TOOL_ARGS = {
+    "search_documents": lambda q: {"query": q, "n_results": 5},
+    "generate_flashcards": lambda q: {"topic": q, "num_cards": 10},
+    "generate_quiz": lambda q: {"topic": q, "num_questions": 5},
+    "create_study_guide": lambda q: {"topic": q},
+    "generate_visualization": lambda q: {"description": q},
+}
+
+
+def _sleep_ms(ms: float) -> None:
+    if ms > 0:
+        time.sleep(ms / 1000)
+
+
+async def _asleep_ms(ms: float) -> None:
+    if ms > 0:
+        await asyncio.sleep(ms / 1000)
+
+
+def _tokens(text: str) -> int:
+    return max(1, round(len(text.split()) * 1.3))
+
+
+def _generate_ms(output_tokens: int) -> float:
+    return settings.first_token_ms + output_tokens / settings.tokens_per_sec * 1000
+
+
+class FakeEmbeddings(LCEmbeddings):
+    """Hashed bag-of-words vectors: deterministic, and similar texts score as similar."""
+
+    def _vector(self, text: str) -> List[float]:
+        vec = [0.0] * settings.dim
+        for word in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+            vec[h % settings.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    @staticmethod
+    def _latency_ms(count: int) -> float:
+        return math.ceil(count / 100) * settings.embed_batch_ms + count * settings.embed_text_ms
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        _sleep_ms(self._latency_ms(len(texts)))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        _sleep_ms(self._latency_ms(1))
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await _asleep_ms(self._latency_ms(len(texts)))
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await _asleep_ms(self._latency_ms(1))
+        return self._vector(text)
+
+
+def _fake_items(schema_name: str, count: int, context: str) -> List[Dict]:
+    words = re.findall(r"[A-Za-z]{5,}", context) or ["concept"]
+    items = []
+    for i in range(count):
+        term = words[(i * 7) % len(words)]
+        if schema_name == "quiz":
+            items.append({
+                "question": f"Which statement best describes {term}?",
+                "options": [f"{term} option {k}" for k in range(4)],
+                "correct_index": i % 4,
+                "explanation": f"The document discusses {term} in this context.",
+            })
+        else:
+            items.append({
+                "front": f"What is {term}?",
+                "back": f"{term.capitalize()} is described in the document as " + " ".join(words[i:i + 12]),
+                "difficulty": ("easy", "medium", "hard")[i % 3],
+                "tags": [term],
+            })
+    return items
+
+
+def _content(message) -> str:
+    """Text of a request message (a dict, or a ChatCompletionMessage echoed back by the agentic loop)."""
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def _role(message) -> str:
+    return message.get("role", "") if isinstance(message, dict) else getattr(message, "role", "")
+
+
+def _complete(calls: Counter, model: str, messages: list, tools=None, tool_choice=None,
+              response_format=None, **_) -> tuple:
+    """The fake model's reply to one request: (ChatCompletion, output tokens)."""
+    prompt_tokens = sum(_tokens(_content(m)) for m in messages)
+    question = next((_content(m) for m in reversed(messages) if _role(m) == "user"), "")
+    message = {"role": "assistant", "content": None}
+    finish_reason = "stop"
+
+    if response_format:
+        calls["structured"] += 1
+        match = re.search(r"Generate (\d+)", question)
+        name = response_format["json_schema"]["name"]
+        message["content"] = json.dumps({"items": _fake_items(name, int(match.group(1)) if match else 5, question)})
+    elif tools and not any(_role(m) == "tool" for m in messages):
+        calls["tool_call"] += 1
+        name = tool_choice["function"]["name"] if isinstance(tool_choice, dict) else "search_documents"
+        message["tool_calls"] = [{
+            "id": f"call_{calls['tool_call']}", "type": "function",
+            "function": {"name": name, "arguments": json.dumps(_TOOL_ARGS[name](question))},
+        }]
+        finish_reason = "tool_calls"
+    else:
+        calls["answer"] += 1
+        results = [_content(m) for m in messages if _role(m) == "tool"]
+        words = " ".join(results or [question]).split()
+        n = int(settings.answer_tokens / 1.3)
+        message["content"] = " ".join(words[i % len(words)] for i in range(n)) if words else "No context."
+
+    output_tokens = _tokens(message["content"] or "") if message["content"] else 20
+    response = ChatCompletion.model_validate({
+        "id": f"fake-{sum(calls.values())}",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": output_tokens,
+            "total_tokens": prompt_tokens + output_tokens,
+        },
+    })
+    return response, output_tokens
+
+
+class FakeOpenAI:
+    """``OpenAI`` client stand-in: only ``chat.completions.create``."""
+
+    def __init__(self, calls: Counter):
+        def create(**kwargs):
+            response, output_tokens = _complete(calls, **kwargs)
+            _sleep_ms(_generate_ms(output_tokens))
+            return response
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+
+
+class FakeAsyncOpenAI:
+    """``AsyncOpenAI`` client stand-in: only ``chat.completions.create``."""
+
+    def __init__(self, calls: Counter):
+        async def create(**kwargs):
+            response, output_tokens = _complete(calls, **kwargs)
+            await _asleep_ms(_generate_ms(output_tokens))
+            return response
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+
+
+class FakeAIService(_ai_service.AIService):
+    def __init__(self):
+        self.provider = "openai"
+        self.calls = Counter()
+        self._openai_client_instance = FakeOpenAI(self.calls)
+        self._async_openai_client_instance = FakeAsyncOpenAI(self.calls)
+        self._gemini_configured = False
+        self.embeddings = _ai_service.TimedEmbeddings(FakeEmbeddings(), "openai", self.OPENAI_EMBEDDING_MODEL)
+
+    @property
+    def gemini_client(self):
+        raise RuntimeError("The benchmark provider fakes OpenAI only")
+
+
+def install(**overrides) -> FakeSettings:
+    """Swap ``AIService`` for the fake (before ``main`` is imported) and apply setting overrides."""
+    if _ai_service.AI_PROVIDER != "openai":
+        raise RuntimeError("Set AI_PROVIDER=openai before importing services.ai_service")
+    for name, value in overrides.items():
+        if value is not None:
+            setattr(settings, name, value)
+    _ai_service.AIService = FakeAIService
+    return settings
@@ -0,0 +1,152 @@
+"""Benchmark GET /flashcards/due against a user with many due cards.
+
+Seeds a throwaway SQLite database with one user, a handful of sessions and
+N due FlashcardProgress rows (default 10,000) spread over assistant messages
+that carry flashcards artifacts, then times the endpoint through an
+in-process ASGI client:
+
+  * cold  — first request; cards come only from artifacts_json, so the
+            endpoint backfills the normalized flashcards table in one batch
+  * warm  — subsequent requests read fronts/backs straight from the table
+
+Usage (from backend/):
+    python -m benchmarks.flashcards_due [--cards 10000] [--limit 500] [--runs 20]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+_tmp = tempfile.mkdtemp(prefix="filegeek-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp}/bench.db")
+os.environ.setdefault("SYNC_DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("CHROMA_PATH", os.path.join(_tmp, "chroma"))
+os.environ.setdefault("GOOGLE_API_KEY", "bench")
+os.environ.setdefault("JWT_SECRET", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+CARDS_PER_MESSAGE = 20
+SESSIONS = 10
+
+
+async def _seed(n_cards: int):
+    from database import AsyncSessionLocal, init_db
+    from models_async import ChatMessage, FlashcardProgress, StudySession, User
+
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        user = User(name="Bench", email="bench@example.com", password_hash="x")
+        db.add(user)
+        await db.flush()
+        sessions = [StudySession(user_id=user.id, title=f"Bench {i}") for i in range(SESSIONS)]
+        db.add_all(sessions)
+        await db.flush()
+
+        past = datetime.utcnow() - timedelta(days=1)
+        n_messages = (n_cards + CARDS_PER_MESSAGE - 1) // CARDS_PER_MESSAGE
+        for m in range(n_messages):
+            session = sessions[m % SESSIONS]
+            cards = [
+                {"front": f"Term {m}.{i}", "back": f"Definition of term {m}.{i} " * 8}
+                for i in range(CARDS_PER_MESSAGE)
+            ]
+            msg = ChatMessage(
+                session_id=session.id,
+                role="assistant",
+                content="Here are your flashcards.",
+                artifacts_json=json.dumps([{"artifact_type": "flashcards", "content": cards}]),
+            )
+            db.add(msg)
+            await db.flush()
+            for i, card in enumerate(cards):
+                if m * CARDS_PER_MESSAGE + i >= n_cards:
+                    break
+                db.add(FlashcardProgress(
+                    session_id=session.id,
+                    message_id=msg.id,
+                    card_index=i,
+                    card_front=card["front"],
+                    status="reviewing",
+                    next_review_date=past - timedelta(seconds=m * CARDS_PER_MESSAGE + i),
+                ))
+        await db.commit()
+        return user
+
+
+async def _run(n_cards: int, limit: int, runs: int):
+    import httpx
+    from main import app
+    from routers.auth import _create_access_token
+
+    t0 = time.perf_counter()
+    user = await _seed(n_cards)
+    seed_s = time.perf_counter() - t0
+    headers = {"Authorization": f"Bearer {_create_access_token(user)}"}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def fetch_all_pages():
+            offset, fetched = 0, 0
+            while True:
+                r = await client.get("/flashcards/due", params={"limit": limit, "offset": offset}, headers=headers)
+                r.raise_for_status()
+                body = r.json()
+                fetched += len(body["due"])
+                assert all(row["card_back"] for row in body["due"]), "missing card_back"
+                if not body["has_more"]:
+                    return fetched
+                offset += limit
+
+        t = time.perf_counter()
+        cold_cards = await fetch_all_pages()
+        cold_s = time.perf_counter() - t
+
+        first_page, all_pages = [], []
+        for _ in range(runs):
+            t = time.perf_counter()
+            r = await client.get("/flashcards/due", params={"limit": limit}, headers=headers)
+            r.raise_for_status()
+            first_page.append(time.perf_counter() - t)
+        for _ in range(max(1, runs // 5)):
+            t = time.perf_counter()
+            warm_cards = await fetch_all_pages()
+            all_pages.append(time.perf_counter() - t)
+
+    def ms(values):
+        values = sorted(values)
+        return {
+            "p50_ms": round(statistics.median(values) * 1000, 2),
+            "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 2),
+        }
+
+    return {
+        "cards": n_cards,
+        "limit": limit,
+        "seed_s": round(seed_s, 2),
+        "cold_all_pages_ms": round(cold_s * 1000, 2),
+        "cold_cards": cold_cards,
+        "warm_first_page": ms(first_page),
+        "warm_all_pages": {**ms(all_pages), "cards": warm_cards},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=10_000)
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    try:
+        print(json.dumps(asyncio.run(_run(args.cards, args.limit, args.runs)), indent=2))
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""Ingestion micro-benchmarks: extraction and chunking on a synthetic corpus.
+
+Times the code the Celery indexing task runs before anything is embedded:
+
+  extract   FileService.extract_text_universal (pdfplumber for PDF,
+            python-docx for DOCX, the ~2000-char splitter for TXT)
+  chunk     FileService.chunking_function_with_pages on the extracted pages
+
+over deterministic documents from ``benchmarks.corpus``. By default each
+format is run plain and, for PDF/DOCX, "rich" (``--tables`` tables and
+``--images`` images per page). Every stage reports the median of
+``--repeat`` runs as pages/sec, chunks/sec and MB/s, plus the peak Python
+heap (tracemalloc, measured in a separate untimed pass).
+
+Throughput is also reported normalized by a fixed pure-Python calibration
+loop, so reports from different machines are comparable. ``--check
+baseline.json`` fails (exit 1) when a normalized throughput drops, or a peak
+heap grows, by more than ``--tolerance``; CI runs it against the committed
+``benchmarks/ingestion_baseline.json``.
+
+Usage (from backend/):
+    python -m benchmarks.ingestion [--pages 20] [--tables 1] [--images 1]
+        [--repeat 5] [--formats pdf,docx,txt] [--output report.json]
+        [--check benchmarks/ingestion_baseline.json] [--tolerance 0.5]
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks import corpus
+
+FORMATS = ("pdf", "docx", "txt")
+# Peak-heap growth below this is noise, whatever the relative change.
+MEMORY_SLACK_MIB = 2.0
+
+
+def _calibrate(rounds: int = 5) -> float:
+    """Seconds for a fixed string/dict workload (best of ``rounds``); the machine-speed unit."""
+    words = corpus.paragraphs(40, seed=99)
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        counts = {}
+        for _ in range(25):
+            for text in words:
+                for word in text.lower().split():
+                    counts[word] = counts.get(word, 0) + 1
+                "\n".join(text.split(". ")).splitlines()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _build_cases(args, workdir: str) -> list:
+    writers = {"pdf": corpus.write_pdf, "docx": corpus.write_docx, "txt": corpus.write_txt}
+    cases = []
+    for fmt in args.formats:
+        variants = [("", {})]
+        if fmt != "txt" and (args.tables or args.images):
+            variants.append(("_rich", {"tables": args.tables, "images": args.images}))
+        for suffix, extra in variants:
+            path = os.path.join(workdir, f"{fmt}{suffix}.{fmt}")
+            writers[fmt](path, args.pages, **extra)
+            cases.append({"name": f"{fmt}{suffix}", "path": path, "format": fmt, **extra})
+    return cases
+
+
+def _peak_heap_mib(fn) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 2**20, 2)
+
+
+def _run_case(service, case: dict, repeat: int, calibration_s: float) -> dict:
+    path = case["path"]
+    pages = service.extract_text_universal(path)
+    if not pages:
+        raise RuntimeError(f"{case['name']}: extraction returned nothing")
+    chunks = service.chunking_function_with_pages(pages)
+    size_mb = os.path.getsize(path) / 2**20
+
+    def timed(fn):
+        samples = []
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+        return statistics.median(samples)
+
+    extract_s = timed(lambda: service.extract_text_universal(path))
+    chunk_s = timed(lambda: service.chunking_function_with_pages(pages))
+
+    def stage(seconds, units, unit_name, extra=None):
+        rate = units / seconds if seconds else 0.0
+        return {
+            "median_ms": round(seconds * 1000, 2),
+            f"{unit_name}_per_sec": round(rate, 1),
+            # Units per calibration-loop duration: stable across machines.
+            "normalized": round(rate * calibration_s, 3),
+            **(extra or {}),
+        }
+
+    return {
+        "format": case["format"],
+        "tables_per_page": case.get("tables", 0),
+        "images_per_page": case.get("images", 0),
+        "file_mb": round(size_mb, 3),
+        "pages": len(pages),
+        "chunks": len(chunks),
+        "extract": {
+            **stage(extract_s, len(pages), "pages", {"mb_per_sec": round(size_mb / extract_s, 2)}),
+            "peak_heap_mib": _peak_heap_mib(lambda: service.extract_text_universal(path)),
+        },
+        "chunk": {
+            **stage(chunk_s, len(chunks), "chunks"),
+            "peak_heap_mib": _peak_heap_mib(lambda: service.chunking_function_with_pages(pages)),
+        },
+    }
+
+
+def _check(report: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of ``report`` against ``baseline``, as printable strings."""
+    failures = []
+    if baseline.get("meta", {}).get("pages") != report["meta"]["pages"]:
+        print("  baseline was recorded with a different --pages; sizes may not match", file=sys.stderr)
+    for name, cur in report["cases"].items():
+        old = baseline.get("cases", {}).get(name)
+        if not old:
+            print(f"  {name}: not in baseline, skipped", file=sys.stderr)
+            continue
+        for stage in ("extract", "chunk"):
+            new_s, old_s = cur[stage], old[stage]
+            floor = old_s["normalized"] * (1 - tolerance)
+            if new_s["normalized"] < floor:
+                failures.append(
+                    f"{name}.{stage}: normalized throughput {new_s['normalized']} < {floor:.3f} "
+                    f"(baseline {old_s['normalized']})"
+                )
+            ceiling = max(old_s["peak_heap_mib"] * (1 + tolerance), old_s["peak_heap_mib"] + MEMORY_SLACK_MIB)
+            if new_s["peak_heap_mib"] > ceiling:
+                failures.append(
+                    f"{name}.{stage}: peak heap {new_s['peak_heap_mib']} MiB > {ceiling:.2f} MiB "
+                    f"(baseline {old_s['peak_heap_mib']})"
+                )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=20, help="pages per synthetic document")
+    parser.add_argument("--tables", type=int, default=1, help="tables per page in the rich PDF/DOCX")
+    parser.add_argument("--images", type=int, default=1, help="images per page in the rich PDF/DOCX")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage (median is kept)")
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--check", help="baseline JSON report; exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed fractional drop in throughput / growth in peak heap")
+    args = parser.parse_args()
+    args.formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    unknown = set(args.formats) - set(FORMATS)
+    if unknown:
+        parser.error(f"unknown formats: {', '.join(sorted(unknown))}")
+
+    # Extractor failures are raised below; their log lines are just noise here.
+    logging.getLogger("services.file_service").setLevel(logging.CRITICAL)
+    logging.getLogger("pdfminer").setLevel(logging.ERROR)
+    from services.file_service import FileService
+
+    service = FileService()
+    calibration_s = _calibrate()
+    workdir = tempfile.mkdtemp(prefix="filegeek-ingest-")
+    cases = {}
+    try:
+        for case in _build_cases(args, workdir):
+            cases[case["name"]] = result = _run_case(service, case, args.repeat, calibration_s)
+            print(
+                f"  {case['name']:<10} extract {result['extract']['pages_per_sec']:>8} pages/s "
+                f"{result['extract']['peak_heap_mib']:>7} MiB | chunk "
+                f"{result['chunk']['chunks_per_sec']:>9} chunks/s {result['chunk']['peak_heap_mib']:>6} MiB",
+                file=sys.stderr,
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "cases": cases,
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "pages": args.pages,
+            "tables": args.tables,
+            "images": args.images,
+            "repeat": args.repeat,
+            "calibration_ms": round(calibration_s * 1000, 3),
+            "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+    }
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+    if args.check:
+        with open(args.check) as f:
+            failures = _check(report, json.load(f), args.tolerance)
+        for line in failures:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+        print(f"No ingestion regressions against {args.check}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,38 @@ import os
 
 from celery import Celery, Task
 from dotenv import load_dotenv
+from kombu import Queue
 
 load_dotenv()
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
+# ── Queues ─────────────────────────────────────────────────────────────────────
+# Chat answers, document indexing and deferrable background work are kept on
+# separate queues so a burst of uploads never sits in front of a chat reply.
+# Run one worker per queue to give each its own concurrency, e.g.
+#   celery -A celery_app.celery_app worker -Q interactive --concurrency=$CELERY_INTERACTIVE_CONCURRENCY
+#   celery -A celery_app.celery_app worker -Q indexing    --concurrency=$CELERY_INDEXING_CONCURRENCY
+#   celery -A celery_app.celery_app worker -Q maintenance --concurrency=$CELERY_MAINTENANCE_CONCURRENCY
+# A worker started without -Q consumes all three (single-worker deployments).
+INTERACTIVE_QUEUE = "interactive"
+INDEXING_QUEUE = "indexing"
+MAINTENANCE_QUEUE = "maintenance"
+
+TASK_ROUTES = {
+    # Exact names are matched before glob patterns.
+    "tasks.document_tasks.build_document_digest_task": {"queue": MAINTENANCE_QUEUE},
+    "tasks.message_tasks.*": {"queue": INTERACTIVE_QUEUE},
+    "tasks.document_tasks.*": {"queue": INDEXING_QUEUE},
+}
+
+# Redis transport priorities: 0 is served first. Short pipeline stages jump
+# ahead of embedding fan-out so a second user's upload starts promptly even
+# while a large document's batches are queued.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 3
+PRIORITY_BULK = 6
+
 
 def make_celery(app=None):
     """Create a Celery instance that runs tasks inside the Flask app context."""
@@ -37,10 +64,30 @@ def make_celery(app=None):
         task_acks_late=True,
         worker_prefetch_multiplier=1,
         broker_connection_retry_on_startup=True,
+        task_queues=(
+            Queue(INTERACTIVE_QUEUE),
+            Queue(INDEXING_QUEUE),
+            Queue(MAINTENANCE_QUEUE),
+        ),
+        task_default_queue=INTERACTIVE_QUEUE,
+        task_routes=TASK_ROUTES,
+        task_default_priority=PRIORITY_NORMAL,
+        broker_transport_options={
+            "priority_steps": list(range(10)),
+            "sep": ":",
+            "queue_order_strategy": "priority",
+        },
     )
 
     celery.autodiscover_tasks(["tasks"])
 
+    from utils.metrics import install_celery_metrics
+    install_celery_metrics()
+    from tracing import install_celery_tracing
+    install_celery_tracing()
+    from services.usage import install_celery_usage
+    install_celery_usage()
+
     return celery
 
 
@@ -48,6 +95,68 @@ def make_celery(app=None):
 celery_app = make_celery()
 
 
+class PerUserSlots:
+    """Per-user cap on concurrently running work of one kind (Redis counter).
+
+    ``acquire`` returns False when the user already holds ``limit`` slots; the
+    caller re-queues itself with a countdown so other users' work is served in
+    the meantime. Keys expire ``ttl`` seconds after the first slot is taken so
+    a crashed worker cannot leak a slot forever. ``release_once`` releases a
+    slot at most once per token (e.g. a pipeline id), for work whose several
+    tasks may each report the end. Fails open when Redis is unreachable.
+    """
+
+    def __init__(self, name, limit, ttl=3600):
+        self.name = name
+        self.limit = limit
+        self.ttl = ttl
+        self._redis = None
+
+    def _client(self):
+        if self._redis is None:
+            import redis
+            self._redis = redis.from_url(REDIS_URL)
+        return self._redis
+
+    def _key(self, user_id):
+        return f"slots:{self.name}:{user_id}"
+
+    def acquire(self, user_id):
+        if self.limit <= 0:
+            return True
+        try:
+            r = self._client()
+            key = self._key(user_id)
+            held = r.incr(key)
+            if held == 1:
+                r.expire(key, self.ttl)
+            if held > self.limit:
+                r.decr(key)
+                return False
+            return True
+        except Exception:
+            return True
+
+    def release(self, user_id):
+        try:
+            r = self._client()
+            key = self._key(user_id)
+            if r.decr(key) <= 0:
+                r.delete(key)
+        except Exception:
+            pass
+
+    def release_once(self, user_id, token):
+        """Release the slot held by ``token``; later calls with the same token do nothing."""
+        try:
+            if not self._client().set(f"{self._key(user_id)}:released:{token}", 1, nx=True, ex=self.ttl):
+                return False
+        except Exception:
+            return False
+        self.release(user_id)
+        return True
+
+
 def init_celery(app):
     """Attach Flask app context to an existing Celery instance."""
     celery_app.Task = type(
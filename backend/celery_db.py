@@ -4,14 +4,20 @@ import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-SYNC_DATABASE_URL = os.getenv(
-    "SYNC_DATABASE_URL",
-    "sqlite:///./instance/users.db",
+from database import engine_options, install_sqlite_pragmas, normalize_database_url
+
+# Defaults to the API's DATABASE_URL with the sync driver (pysqlite / psycopg).
+SYNC_DATABASE_URL = normalize_database_url(
+    os.getenv("SYNC_DATABASE_URL")
+    or os.getenv("DATABASE_URL", "sqlite:///./instance/users.db"),
+    is_async=False,
 )
 
 sync_engine = create_engine(
     SYNC_DATABASE_URL,
-    connect_args={"check_same_thread": False},
+    **engine_options(SYNC_DATABASE_URL, is_async=False),
 )
 
+install_sqlite_pragmas(sync_engine)
+
 SyncSession = sessionmaker(bind=sync_engine, expire_on_commit=False)
@@ -48,6 +48,87 @@ class Config:
     NUM_RETRIEVAL_CHUNKS = int(os.getenv("NUM_RETRIEVAL_CHUNKS", "5"))
     DEEP_THINK_CHUNKS = int(os.getenv("DEEP_THINK_CHUNKS", "12"))
 
+    # Staged Celery indexing: per-document artifacts live under INDEX_WORK_DIR
+    # (must be shared by all indexing workers) until the store stage succeeds.
+    INDEX_WORK_DIR = os.getenv("INDEX_WORK_DIR", os.path.join(UPLOAD_FOLDER, "indexing"))
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+    # Fairness: max indexing pipelines one user may have running at once;
+    # extra uploads wait on the indexing queue and re-check after the delay.
+    INDEXING_MAX_PER_USER = int(os.getenv("INDEXING_MAX_PER_USER", "2"))
+    INDEXING_FAIRNESS_RETRY_SECONDS = int(os.getenv("INDEXING_FAIRNESS_RETRY_SECONDS", "15"))
+    # Socket.IO progress events for one task are coalesced to at most one per interval
+    PROGRESS_MIN_INTERVAL_MS = int(os.getenv("PROGRESS_MIN_INTERVAL_MS", "250"))
+
+    # Request-path caches (authenticated user snapshots, session ownership). With
+    # CACHE_REDIS_ENABLED entries and invalidations are shared across API processes.
+    USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+    SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "300"))
+    CACHE_REDIS_ENABLED = os.getenv("CACHE_REDIS_ENABLED", "false").lower() == "true"
+
+    # Document digests (outline + section summaries + key terms built after indexing)
+    DOCUMENT_DIGESTS_ENABLED = os.getenv("DOCUMENT_DIGESTS_ENABLED", "false").lower() == "true"
+    DIGEST_CHUNKS_PER_CALL = int(os.getenv("DIGEST_CHUNKS_PER_CALL", "30"))
+
+    # Prometheus (/metrics). With METRICS_TOKEN set, scrapes must send
+    # "Authorization: Bearer <token>". Workers on other hosts push to a
+    # Pushgateway; see utils/metrics.py for the multiprocess setup.
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+    PROMETHEUS_PUSHGATEWAY_URL = os.getenv("PROMETHEUS_PUSHGATEWAY_URL", "")
+    PROMETHEUS_PUSH_INTERVAL = float(os.getenv("PROMETHEUS_PUSH_INTERVAL", "15"))
+
+    # OpenTelemetry tracing (see tracing.py): none | console | file | otlp.
+    # The file exporter writes JSON lines; "{pid}" keeps worker processes apart.
+    TRACING_EXPORTER = os.getenv("OTEL_TRACES_EXPORTER", "none").lower()
+    TRACING_FILE = os.getenv("OTEL_TRACES_FILE", "traces/traces-{pid}.jsonl")
+    TRACING_SAMPLE_RATIO = float(os.getenv("OTEL_TRACES_SAMPLER_ARG", "1.0"))
+
+    # Token usage accounting (services/usage.py). Budgets are per user; 0 disables.
+    # MODEL_PRICES overrides the built-in USD per 1M tokens:
+    #   {"gpt-4o": [2.5, 10.0], "my-model": [0.1, 0.4]}   (input, output)
+    USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))
+    USAGE_DAILY_TOKEN_BUDGET = int(os.getenv("USAGE_DAILY_TOKEN_BUDGET", "0"))
+    USAGE_MONTHLY_COST_BUDGET_USD = float(os.getenv("USAGE_MONTHLY_COST_BUDGET_USD", "0"))
+    MODEL_PRICES = os.getenv("MODEL_PRICES", "")
+    # Provider limiter (services/provider_limits.py): per provider:model and lane,
+    # concurrent calls and tokens per minute (0 = unlimited), and the longest a
+    # call may queue. Calls from LLM_BACKGROUND_FEATURES use the background lane.
+    # LLM_LIMITS overrides per model: {"openai:gpt-4o": {"interactive_tpm": 400000}}
+    LLM_LIMITS_ENABLED = os.getenv("LLM_LIMITS_ENABLED", "true").lower() == "true"
+    LLM_INTERACTIVE_CONCURRENCY = int(os.getenv("LLM_INTERACTIVE_CONCURRENCY", "16"))
+    LLM_INTERACTIVE_TPM = int(os.getenv("LLM_INTERACTIVE_TPM", "0"))
+    LLM_INTERACTIVE_MAX_WAIT = float(os.getenv("LLM_INTERACTIVE_MAX_WAIT", "15"))
+    LLM_BACKGROUND_CONCURRENCY = int(os.getenv("LLM_BACKGROUND_CONCURRENCY", "4"))
+    LLM_BACKGROUND_TPM = int(os.getenv("LLM_BACKGROUND_TPM", "0"))
+    LLM_BACKGROUND_MAX_WAIT = float(os.getenv("LLM_BACKGROUND_MAX_WAIT", "120"))
+    LLM_BACKGROUND_FEATURES = set(os.getenv("LLM_BACKGROUND_FEATURES", "indexing,digest,memory").split(","))
+    LLM_LIMITS = os.getenv("LLM_LIMITS", "")
+    # Share the limits across processes through Redis (REDIS_URL); falls back to local limits.
+    LLM_LIMITS_REDIS = os.getenv("LLM_LIMITS_REDIS", "false").lower() == "true"
+    # Pause a lane this long after a provider 429 without a Retry-After header.
+    LLM_RATE_LIMIT_COOLDOWN = float(os.getenv("LLM_RATE_LIMIT_COOLDOWN", "5"))
+    # Circuit breakers (services/provider_health.py): a provider:model whose error
+    # rate over the window reaches the threshold fails fast for LLM_BREAKER_OPEN_SECONDS,
+    # and answers fail over to the other provider when its API key is configured.
+    LLM_BREAKER_ENABLED = os.getenv("LLM_BREAKER_ENABLED", "true").lower() == "true"
+    LLM_BREAKER_WINDOW = float(os.getenv("LLM_BREAKER_WINDOW", "60"))
+    LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+    LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+    LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+    LLM_FAILOVER_ENABLED = os.getenv("LLM_FAILOVER_ENABLED", "true").lower() == "true"
+    # Hedged requests: interactive calls still running after the model's p95 latency
+    # (at least LLM_HEDGE_MIN_DELAY seconds) fire a second identical call; first wins.
+    LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true"
+    LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+    # Chat model routing (services/model_router.py): off | shadow | on. Shadow logs what
+    # the router would pick without changing models; on sends easy chat requests to the
+    # fast model (OPENAI_FAST_MODEL / GEMINI_FAST_MODEL) and escalates on weak retrieval.
+    MODEL_ROUTING = os.getenv("MODEL_ROUTING", "shadow").lower()
+    MODEL_ROUTING_THRESHOLD = float(os.getenv("MODEL_ROUTING_THRESHOLD", "0.3"))
+    MODEL_ROUTING_MIN_RELEVANCE = float(os.getenv("MODEL_ROUTING_MIN_RELEVANCE", "0.4"))
+
+    # Comma-separated emails allowed to use the /admin endpoints.
+    ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+
     # Audio
     ALLOWED_AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.webm', '.ogg'}
 
@@ -1,14 +1,100 @@
-"""Async SQLAlchemy engine and session factory for FastAPI."""
+"""Async SQLAlchemy engine and session factory for FastAPI.
+
+Two profiles, picked from the URL scheme:
+
+* SQLite (default, single node) — aiosqlite, WAL journal and the tuned
+  pragmas in ``apply_sqlite_pragmas`` on every new connection.
+* PostgreSQL (production) — asyncpg here, psycopg for the Celery workers
+  (``celery_db.py``), with a sized connection pool and statement caching.
+  ``postgres://`` / ``postgresql://`` URLs are mapped to those drivers.
+"""
 
 import os
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import text
 
-DATABASE_URL = os.getenv(
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+_SYNC_DRIVERS = {"sqlite": "sqlite", "postgresql": "postgresql+psycopg"}
+
+
+def normalize_database_url(url: str, is_async: bool = True) -> str:
+    """Swap in the driver this tier uses (asyncpg/aiosqlite or psycopg/pysqlite)."""
+    if url.startswith("postgres://"):  # Heroku/Render style
+        url = "postgresql://" + url[len("postgres://"):]
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    drivers = _ASYNC_DRIVERS if is_async else _SYNC_DRIVERS
+    if backend in drivers:
+        parsed = parsed.set(drivername=drivers[backend])
+    if is_async and backend == "postgresql" and "sslmode" in parsed.query:
+        # libpq's sslmode is spelled "ssl" by asyncpg
+        query = dict(parsed.query)
+        query["ssl"] = query.pop("sslmode")
+        parsed = parsed.set(query=query)
+    return parsed.render_as_string(hide_password=False)
+
+
+def is_sqlite_url(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+# Applied to every new SQLite connection (API and workers). Sizes are per connection.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # durable with WAL except across power loss; far fewer fsyncs
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),  # negative = KiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+}
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def install_sqlite_pragmas(sync_engine) -> None:
+    """Register the pragma hook on a (sync or AsyncEngine.sync_engine) SQLite engine."""
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", apply_sqlite_pragmas)
+
+
+def engine_options(url: str, is_async: bool = True) -> dict:
+    """create_engine kwargs for the URL's backend; pool settings come from DB_* env vars."""
+    if is_sqlite_url(url):
+        return {"connect_args": {"check_same_thread": False}}
+
+    statement_cache = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+    options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_pre_ping": True,
+    }
+    # Server-side prepared statements. Set DB_STATEMENT_CACHE_SIZE=0 behind
+    # PgBouncer in transaction mode, which cannot keep them across transactions.
+    if is_async:
+        options["connect_args"] = {
+            "prepared_statement_cache_size": statement_cache,
+            "statement_cache_size": statement_cache,
+        }
+    else:
+        options["connect_args"] = {"prepare_threshold": 5 if statement_cache else None}
+    return options
+
+
+DATABASE_URL = normalize_database_url(os.getenv(
     "DATABASE_URL",
     "sqlite+aiosqlite:///./instance/users.db",
-)
+))
 
 
 class Base(DeclarativeBase):
@@ -17,10 +103,12 @@ class Base(DeclarativeBase):
 
 engine = create_async_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False},
     echo=False,
+    **engine_options(DATABASE_URL),
 )
 
+install_sqlite_pragmas(engine.sync_engine)
+
 AsyncSessionLocal = async_sessionmaker(
     engine,
     expire_on_commit=False,
@@ -33,10 +121,16 @@ async def get_db():
         yield session
 
 
+def _create_missing_indexes(sync_conn, metadata) -> None:
+    """create_all only builds indexes with new tables; add any missing on existing ones."""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
 async def init_db():
-    """Create all tables and enable WAL mode for SQLite."""
+    """Create all tables and indexes (SQLite pragmas are applied per connection)."""
     async with engine.begin() as conn:
-        if DATABASE_URL.startswith("sqlite"):
-            await conn.execute(text("PRAGMA journal_mode=WAL"))
         from models_async import Base as ModelsBase  # noqa: F401
         await conn.run_sync(ModelsBase.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes, ModelsBase.metadata)
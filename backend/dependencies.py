@@ -1,7 +1,9 @@
 """FastAPI dependency injection: get_current_user, get_db."""
 
+import json
 import os
-from typing import Annotated
+from dataclasses import asdict, dataclass
+from typing import Annotated, Optional
 
 import jwt as pyjwt
 from fastapi import Depends, HTTPException, status
@@ -9,18 +11,53 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
+from config import Config
 from database import get_db
-from models_async import User
+from models_async import StudySession, User
+from services.usage import budget_exceeded, budgets_enabled, get_user_usage
+from utils.cache import TTLCache
 
 JWT_SECRET = os.getenv("JWT_SECRET", os.getenv("SECRET_KEY", "change-me-in-production"))
 
 _bearer = HTTPBearer(auto_error=True)
 
 
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Detached, read-only view of the authenticated user (safe to cache across requests)."""
+
+    id: int
+    name: str
+    email: str
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(id=user.id, name=user.name, email=user.email)
+
+
+user_cache = TTLCache(
+    "auth_user",
+    ttl=Config.USER_CACHE_TTL_SECONDS,
+    redis_url=Config.REDIS_URL if Config.CACHE_REDIS_ENABLED else None,
+    dumps=lambda u: json.dumps(asdict(u)),
+    loads=lambda raw: UserSnapshot(**json.loads(raw)),
+)
+
+
+async def cache_user(user: User) -> None:
+    """Prime the auth cache with a freshly loaded user (login, refresh)."""
+    await user_cache.set(str(user.id), UserSnapshot.from_user(user))
+
+
+async def invalidate_user(user_id: int) -> None:
+    """Drop a cached user; call after changing or deleting the user row, and on logout."""
+    await user_cache.delete(str(user_id))
+
+
 async def get_current_user(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(_bearer)],
     db: Annotated[AsyncSession, Depends(get_db)],
-) -> User:
+) -> UserSnapshot:
     token = credentials.credentials
     try:
         payload = pyjwt.decode(token, JWT_SECRET, algorithms=["HS256"])
@@ -39,15 +76,114 @@ async def get_current_user(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload"
         )
 
+    cached = await user_cache.get(str(user_id))
+    if cached is not None:
+        return cached
+
     result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalar_one_or_none()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found"
         )
-    return user
+    snapshot = UserSnapshot.from_user(user)
+    await user_cache.set(str(user_id), snapshot)
+    return snapshot
 
 
 # Convenience type aliases
-CurrentUser = Annotated[User, Depends(get_current_user)]
+CurrentUser = Annotated[UserSnapshot, Depends(get_current_user)]
+
+
+async def get_admin_user(current_user: CurrentUser) -> UserSnapshot:
+    """The caller, if their email is listed in ADMIN_EMAILS; 403 otherwise."""
+    if current_user.email.lower() not in Config.ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+
+AdminUser = Annotated[UserSnapshot, Depends(get_admin_user)]
+
+
+async def enforce_usage_budget(
+    current_user: CurrentUser,
+    db: Annotated[AsyncSession, Depends(get_db)],
+) -> None:
+    """429 before LLM work when the caller is over a token or cost budget (route dependency)."""
+    if not budgets_enabled():
+        return
+    reason = budget_exceeded(await get_user_usage(db, current_user.id))
+    if reason:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=reason)
+
+
+WithinBudget = Depends(enforce_usage_budget)
+
+
+# ── Session ownership ─────────────────────────────────────────────────────────
+
+@dataclass(frozen=True)
+class SessionRef:
+    """Proof that ``user_id`` owns study session ``id``, plus the fields handlers read."""
+
+    id: str
+    user_id: int
+    persona: str
+
+
+session_cache = TTLCache(
+    "session_owner",
+    ttl=Config.SESSION_CACHE_TTL_SECONDS,
+    redis_url=Config.REDIS_URL if Config.CACHE_REDIS_ENABLED else None,
+    dumps=lambda ref: json.dumps(asdict(ref)),
+    loads=lambda raw: SessionRef(**json.loads(raw)),
+)
+
+
+def _session_key(session_id: str, user_id: int) -> str:
+    return f"{user_id}:{session_id}"
+
+
+async def cache_session(session: StudySession) -> SessionRef:
+    ref = SessionRef(id=session.id, user_id=session.user_id, persona=session.persona or "academic")
+    await session_cache.set(_session_key(session.id, session.user_id), ref)
+    return ref
+
+
+async def invalidate_session(session_id: str, user_id: int) -> None:
+    """Drop a cached ownership entry; call when a session is deleted or reassigned."""
+    await session_cache.delete(_session_key(session_id, user_id))
+
+
+async def load_owned_session(db: AsyncSession, session_id: str, user_id: int) -> Optional[SessionRef]:
+    """Return a SessionRef if ``user_id`` owns ``session_id``, else None (cached across requests)."""
+    key = _session_key(session_id, user_id)
+    cached = await session_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = await db.execute(
+        select(StudySession).where(
+            StudySession.id == session_id, StudySession.user_id == user_id
+        )
+    )
+    session = result.scalar_one_or_none()
+    if not session:
+        return None
+    return await cache_session(session)
+
+
+async def get_owned_session(
+    session_id: str,
+    current_user: CurrentUser,
+    db: Annotated[AsyncSession, Depends(get_db)],
+) -> SessionRef:
+    """Resolve the ``{session_id}`` path parameter to a session owned by the caller, or 404."""
+    ref = await load_owned_session(db, session_id, current_user.id)
+    if ref is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found")
+    return ref
+
+
+OwnedSession = Annotated[SessionRef, Depends(get_owned_session)]
 DB = Annotated[AsyncSession, Depends(get_db)]
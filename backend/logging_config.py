@@ -16,6 +16,17 @@ def _mask_pii_processor(logger, method_name, event_dict):
     return event_dict
 
 
+def _add_trace_context(logger, method_name, event_dict):
+    """structlog processor that tags events logged inside a traced span with its ids."""
+    from opentelemetry import trace
+
+    ctx = trace.get_current_span().get_span_context()
+    if ctx.is_valid:
+        event_dict["trace_id"] = format(ctx.trace_id, "032x")
+        event_dict["span_id"] = format(ctx.span_id, "016x")
+    return event_dict
+
+
 def configure_logging():
     """Set up structlog with JSON output in production, console in dev."""
     env = os.getenv("FLASK_ENV", "development")
@@ -28,6 +39,7 @@ def configure_logging():
         structlog.stdlib.add_logger_name,
         structlog.processors.TimeStamper(fmt="iso"),
         structlog.processors.StackInfoRenderer(),
+        _add_trace_context,
         _mask_pii_processor,
     ]
 
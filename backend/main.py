@@ -1,47 +1,79 @@
 """FileGeek FastAPI application — replaces app.py."""
 
 import asyncio
+import hmac
 import json
 import os
 import re
 import uuid
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
+from typing import Optional
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from fastapi import (
-    Depends, FastAPI, HTTPException, Request, Response, UploadFile,
+    Depends, FastAPI, HTTPException, Query, Request, Response, UploadFile,
     status,
 )
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
+from opentelemetry import trace
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
-from sqlalchemy import select
+from sqlalchemy import and_, delete, func, select, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer, selectinload
 
 from config import Config
-from database import get_db, init_db
+from database import engine, get_db, init_db
 from socket_manager import socket_app
-from dependencies import CurrentUser, DB, get_current_user
+from dependencies import (
+    AdminUser, CurrentUser, DB, OwnedSession, WithinBudget, cache_session,
+    get_current_user, invalidate_session, load_owned_session,
+)
 from models_async import (
-    ChatMessage, FlashcardProgress, QuizResult, SessionDocument, StudySession, User,
+    Artifact, ChatMessage, DocumentDigest, Flashcard, FlashcardProgress,
+    QuizResult, SessionDocument, StudySession, User,
 )
 from routers.auth import router as auth_router
 from schemas import (
     ChatMessageCreate, DocumentCreate, ExportRequest, FeedbackCreate,
-    FlashcardProgressCreate, NotionExportRequest, QuizResultCreate,
-    S3PresignRequest, SessionCreate, TTSRequest,
+    FlashcardProgressBulk, FlashcardProgressCreate, NotionExportRequest,
+    QuizResultCreate, S3PresignRequest, SessionCreate, TTSRequest,
 )
 from services.ai_service import AIService, PersonaManager
+from services.artifact_store import add_message_artifacts, load_artifact
+from services.digest_service import DigestService
 from services.file_service import FileService
+from services.flashcard_store import (
+    REVIEW_STATUSES, backfill_flashcards, sm2_review, upsert_review_results,
+)
 from services.rag_service import RAGService, MemoryService
 from services.tools import ToolExecutor
+from services.usage import (
+    USAGE_DIMENSIONS, USAGE_ORDERS, flush_usage, run_usage_flusher, usage_report,
+    usage_scope,
+)
+from services.user_stats import (
+    bump_user_stats, flashcard_status_deltas, get_user_stats, quiz_percent,
+    rebuild_user_stats,
+)
 from logging_config import get_logger
+from tracing import setup_api_tracing, shutdown_tracing
+from utils.cache import cache_stats
+from utils.metrics import (
+    CONTENT_TYPE_LATEST, PROMETHEUS_AVAILABLE, CeleryQueueCollector, observe_http,
+    register_scrape_collector, render_latest,
+)
+from utils.pagination import decode_cursor, encode_cursor, etag_json_response, parse_fields
+from utils.timing import (
+    current_timings, end_request_timings, run_in_thread, span, start_request_timings,
+)
+from write_queue import write_queue
 from utils.validators import InputValidator, check_prompt_injection
 
 logger = get_logger(__name__)
@@ -51,7 +83,8 @@ ai_service = AIService()
 file_service = FileService()
 rag_service = RAGService(ai_service, file_service)
 memory_service = MemoryService(ai_service)
-tool_executor = ToolExecutor(rag_service, ai_service)
+digest_service = DigestService(rag_service, ai_service)
+tool_executor = ToolExecutor(rag_service, ai_service, digest_service)
 
 UPLOAD_FOLDER = Config.UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -65,6 +98,14 @@ try:
 except Exception as exc:
     logger.warning("celery.unavailable", error=str(exc))
 
+if _celery_available:
+    register_scrape_collector(CeleryQueueCollector(
+        celery_app.conf.broker_url,
+        [q.name for q in celery_app.conf.task_queues],
+        celery_app.conf.broker_transport_options.get("priority_steps", [0]),
+        celery_app.conf.broker_transport_options.get("sep", ":"),
+    ))
+
 # ── Rate limiter (slowapi) ─────────────────────────────────────────────────────
 limiter = Limiter(key_func=get_remote_address)
 
@@ -74,7 +115,12 @@ limiter = Limiter(key_func=get_remote_address)
 async def lifespan(app: FastAPI):
     await init_db()
     logger.info("database.initialized")
+    usage_flusher = asyncio.create_task(run_usage_flusher(Config.USAGE_FLUSH_INTERVAL))
     yield
+    usage_flusher.cancel()
+    await flush_usage()
+    await write_queue.close()
+    shutdown_tracing()
 
 
 # ── FastAPI app ────────────────────────────────────────────────────────────────
@@ -96,6 +142,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ── Tracing (off unless OTEL_TRACES_EXPORTER is set) ──────────────────────────
+setup_api_tracing(app, engine)
+
 # ── Mount auth router ──────────────────────────────────────────────────────────
 app.include_router(auth_router)
 
@@ -111,7 +160,34 @@ async def log_requests(request: Request, call_next):
         method=request.method,
         path=request.url.path,
     )
-    return await call_next(request)
+    # Spans recorded while handling the request (utils.timing.span) land here.
+    # For streaming responses this covers the work done before the first byte.
+    timings, token = start_request_timings()
+    try:
+        response = await call_next(request)
+    finally:
+        end_request_timings(token)
+    response.headers["Server-Timing"] = timings.server_timing()
+    span_context = trace.get_current_span().get_span_context()
+    if span_context.is_valid:
+        response.headers["X-Trace-Id"] = format(span_context.trace_id, "032x")
+    # Label by route template, not the raw path, to keep series bounded.
+    route = request.scope.get("route")
+    observe_http(
+        request.method,
+        getattr(route, "path", "unmatched"),
+        response.status_code,
+        timings.elapsed_ms() / 1000,
+    )
+    logger.info(
+        "request.completed",
+        method=request.method,
+        path=request.url.path,
+        status=response.status_code,
+        duration_ms=round(timings.elapsed_ms(), 1),
+        timings=timings.summary(),
+    )
+    return response
 
 
 # ── Helper ─────────────────────────────────────────────────────────────────────
@@ -123,6 +199,56 @@ ALLOWED_URL_PREFIXES = (
 )
 
 
+def _decode_cursor(cursor: str):
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _parse_fields(fields: Optional[str], allowed):
+    try:
+        return parse_fields(fields, allowed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _message_page(db: AsyncSession, session_id: str, limit: int, cursor: Optional[str], fields):
+    """Keyset page of a session's messages, newest first in SQL, returned oldest first.
+
+    Returns (messages, cursor for the next older page or None). Payload
+    columns and artifact references not named in ``fields`` are never loaded.
+    """
+    if limit == 0:
+        return [], None
+    query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+    if cursor:
+        created_at, message_id = _decode_cursor(cursor)
+        query = query.where(
+            tuple_(ChatMessage.created_at, ChatMessage.id) < tuple_(created_at, message_id)
+        )
+    if fields is None or "artifacts" in fields:
+        query = query.options(selectinload(ChatMessage.artifacts))
+    if fields is not None:
+        skip = [
+            column for name, column in (
+                ("sources", ChatMessage.sources_json),
+                ("suggestions", ChatMessage.suggestions_json),
+                ("content", ChatMessage.content),
+            ) if name not in fields
+        ]
+        if skip:
+            query = query.options(*(defer(column) for column in skip))
+    result = await db.execute(
+        query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit + 1)
+    )
+    rows = result.scalars().all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id) if has_more else None
+    return [m.to_dict(fields) for m in reversed(rows)], next_cursor
+
+
 # ── Health & Personas ──────────────────────────────────────────────────────────
 @app.get("/health")
 async def health_check():
@@ -153,6 +279,7 @@ async def health_check():
         "celery_available": _celery_available,
         "chromadb": "ok" if chroma_ok else "unavailable",
         "redis": "ok" if redis_ok else "unavailable",
+        "caches": cache_stats(),
     }
 
 
@@ -175,6 +302,19 @@ async def workers_status():
         return {"available": False, "workers": [], "reason": str(exc)}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Prometheus scrape endpoint."""
+    if Config.METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get("authorization", ""), f"Bearer {Config.METRICS_TOKEN}"
+    ):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    if not PROMETHEUS_AVAILABLE:
+        raise HTTPException(status_code=503, detail="prometheus_client is not installed")
+    body = await asyncio.get_event_loop().run_in_executor(None, render_latest)
+    return Response(content=body, media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/personas")
 async def list_personas():
     return {"personas": PersonaManager.list_all()}
@@ -193,17 +333,22 @@ async def get_task_status(
     state = result.state
     meta = result.info if isinstance(result.info, dict) else {}
 
+    # Fallbacks for states that carry no explicit progress; indexing stages
+    # report real per-batch progress in their meta.
     progress_map = {
-        "PENDING": 5, "DOWNLOADING": 20, "EXTRACTING": 50,
-        "INDEXING": 80, "SUCCESS": 100, "FAILURE": 0,
+        "PENDING": 5, "DOWNLOADING": 10, "EXTRACTING": 15, "EMBEDDING": 25,
+        "STORING": 92, "SUCCESS": 100, "FAILURE": 0,
     }
 
     resp = {
         "task_id": task_id,
         "status": state,
         "phase": meta.get("phase", state.lower()),
-        "progress": progress_map.get(state, 50),
+        "progress": meta.get("progress", progress_map.get(state, 50)),
     }
+    if "batches_total" in meta:
+        resp["batches_done"] = meta.get("batches_done", 0)
+        resp["batches_total"] = meta["batches_total"]
     if state == "SUCCESS":
         resp["result"] = result.result
         resp["progress"] = 100
@@ -250,15 +395,30 @@ async def s3_presign(
 
 # ── Sessions ───────────────────────────────────────────────────────────────────
 @app.get("/sessions")
-async def list_sessions(current_user: CurrentUser, db: DB):
+async def list_sessions(
+    request: Request,
+    current_user: CurrentUser,
+    db: DB,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+):
+    """Most recently updated first; pass ``next_cursor`` back as ``cursor`` for the next page."""
+    query = select(StudySession).where(StudySession.user_id == current_user.id)
+    if cursor:
+        updated_at, session_id = _decode_cursor(cursor)
+        query = query.where(
+            tuple_(StudySession.updated_at, StudySession.id) < tuple_(updated_at, session_id)
+        )
     result = await db.execute(
-        select(StudySession)
-        .where(StudySession.user_id == current_user.id)
-        .order_by(StudySession.updated_at.desc())
-        .limit(50)
+        query.order_by(StudySession.updated_at.desc(), StudySession.id.desc()).limit(limit + 1)
     )
     sessions = result.scalars().all()
-    return {"sessions": [s.to_dict() for s in sessions]}
+    has_more = len(sessions) > limit
+    sessions = sessions[:limit]
+    return etag_json_response(request, {
+        "sessions": [s.to_dict() for s in sessions],
+        "next_cursor": encode_cursor(sessions[-1].updated_at, sessions[-1].id) if has_more else None,
+    })
 
 
 @app.post("/sessions", status_code=201)
@@ -271,32 +431,58 @@ async def create_session(data: SessionCreate, current_user: CurrentUser, db: DB)
     db.add(session)
     await db.commit()
     await db.refresh(session)
+    await cache_session(session)
     return {"session": session.to_dict()}
 
 
 @app.get("/sessions/{session_id}")
-async def get_session(session_id: str, current_user: CurrentUser, db: DB):
-    result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == session_id, StudySession.user_id == current_user.id
-        )
-    )
-    session = result.scalar_one_or_none()
+async def get_session(
+    request: Request,
+    owned: OwnedSession,
+    db: DB,
+    message_limit: int = Query(100, ge=0, le=500),
+    fields: Optional[str] = None,
+):
+    """Session with its documents and latest ``message_limit`` messages.
+
+    Older messages are paged with ``GET /sessions/{id}/messages?cursor=<messages_cursor>``;
+    ``fields`` limits the message keys (e.g. ``id,role,content``).
+    """
+    session = await db.get(StudySession, owned.id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    # Eagerly load relationships for to_dict
-    await db.refresh(session, ["messages", "documents"])
-    return {"session": session.to_dict(include_messages=True, include_documents=True)}
+    await db.refresh(session, ["documents"])
+    messages, next_cursor = await _message_page(
+        db, owned.id, message_limit, None, _parse_fields(fields, ChatMessage.FIELDS)
+    )
+    return etag_json_response(request, {
+        "session": {
+            **session.to_dict(include_documents=True),
+            "messages": messages,
+            "messages_cursor": next_cursor,
+        }
+    })
 
 
-@app.delete("/sessions/{session_id}")
-async def delete_session(session_id: str, current_user: CurrentUser, db: DB):
-    result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == session_id, StudySession.user_id == current_user.id
-        )
+@app.get("/sessions/{session_id}/messages")
+async def list_session_messages(
+    request: Request,
+    owned: OwnedSession,
+    db: DB,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """A page of messages in chronological order, ending just before ``cursor`` (newest page first)."""
+    messages, next_cursor = await _message_page(
+        db, owned.id, limit, cursor, _parse_fields(fields, ChatMessage.FIELDS)
     )
-    session = result.scalar_one_or_none()
+    return etag_json_response(request, {"messages": messages, "next_cursor": next_cursor})
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str, owned: OwnedSession, current_user: CurrentUser, db: DB):
+    session = await db.get(StudySession, owned.id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
 
@@ -304,30 +490,28 @@ async def delete_session(session_id: str, current_user: CurrentUser, db: DB):
     await asyncio.get_event_loop().run_in_executor(
         None, rag_service.delete_session_documents, session_id, current_user.id
     )
+    await db.execute(delete(DocumentDigest).where(DocumentDigest.session_id == session_id))
+    await db.execute(delete(Flashcard).where(Flashcard.session_id == session_id))
+    await db.execute(delete(Artifact).where(Artifact.session_id == session_id))
     await db.delete(session)
+    await db.flush()
+    await rebuild_user_stats(db, current_user.id)
     await db.commit()
+    await invalidate_session(session_id, current_user.id)
     return {"message": "Session deleted"}
 
 
 # ── Documents ──────────────────────────────────────────────────────────────────
-@app.post("/sessions/{session_id}/documents", status_code=202)
+@app.post("/sessions/{session_id}/documents", status_code=202, dependencies=[WithinBudget])
 @limiter.limit("20/minute")
 async def index_session_document(
     session_id: str,
     data: DocumentCreate,
     request: Request,
+    owned: OwnedSession,
     current_user: CurrentUser,
     db: DB,
 ):
-    result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == session_id, StudySession.user_id == current_user.id
-        )
-    )
-    session = result.scalar_one_or_none()
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-
     file_url = data.url
     file_name = data.name
 
@@ -355,9 +539,10 @@ async def index_session_document(
     document_id = f"{session_id}_{secure_filename(safe_name)}_{datetime.now().strftime('%H%M%S')}"
 
     try:
-        idx_result = await rag_service.index_from_url_async(
-            file_url, file_name, document_id, session_id, current_user.id
-        )
+        with usage_scope(current_user.id, session_id, "indexing"):
+            idx_result = await rag_service.index_from_url_async(
+                file_url, file_name, document_id, session_id, current_user.id
+            )
     except Exception as exc:
         logger.error("document.index.failed", error=str(exc))
         raise HTTPException(status_code=500, detail=f"Failed to index document: {file_name}")
@@ -379,24 +564,17 @@ async def index_session_document(
 
 
 # ── Messages (SSE streaming) ───────────────────────────────────────────────────
-@app.post("/sessions/{session_id}/messages")
+@app.post("/sessions/{session_id}/messages", dependencies=[WithinBudget])
 @limiter.limit("20/minute")
 async def send_session_message(
     session_id: str,
     data: ChatMessageCreate,
     request: Request,
+    owned: OwnedSession,
     current_user: CurrentUser,
     db: DB,
+    timings: bool = Query(False, description="Send a `timings` event with the per-stage breakdown"),
 ):
-    result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == session_id, StudySession.user_id == current_user.id
-        )
-    )
-    session = result.scalar_one_or_none()
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-
     question = data.question.strip()
     is_valid, error_msg = InputValidator.validate_question(question)
     if not is_valid:
@@ -411,59 +589,62 @@ async def send_session_message(
 
     deep_think = data.deepThink
     custom_model = data.model
+    chat_feature = "deep_think" if deep_think else "chat"
+
+    request_timings = current_timings()
 
     # Save user message
-    user_msg = ChatMessage(session_id=session_id, role="user", content=question)
-    db.add(user_msg)
-    await db.commit()
-    await db.refresh(user_msg)
+    with span("chat.save_question"):
+        user_msg = ChatMessage(session_id=session_id, role="user", content=question)
+        db.add(user_msg)
+        await db.commit()
+        await db.refresh(user_msg)
 
     # Build chat history
-    msgs_result = await db.execute(
-        select(ChatMessage)
-        .where(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.created_at)
-        .limit(20)
-    )
-    recent_msgs = msgs_result.scalars().all()
-    chat_history = [{"role": m.role, "content": m.content} for m in recent_msgs[:-1]]
+    with span("chat.history"):
+        msgs_result = await db.execute(
+            select(ChatMessage)
+            .where(ChatMessage.session_id == session_id)
+            .order_by(ChatMessage.created_at)
+            .limit(20)
+        )
+        recent_msgs = msgs_result.scalars().all()
+        chat_history = [{"role": m.role, "content": m.content} for m in recent_msgs[:-1]]
 
     # Memory context
     memory_context = ""
     preference_context = ""
     try:
-        loop = asyncio.get_event_loop()
-        memories = await loop.run_in_executor(
-            None, memory_service.retrieve_relevant_memory, current_user.id, question, 3
-        )
-        if memories:
-            memory_context = " | ".join(memories[:3])
-        preference_context = await loop.run_in_executor(
-            None, memory_service.get_user_preferences, current_user.id
-        )
+        with usage_scope(current_user.id, session_id, chat_feature):
+            memories = await run_in_thread(
+                memory_service.retrieve_relevant_memory, current_user.id, question, 3
+            )
+            if memories:
+                memory_context = " | ".join(memories[:3])
+            preference_context = await run_in_thread(
+                memory_service.get_user_preferences, current_user.id
+            )
     except Exception as exc:
         logger.warning("memory.retrieval.failed", error=str(exc))
 
     model_override = custom_model or (AIService.RESPONSE_MODEL if deep_think else None)
 
     async def generate_response():
-        loop = asyncio.get_event_loop()
         try:
-            ai_result = await loop.run_in_executor(
-                None,
-                lambda: ai_service.answer_with_tools(
+            with span("chat.agent", session_id=session_id), \
+                    usage_scope(current_user.id, session_id, chat_feature):
+                ai_result = await ai_service.answer_with_tools_async(
                     question=question,
                     chat_history=chat_history,
                     tool_executor=tool_executor,
                     session_id=session_id,
                     user_id=current_user.id,
-                    persona=session.persona or "academic",
+                    persona=owned.persona,
                     file_type="pdf",
                     model_override=model_override,
                     memory_context=memory_context,
                     preference_context=preference_context,
-                ),
-            )
+                )
         except Exception as exc:
             logger.error("ai.failed", error=str(exc))
             yield f"data: {json.dumps({'error': 'AI response failed'})}\n\n"
@@ -523,23 +704,32 @@ async def send_session_message(
 
 
         # Save assistant message
-        assistant_msg = ChatMessage(
-            session_id=session_id,
-            role="assistant",
-            content=answer,
-            sources_json=json.dumps(sources),
-            artifacts_json=json.dumps(artifacts),
-            suggestions_json=json.dumps(suggestions),
-            tool_calls_json=json.dumps(ai_result.get("tool_calls", [])),
-        )
-        db.add(assistant_msg)
-        session.updated_at = datetime.utcnow()
-        await db.commit()
-        await db.refresh(assistant_msg)
+        with span("chat.save_answer"):
+            assistant_msg = ChatMessage(
+                session_id=session_id,
+                role="assistant",
+                content=answer,
+                sources_json=json.dumps(sources),
+                suggestions_json=json.dumps(suggestions),
+                tool_calls_json=json.dumps(ai_result.get("tool_calls", [])),
+            )
+            db.add(assistant_msg)
+            await db.flush()
+            artifact_rows = add_message_artifacts(db, session_id, assistant_msg.id, artifacts)
+            await db.execute(
+                update(StudySession)
+                .where(StudySession.id == session_id)
+                .values(updated_at=datetime.utcnow())
+            )
+            await db.commit()
+            await db.refresh(assistant_msg)
 
         # Enrich artifacts with message_id and session_id so the frontend
         # can persist flash-card progress even before the done event arrives.
-        for artifact in artifacts:
+        # The artifact id lets it be re-fetched later via /sessions/{id}/artifacts/{artifact_id}.
+        artifact_ids = {row.position: row.id for row in artifact_rows}
+        for position, artifact in enumerate(artifacts):
+            artifact["id"] = artifact_ids.get(position)
             artifact["message_id"] = assistant_msg.id
             artifact["session_id"] = session_id
 
@@ -554,12 +744,44 @@ async def send_session_message(
             yield f"data: {json.dumps({'chunk': answer[i:i+50]})}\n\n"
             await asyncio.sleep(0)
 
+        # Per-stage breakdown (opt-in, ?timings=true): the Server-Timing header
+        # only covers the work done before streaming started.
+        if timings and request_timings is not None:
+            yield f"data: {json.dumps({'timings': request_timings.summary(), 'total_ms': round(request_timings.elapsed_ms(), 1)})}\n\n"
+
         # Final done event with metadata
         yield f"data: {json.dumps({'done': True, 'answer': answer, 'message_id': assistant_msg.id, 'sources': sources, 'artifacts': artifacts, 'suggestions': suggestions})}\n\n"
 
     return StreamingResponse(generate_response(), media_type="text/event-stream")
 
 
+# ── Artifacts ──────────────────────────────────────────────────────────────────
+@app.get("/sessions/{session_id}/artifacts")
+async def list_session_artifacts(
+    session_id: str, owned: OwnedSession, db: DB, artifact_type: Optional[str] = None
+):
+    """Artifact references for a session (no payloads), oldest first."""
+    query = select(Artifact).where(Artifact.session_id == session_id)
+    if artifact_type:
+        query = query.where(Artifact.artifact_type == artifact_type)
+    result = await db.execute(query.order_by(Artifact.message_id, Artifact.position))
+    return {
+        "artifacts": [
+            {**a.ref(), "message_id": a.message_id, "created_at": a.created_at.isoformat()}
+            for a in result.scalars()
+        ]
+    }
+
+
+@app.get("/sessions/{session_id}/artifacts/{artifact_id}")
+async def get_session_artifact(session_id: str, artifact_id: int, owned: OwnedSession, db: DB):
+    """Full artifact payload, as it was streamed when the message was generated."""
+    artifact = await load_artifact(db, session_id, artifact_id)
+    if not artifact:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    return {"artifact": artifact.to_dict()}
+
+
 # ── Feedback ───────────────────────────────────────────────────────────────────
 @app.post("/messages/{message_id}/feedback")
 async def message_feedback(
@@ -575,17 +797,12 @@ async def message_feedback(
     if not msg:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    sess_result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == msg.session_id,
-            StudySession.user_id == current_user.id,
-        )
-    )
-    if not sess_result.scalar_one_or_none():
+    if not await load_owned_session(db, msg.session_id, current_user.id):
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    msg.feedback = data.feedback
-    await db.commit()
+    await write_queue.submit(lambda wdb: wdb.execute(
+        update(ChatMessage).where(ChatMessage.id == message_id).values(feedback=data.feedback)
+    ))
 
     try:
         user_msg_result = await db.execute(
@@ -597,15 +814,14 @@ async def message_feedback(
         )
         user_msg = user_msg_result.scalar_one_or_none()
         if user_msg:
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(
-                None,
-                memory_service.store_interaction,
-                current_user.id,
-                user_msg.content,
-                msg.content[:300],
-                data.feedback,
-            )
+            with usage_scope(current_user.id, msg.session_id, "memory"):
+                await run_in_thread(
+                    memory_service.store_interaction,
+                    current_user.id,
+                    user_msg.content,
+                    msg.content[:300],
+                    data.feedback,
+                )
     except Exception as exc:
         logger.warning("memory.feedback.failed", error=str(exc))
 
@@ -617,70 +833,76 @@ async def message_feedback(
 async def save_flashcard_progress(
     data: FlashcardProgressCreate, current_user: CurrentUser, db: DB
 ):
-    if data.status not in ("remaining", "reviewing", "known"):
+    if data.status not in REVIEW_STATUSES:
         raise HTTPException(status_code=400, detail="Invalid status")
 
-    sess_result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == data.session_id,
-            StudySession.user_id == current_user.id,
-        )
-    )
-    if not sess_result.scalar_one_or_none():
+    if not await load_owned_session(db, data.session_id, current_user.id):
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    prog_result = await db.execute(
-        select(FlashcardProgress).where(
-            FlashcardProgress.session_id == data.session_id,
-            FlashcardProgress.message_id == data.message_id,
-            FlashcardProgress.card_index == data.card_index,
-        )
-    )
-    progress = prog_result.scalar_one_or_none()
-
-    if not progress:
-        progress = FlashcardProgress(
-            session_id=data.session_id,
-            message_id=data.message_id,
-            card_index=data.card_index,
-            card_front=data.card_front[:255],
+    async def _save(wdb):
+        prog_result = await wdb.execute(
+            select(FlashcardProgress).where(
+                FlashcardProgress.session_id == data.session_id,
+                FlashcardProgress.message_id == data.message_id,
+                FlashcardProgress.card_index == data.card_index,
+            )
         )
-        db.add(progress)
-
-    progress.status = data.status
-    progress.review_count += 1
-    progress.updated_at = datetime.utcnow()
-
-    if data.status == "known":
-        progress.ease_factor = min(2.5, progress.ease_factor + 0.1)
-        progress.interval_days = max(1, int(progress.interval_days * progress.ease_factor))
-        progress.next_review_date = datetime.utcnow() + timedelta(days=progress.interval_days)
-    elif data.status == "reviewing":
-        progress.ease_factor = max(1.3, progress.ease_factor - 0.15)
-        progress.interval_days = 1
-        progress.next_review_date = datetime.utcnow() + timedelta(days=1)
-    else:  # remaining
-        progress.ease_factor = max(1.3, progress.ease_factor - 0.3)
-        progress.interval_days = 1
-        progress.next_review_date = None
+        progress = prog_result.scalar_one_or_none()
+        old_status = progress.status if progress else None
+
+        if not progress:
+            progress = FlashcardProgress(
+                session_id=data.session_id,
+                message_id=data.message_id,
+                card_index=data.card_index,
+                card_front=data.card_front[:255],
+                # Column defaults only apply at INSERT; the SM-2 update below reads these.
+                ease_factor=2.5,
+                interval_days=1,
+                review_count=0,
+            )
+            wdb.add(progress)
 
-    await db.commit()
-    await db.refresh(progress)
-    return {"message": "Progress saved", "progress": progress.to_dict()}
+        now = datetime.utcnow()
+        progress.status = data.status
+        progress.review_count += 1
+        progress.updated_at = now
+        for field, value in sm2_review(progress.ease_factor, progress.interval_days, data.status, now).items():
+            setattr(progress, field, value)
 
+        await bump_user_stats(wdb, current_user.id, **flashcard_status_deltas(old_status, data.status))
+        await wdb.flush()
+        return progress.to_dict()
 
-@app.get("/flashcards/progress/{session_id}/{message_id}")
-async def load_flashcard_progress(
-    session_id: str, message_id: int, current_user: CurrentUser, db: DB
+    # Small write: batched with other reviewers' writes by the SQLite write queue.
+    progress = await write_queue.submit(_save)
+    return {"message": "Progress saved", "progress": progress}
+
+
+@app.post("/flashcards/progress/bulk")
+async def save_flashcard_progress_bulk(
+    data: FlashcardProgressBulk, current_user: CurrentUser, db: DB
 ):
-    sess_result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == session_id, StudySession.user_id == current_user.id
-        )
-    )
-    if not sess_result.scalar_one_or_none():
+    """Save a whole review deck for one session in one request and one upsert."""
+    if any(r.status not in REVIEW_STATUSES for r in data.results):
+        raise HTTPException(status_code=400, detail="Invalid status")
+
+    if not await load_owned_session(db, data.session_id, current_user.id):
         raise HTTPException(status_code=403, detail="Not authorized")
 
+    async def _save(wdb):
+        progress, deltas = await upsert_review_results(wdb, data.session_id, data.results)
+        await bump_user_stats(wdb, current_user.id, **deltas)
+        return [p.to_dict() for p in progress]
+
+    progress = await write_queue.submit(_save)
+    return {"message": "Progress saved", "saved": len(data.results), "progress": progress}
+
+
+@app.get("/flashcards/progress/{session_id}/{message_id}")
+async def load_flashcard_progress(
+    session_id: str, message_id: int, owned: OwnedSession, db: DB
+):
     prog_result = await db.execute(
         select(FlashcardProgress)
         .where(
@@ -694,67 +916,68 @@ async def load_flashcard_progress(
 
 
 @app.get("/flashcards/due")
-async def get_due_flashcards(current_user: CurrentUser, db: DB):
-    """Return all flashcards due for review today (SM-2 next_review_date <= now)."""
-    today = datetime.utcnow()
-
-    # Get all sessions for this user
-    sess_result = await db.execute(
-        select(StudySession.id).where(StudySession.user_id == current_user.id)
+async def get_due_flashcards(
+    current_user: CurrentUser,
+    db: DB,
+    limit: int = Query(100, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    """Return flashcards due for review today (SM-2 next_review_date <= now), oldest first."""
+    due_filter = (
+        FlashcardProgress.session_id.in_(
+            select(StudySession.id).where(StudySession.user_id == current_user.id)
+        ),
+        FlashcardProgress.next_review_date <= datetime.utcnow(),
     )
-    session_ids = [row[0] for row in sess_result.fetchall()]
-    if not session_ids:
-        return {"due": [], "total": 0}
-
-    # Fetch due cards
-    due_result = await db.execute(
-        select(FlashcardProgress)
-        .where(
-            FlashcardProgress.session_id.in_(session_ids),
-            FlashcardProgress.next_review_date <= today,
-        )
-        .order_by(FlashcardProgress.next_review_date)
+    total = await db.scalar(
+        select(func.count()).select_from(FlashcardProgress).where(*due_filter)
     )
-    due_records = due_result.scalars().all()
 
-    # Enrich each card with its back text from the originating message artifact
-    enriched = []
-    msg_cache: dict = {}
-    for rec in due_records:
-        card_back = None
+    # Card backs come from the normalized flashcards table in the same query.
+    rows = (await db.execute(
+        select(FlashcardProgress, Flashcard)
+        .outerjoin(
+            Flashcard,
+            and_(
+                Flashcard.message_id == FlashcardProgress.message_id,
+                Flashcard.card_index == FlashcardProgress.card_index,
+            ),
+        )
+        .where(*due_filter)
+        .order_by(FlashcardProgress.next_review_date, FlashcardProgress.id)
+        .limit(limit)
+        .offset(offset)
+    )).all()
+
+    # Messages saved before the flashcards table existed: backfill them in one batch.
+    missing = {rec.message_id for rec, card in rows if card is None}
+    backfilled = {}
+    if missing:
         try:
-            if rec.message_id not in msg_cache:
-                msg_res = await db.execute(
-                    select(ChatMessage).where(ChatMessage.id == rec.message_id)
-                )
-                msg = msg_res.scalar_one_or_none()
-                msg_cache[rec.message_id] = json.loads(msg.artifacts_json or "[]") if msg else []
-
-            artifacts = msg_cache[rec.message_id]
-            for art in artifacts:
-                if art.get("artifact_type") == "flashcards":
-                    cards_data = art.get("content")
-                    if isinstance(cards_data, str):
-                        import json as _json
-                        cards_data = _json.loads(cards_data)
-                    if isinstance(cards_data, dict):
-                        cards_data = cards_data.get("cards", [])
-                    if isinstance(cards_data, list) and len(cards_data) > rec.card_index:
-                        card = cards_data[rec.card_index]
-                        card_back = card.get("back") or card.get("answer") or card.get("definition")
-                    break
+            backfilled = await backfill_flashcards(db, missing)
+            await db.commit()
         except Exception as exc:
-            logger.warning(f"flashcards.due.enrich.failed card={rec.id}: {exc}")
+            await db.rollback()
+            logger.warning("flashcards.due.backfill.failed", error=str(exc))
 
+    enriched = []
+    for rec, card in rows:
+        card = card or backfilled.get((rec.message_id, rec.card_index))
         row = rec.to_dict()
-        row["card_back"] = card_back
+        row["card_back"] = card.back if card else None
         enriched.append(row)
 
-    return {"due": enriched, "total": len(enriched)}
+    return {
+        "due": enriched,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "has_more": offset + len(enriched) < total,
+    }
 
 
 # ── Flashcard & Quiz direct-generate (migrated from Flask app.py) ─────────────
-@app.post("/flashcards/generate")
+@app.post("/flashcards/generate", dependencies=[WithinBudget])
 @limiter.limit("10/minute")
 async def generate_flashcards_direct(
     request: Request, current_user: CurrentUser, db: DB
@@ -771,17 +994,10 @@ async def generate_flashcards_direct(
     if not session_id:
         raise HTTPException(status_code=400, detail="session_id is required")
 
-    sess_result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == session_id, StudySession.user_id == current_user.id
-        )
-    )
-    if not sess_result.scalar_one_or_none():
+    if not await load_owned_session(db, session_id, current_user.id):
         raise HTTPException(status_code=404, detail="Session not found or not authorized")
 
-    loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(
-        None,
+    result = await run_in_thread(
         lambda: tool_executor.execute(
             "generate_flashcards",
             {"topic": topic, "num_cards": num_cards, "card_type": "mixed"},
@@ -808,7 +1024,7 @@ async def generate_flashcards_direct(
     }
 
 
-@app.post("/quiz/generate")
+@app.post("/quiz/generate", dependencies=[WithinBudget])
 @limiter.limit("10/minute")
 async def generate_quiz_direct(
     request: Request, current_user: CurrentUser, db: DB
@@ -822,17 +1038,10 @@ async def generate_quiz_direct(
     if not session_id:
         raise HTTPException(status_code=400, detail="session_id is required")
 
-    sess_result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == session_id, StudySession.user_id == current_user.id
-        )
-    )
-    if not sess_result.scalar_one_or_none():
+    if not await load_owned_session(db, session_id, current_user.id):
         raise HTTPException(status_code=404, detail="Session not found or not authorized")
 
-    loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(
-        None,
+    result = await run_in_thread(
         lambda: tool_executor.execute(
             "generate_quiz",
             {"topic": topic, "num_questions": num_questions},
@@ -856,17 +1065,8 @@ async def generate_quiz_direct(
 
 # ── Session activity feed ──────────────────────────────────────────────────────
 @app.get("/sessions/{session_id}/activity")
-async def get_session_activity(session_id: str, current_user: CurrentUser, db: DB):
+async def get_session_activity(session_id: str, owned: OwnedSession, db: DB):
     """Aggregate activity (messages, quiz results, flashcard progress) for the Document Dashboard."""
-    sess_result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == session_id, StudySession.user_id == current_user.id
-        )
-    )
-    session = sess_result.scalar_one_or_none()
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-
     # Recent messages (ai exchanges only)
     msgs_result = await db.execute(
         select(ChatMessage)
@@ -882,13 +1082,15 @@ async def get_session_activity(session_id: str, current_user: CurrentUser, db: D
     )
     quizzes = quiz_res.scalars().all()
 
-    # Flashcard progress for session
-    fc_res = await db.execute(
-        select(FlashcardProgress).where(FlashcardProgress.session_id == session_id)
-    )
-    fc_records = fc_res.scalars().all()
-    known = sum(1 for r in fc_records if r.status == "known")
-    reviewing = sum(1 for r in fc_records if r.status == "reviewing")
+    # Flashcard progress for session, counted per status in SQL
+    by_status = dict((await db.execute(
+        select(FlashcardProgress.status, func.count(FlashcardProgress.id))
+        .where(FlashcardProgress.session_id == session_id)
+        .group_by(FlashcardProgress.status)
+    )).all())
+    total_cards = sum(by_status.values())
+    known = by_status.get("known", 0)
+    reviewing = by_status.get("reviewing", 0)
 
     return {
         "session_id": session_id,
@@ -898,26 +1100,18 @@ async def get_session_activity(session_id: str, current_user: CurrentUser, db: D
         ],
         "quiz_results": [q.to_dict() for q in quizzes],
         "flashcard_summary": {
-            "total": len(fc_records),
+            "total": total_cards,
             "known": known,
             "reviewing": reviewing,
-            "remaining": len(fc_records) - known - reviewing,
+            "remaining": total_cards - known - reviewing,
         },
     }
 
 
 # ── Flashcard mastery summary (for Heatmap) ────────────────────────────────────
 @app.get("/flashcards/progress/summary/{session_id}")
-async def get_flashcard_mastery_summary(session_id: str, current_user: CurrentUser, db: DB):
+async def get_flashcard_mastery_summary(session_id: str, owned: OwnedSession, db: DB):
     """Return per-card mastery data grouped by message_id for the MasteryHeatmap."""
-    sess_result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == session_id, StudySession.user_id == current_user.id
-        )
-    )
-    if not sess_result.scalar_one_or_none():
-        raise HTTPException(status_code=403, detail="Not authorized")
-
     fc_res = await db.execute(
         select(FlashcardProgress)
         .where(FlashcardProgress.session_id == session_id)
@@ -946,13 +1140,7 @@ async def get_flashcard_mastery_summary(session_id: str, current_user: CurrentUs
 # ── Quiz results ───────────────────────────────────────────────────────────────
 @app.post("/quiz/results")
 async def save_quiz_result(data: QuizResultCreate, current_user: CurrentUser, db: DB):
-    sess_result = await db.execute(
-        select(StudySession).where(
-            StudySession.id == data.session_id,
-            StudySession.user_id == current_user.id,
-        )
-    )
-    if not sess_result.scalar_one_or_none():
+    if not await load_owned_session(db, data.session_id, current_user.id):
         raise HTTPException(status_code=403, detail="Not authorized")
 
     result = QuizResult(
@@ -965,6 +1153,10 @@ async def save_quiz_result(data: QuizResultCreate, current_user: CurrentUser, db
         time_taken=data.time_taken,
     )
     db.add(result)
+    await bump_user_stats(
+        db, current_user.id,
+        total_quizzes=1, quiz_percent_sum=quiz_percent(data.score, data.total_questions),
+    )
     await db.commit()
     await db.refresh(result)
     return {"message": "Quiz result saved", "result": result.to_dict()}
@@ -973,63 +1165,73 @@ async def save_quiz_result(data: QuizResultCreate, current_user: CurrentUser, db
 # ── Analytics ──────────────────────────────────────────────────────────────────
 @app.get("/analytics/summary")
 async def get_analytics_summary(current_user: CurrentUser, db: DB):
-    sessions_result = await db.execute(
-        select(StudySession).where(StudySession.user_id == current_user.id)
-    )
-    sessions = sessions_result.scalars().all()
-    session_ids = [s.id for s in sessions]
-
-    if session_ids:
-        quiz_result = await db.execute(
-            select(QuizResult)
-            .where(QuizResult.session_id.in_(session_ids))
-            .order_by(QuizResult.created_at.desc())
-        )
-        quiz_results = quiz_result.scalars().all()
+    """Dashboard totals from the user_stats row plus two small indexed queries."""
+    stats = await get_user_stats(db, current_user.id)
 
-        fc_result = await db.execute(
-            select(FlashcardProgress).where(
-                FlashcardProgress.session_id.in_(session_ids)
-            )
-        )
-        fc_records = fc_result.scalars().all()
-    else:
-        quiz_results = []
-        fc_records = []
-
-    total_quizzes = len(quiz_results)
-    avg_score = (
-        round(
-            sum(
-                q.score / q.total_questions * 100
-                for q in quiz_results
-                if q.total_questions > 0
-            )
-            / total_quizzes,
-            1,
-        )
-        if total_quizzes > 0
-        else 0
+    user_sessions = select(StudySession.id).where(StudySession.user_id == current_user.id)
+    total_sessions = await db.scalar(
+        select(func.count()).select_from(StudySession).where(StudySession.user_id == current_user.id)
     )
-    today = datetime.utcnow().date()
-    cards_due = sum(
-        1
-        for r in fc_records
-        if r.next_review_date and r.next_review_date.date() <= today
+    # Due "today" means due by the end of the current UTC day.
+    end_of_today = datetime.combine(datetime.utcnow().date() + timedelta(days=1), datetime.min.time())
+    cards_due = await db.scalar(
+        select(func.count()).select_from(FlashcardProgress).where(
+            FlashcardProgress.session_id.in_(user_sessions),
+            FlashcardProgress.next_review_date < end_of_today,
+        )
     )
+    recent = (await db.execute(
+        select(QuizResult)
+        .where(QuizResult.session_id.in_(user_sessions))
+        .order_by(QuizResult.created_at.desc())
+        .limit(10)
+    )).scalars().all()
 
     return {
-        "total_sessions": len(sessions),
-        "total_quizzes": total_quizzes,
-        "avg_quiz_score": avg_score,
-        "recent_quizzes": [q.to_dict() for q in quiz_results[:10]],
-        "total_flashcards": len(fc_records),
-        "known_flashcards": sum(1 for r in fc_records if r.status == "known"),
-        "reviewing_flashcards": sum(1 for r in fc_records if r.status == "reviewing"),
+        "total_sessions": total_sessions,
+        "total_quizzes": stats.total_quizzes,
+        "avg_quiz_score": (
+            round(stats.quiz_percent_sum / stats.total_quizzes, 1) if stats.total_quizzes > 0 else 0
+        ),
+        "recent_quizzes": [q.to_dict() for q in recent],
+        "total_flashcards": stats.total_flashcards,
+        "known_flashcards": stats.known_flashcards,
+        "reviewing_flashcards": stats.reviewing_flashcards,
         "cards_due_today": cards_due,
     }
 
 
+@app.get("/admin/usage")
+async def get_usage_report(
+    admin: AdminUser,
+    db: DB,
+    days: int = Query(30, ge=1, le=366),
+    group_by: str = Query("feature,model", description=f"Comma-separated: {', '.join(USAGE_DIMENSIONS)}"),
+    user_id: Optional[int] = None,
+    order: str = Query("cost", description=f"One of: {', '.join(USAGE_ORDERS)}"),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Token usage and estimated cost over the last ``days`` UTC days (ADMIN_EMAILS only)."""
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip()]
+    unknown = [d for d in dimensions if d not in USAGE_DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by: {', '.join(unknown)}")
+    if order not in USAGE_ORDERS:
+        raise HTTPException(status_code=400, detail=f"Unknown order: {order}")
+
+    await flush_usage()  # include this process's most recent calls
+    end = datetime.utcnow().date()
+    report = await usage_report(
+        db, end - timedelta(days=days - 1), end, dimensions,
+        user_id=user_id, order=order, limit=limit,
+    )
+    report["budgets"] = {
+        "daily_tokens": Config.USAGE_DAILY_TOKEN_BUDGET or None,
+        "monthly_cost_usd": Config.USAGE_MONTHLY_COST_BUDGET_USD or None,
+    }
+    return report
+
+
 # ── Transcription ──────────────────────────────────────────────────────────────
 @app.post("/transcribe")
 @limiter.limit("10/minute")
@@ -1073,7 +1275,7 @@ async def transcribe_audio(
 
 
 # ── Legacy upload endpoint ─────────────────────────────────────────────────────
-@app.post("/upload")
+@app.post("/upload", dependencies=[WithinBudget])
 @limiter.limit("20/minute")
 async def upload_file(request: Request, current_user: CurrentUser, db: DB):
     """Legacy multipart upload endpoint (kept for backward compat)."""
@@ -1157,7 +1359,8 @@ async def upload_file(request: Request, current_user: CurrentUser, db: DB):
                 for c in chunks_with_pages
             ]
             ids = [f"{document_id}_chunk_{i}" for i in range(len(docs))]
-            rag_service.vectorstore.add_documents(docs, ids=ids)
+            with usage_scope(current_user.id, None, "upload"):
+                rag_service.vectorstore.add_documents(docs, ids=ids)
             all_chunks_with_pages.extend([(document_id, c) for c in chunks_with_pages])
 
     if not all_chunks_with_pages:
@@ -1166,9 +1369,10 @@ async def upload_file(request: Request, current_user: CurrentUser, db: DB):
     relevant_chunks = []
     relevant_metas = []
     try:
-        results = rag_service.vectorstore.similarity_search(
-            query=question, k=min(n_chunks, max(1, len(all_chunks_with_pages)))
-        )
+        with usage_scope(current_user.id, None, "upload"):
+            results = rag_service.vectorstore.similarity_search(
+                query=question, k=min(n_chunks, max(1, len(all_chunks_with_pages)))
+            )
         relevant_chunks = [doc.page_content for doc in results]
         relevant_metas = [doc.metadata for doc in results]
     except Exception as exc:
@@ -1180,11 +1384,12 @@ async def upload_file(request: Request, current_user: CurrentUser, db: DB):
         except Exception:
             pass
 
-    ai_response = ai_service.answer_from_context(
-        relevant_chunks, question, chat_history,
-        model_override=model_override, persona=persona,
-        file_type=primary_file_type, image_paths=image_filepaths or None,
-    )
+    with usage_scope(current_user.id, None, "upload"):
+        ai_response = await ai_service.answer_from_context_async(
+            relevant_chunks, question, chat_history,
+            model_override=model_override, persona=persona,
+            file_type=primary_file_type, image_paths=image_filepaths or None,
+        )
     if not ai_response:
         raise HTTPException(status_code=500, detail="Failed to generate AI response")
 
@@ -1206,7 +1411,7 @@ async def upload_file(request: Request, current_user: CurrentUser, db: DB):
 
 
 # ── Legacy ask endpoint ────────────────────────────────────────────────────────
-@app.post("/ask")
+@app.post("/ask", dependencies=[WithinBudget])
 @limiter.limit("20/minute")
 async def ask(request: Request, current_user: CurrentUser, db: DB):
     """Legacy ask endpoint: file URLs + question → RAG pipeline."""
@@ -1289,7 +1494,8 @@ async def ask(request: Request, current_user: CurrentUser, db: DB):
                 for c in chunks_with_pages
             ]
             ids = [f"{document_id}_chunk_{i}" for i in range(len(docs))]
-            rag_service.vectorstore.add_documents(docs, ids=ids)
+            with usage_scope(current_user.id, None, "ask"):
+                rag_service.vectorstore.add_documents(docs, ids=ids)
             all_chunks_with_pages.extend([(document_id, c) for c in chunks_with_pages])
 
     if not all_chunks_with_pages:
@@ -1298,9 +1504,10 @@ async def ask(request: Request, current_user: CurrentUser, db: DB):
     relevant_chunks = []
     relevant_metas = []
     try:
-        results = rag_service.vectorstore.similarity_search(
-            query=question, k=min(n_chunks, max(1, len(all_chunks_with_pages)))
-        )
+        with usage_scope(current_user.id, None, "ask"):
+            results = rag_service.vectorstore.similarity_search(
+                query=question, k=min(n_chunks, max(1, len(all_chunks_with_pages)))
+            )
         relevant_chunks = [doc.page_content for doc in results]
         relevant_metas = [doc.metadata for doc in results]
     except Exception as exc:
@@ -1312,11 +1519,12 @@ async def ask(request: Request, current_user: CurrentUser, db: DB):
         except Exception:
             pass
 
-    ai_response = ai_service.answer_from_context(
-        relevant_chunks, question, chat_history,
-        model_override=model_override, persona=persona,
-        file_type=primary_file_type, image_paths=image_filepaths or None,
-    )
+    with usage_scope(current_user.id, None, "ask"):
+        ai_response = await ai_service.answer_from_context_async(
+            relevant_chunks, question, chat_history,
+            model_override=model_override, persona=persona,
+            file_type=primary_file_type, image_paths=image_filepaths or None,
+        )
     if not ai_response:
         raise HTTPException(status_code=500, detail="Failed to generate AI response")
 
@@ -2,12 +2,12 @@
 
 import json
 import uuid
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional, List
 
 from sqlalchemy import (
-    Integer, String, Text, Float, DateTime,
-    ForeignKey, UniqueConstraint,
+    Integer, String, Text, Float, Date, DateTime,
+    ForeignKey, Index, UniqueConstraint,
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -52,6 +52,11 @@ class StudySession(Base):
         "SessionDocument", back_populates="session", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        # GET /sessions, ownership checks, per-user analytics
+        Index("ix_study_sessions_user_updated", "user_id", "updated_at"),
+    )
+
     def to_dict(self, include_messages=False, include_documents=False):
         d = {
             "id": self.id,
@@ -80,25 +85,39 @@ class ChatMessage(Base):
     role: Mapped[str] = mapped_column(String(20), nullable=False)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     sources_json: Mapped[str] = mapped_column(Text, default="[]")
-    artifacts_json: Mapped[str] = mapped_column(Text, default="[]")
+    # Legacy artifact blob; new messages store artifacts in the ``artifacts`` table.
+    # Deferred so loading messages does not pull it (scripts.backfill_artifacts).
+    artifacts_json: Mapped[str] = mapped_column(Text, default="[]", deferred=True)
     suggestions_json: Mapped[str] = mapped_column(Text, default="[]")
     feedback: Mapped[Optional[str]] = mapped_column(String(10), nullable=True)
-    tool_calls_json: Mapped[str] = mapped_column(Text, default="[]")
+    tool_calls_json: Mapped[str] = mapped_column(Text, default="[]", deferred=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     session: Mapped["StudySession"] = relationship("StudySession", back_populates="messages")
+    artifacts: Mapped[List["Artifact"]] = relationship(
+        "Artifact", order_by="Artifact.position", viewonly=True
+    )
 
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "role": self.role,
-            "content": self.content,
-            "sources": json.loads(self.sources_json or "[]"),
-            "artifacts": json.loads(self.artifacts_json or "[]"),
-            "suggestions": json.loads(self.suggestions_json or "[]"),
-            "feedback": self.feedback,
-            "created_at": self.created_at.isoformat(),
+    __table_args__ = (
+        # Chat history and activity feed: WHERE session_id = ? ORDER BY created_at
+        Index("ix_chat_messages_session_created", "session_id", "created_at"),
+    )
+
+    FIELDS = ("id", "role", "content", "sources", "artifacts", "suggestions", "feedback", "created_at")
+
+    def to_dict(self, fields=None):
+        """Serialize; ``fields`` limits the output (and skips parsing what is not asked for)."""
+        getters = {
+            "id": lambda: self.id,
+            "role": lambda: self.role,
+            "content": lambda: self.content,
+            "sources": lambda: json.loads(self.sources_json or "[]"),
+            "artifacts": lambda: [a.ref() for a in self.artifacts],
+            "suggestions": lambda: json.loads(self.suggestions_json or "[]"),
+            "feedback": lambda: self.feedback,
+            "created_at": lambda: self.created_at.isoformat(),
         }
+        return {name: get() for name, get in getters.items() if fields is None or name in fields}
 
 
 class SessionDocument(Base):
@@ -118,6 +137,10 @@ class SessionDocument(Base):
 
     session: Mapped["StudySession"] = relationship("StudySession", back_populates="documents")
 
+    __table_args__ = (
+        Index("ix_session_documents_session", "session_id"),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -130,6 +153,117 @@ class SessionDocument(Base):
         }
 
 
+class DocumentDigest(Base):
+    """Precomputed outline, section summaries and key terms for one indexed document."""
+
+    __tablename__ = "document_digests"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    session_id: Mapped[str] = mapped_column(
+        String(36), ForeignKey("study_sessions.id", ondelete="CASCADE"), nullable=False
+    )
+    document_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("session_documents.id", ondelete="CASCADE"), unique=True, nullable=False
+    )
+    outline_json: Mapped[str] = mapped_column(Text, default="[]")
+    sections_json: Mapped[str] = mapped_column(Text, default="[]")
+    key_terms_json: Mapped[str] = mapped_column(Text, default="[]")
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_document_digests_session", "session_id"),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "session_id": self.session_id,
+            "document_id": self.document_id,
+            "outline": json.loads(self.outline_json or "[]"),
+            "sections": json.loads(self.sections_json or "[]"),
+            "key_terms": json.loads(self.key_terms_json or "[]"),
+            "created_at": self.created_at.isoformat(),
+        }
+
+
+class Flashcard(Base):
+    """One generated card, normalized out of an assistant message's flashcards artifact."""
+
+    __tablename__ = "flashcards"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    session_id: Mapped[str] = mapped_column(
+        String(36), ForeignKey("study_sessions.id", ondelete="CASCADE"), nullable=False
+    )
+    message_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("chat_messages.id", ondelete="CASCADE"), nullable=False
+    )
+    card_index: Mapped[int] = mapped_column(Integer, nullable=False)
+    front: Mapped[str] = mapped_column(Text, nullable=False, default="")
+    back: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("message_id", "card_index", name="_message_card_uc"),
+        Index("ix_flashcards_session", "session_id"),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "session_id": self.session_id,
+            "message_id": self.message_id,
+            "card_index": self.card_index,
+            "front": self.front,
+            "back": self.back,
+        }
+
+
+class Artifact(Base):
+    """A tool artifact (quiz, flashcards, study guide, visualization) from an assistant message.
+
+    ``payload_json`` holds the full artifact and is deferred; message
+    serialization only returns ``ref()`` and clients fetch the payload by id.
+    """
+
+    __tablename__ = "artifacts"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    session_id: Mapped[str] = mapped_column(
+        String(36), ForeignKey("study_sessions.id", ondelete="CASCADE"), nullable=False
+    )
+    message_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("chat_messages.id", ondelete="CASCADE"), nullable=False
+    )
+    position: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    artifact_type: Mapped[str] = mapped_column(String(30), nullable=False)
+    topic: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    item_count: Mapped[int] = mapped_column(Integer, default=0)
+    payload_json: Mapped[str] = mapped_column(Text, default="{}", deferred=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("message_id", "position", name="_message_artifact_uc"),
+        Index("ix_artifacts_session_type", "session_id", "artifact_type"),
+    )
+
+    def ref(self):
+        return {
+            "id": self.id,
+            "artifact_type": self.artifact_type,
+            "topic": self.topic,
+            "item_count": self.item_count,
+        }
+
+    def to_dict(self):
+        return {
+            **json.loads(self.payload_json or "{}"),
+            **self.ref(),
+            "session_id": self.session_id,
+            "message_id": self.message_id,
+        }
+
+
 class QuizResult(Base):
     __tablename__ = "quiz_results"
 
@@ -147,6 +281,11 @@ class QuizResult(Base):
     time_taken: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Activity feed and recent quizzes: WHERE session_id IN (...) ORDER BY created_at
+        Index("ix_quiz_results_session_created", "session_id", "created_at"),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -192,6 +331,8 @@ class FlashcardProgress(Base):
         UniqueConstraint(
             "session_id", "message_id", "card_index", name="_session_message_card_uc"
         ),
+        # Due queue and cards-due counts: WHERE session_id IN (...) AND next_review_date <= ?
+        Index("ix_flashcard_progress_session_next_review", "session_id", "next_review_date"),
     )
 
     def to_dict(self):
@@ -216,3 +357,60 @@ class FlashcardProgress(Base):
             "created_at": self.created_at.isoformat(),
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
+
+
+class UserStats(Base):
+    """Per-user dashboard counters, kept current on quiz saves and flashcard progress writes.
+
+    Rebuilt from the source tables (see ``services.user_stats``) when missing
+    or after a session is deleted; otherwise only incremented in place.
+    """
+
+    __tablename__ = "user_stats"
+
+    user_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    total_quizzes: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Sum of per-quiz percentages; avg_quiz_score = quiz_percent_sum / total_quizzes
+    quiz_percent_sum: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+    total_flashcards: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    known_flashcards: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    reviewing_flashcards: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+
+class TokenUsage(Base):
+    """Daily LLM and embedding token totals per user, session, provider, model and feature.
+
+    Written by ``services.usage`` from an in-process ledger with additive
+    upserts. ``user_id`` 0 and ``session_id`` "" mean unattributed; neither is
+    a foreign key, so spend history survives session and account deletion.
+    """
+
+    __tablename__ = "token_usage"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, nullable=False)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    session_id: Mapped[str] = mapped_column(String(36), nullable=False, default="")
+    provider: Mapped[str] = mapped_column(String(20), nullable=False)
+    model: Mapped[str] = mapped_column(String(80), nullable=False)
+    feature: Mapped[str] = mapped_column(String(40), nullable=False)
+    requests: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    prompt_tokens: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    completion_tokens: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Largest single prompt in the bucket: finds pathological context sizes.
+    max_prompt_tokens: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    cost_usd: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "day", "user_id", "session_id", "provider", "model", "feature",
+            name="_token_usage_bucket_uc",
+        ),
+        Index("ix_token_usage_user_day", "user_id", "day"),
+        Index("ix_token_usage_day", "day"),
+    )
@@ -8,10 +8,12 @@ from functools import partial
 import bcrypt
 import jwt
 from fastapi import APIRouter, Cookie, Depends, HTTPException, Response
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from database import get_db
+from dependencies import cache_user, invalidate_user
 from models_async import User
 from schemas import SignupRequest, LoginRequest
 
@@ -26,6 +28,8 @@ REFRESH_TOKEN_DAYS = int(os.getenv("REFRESH_TOKEN_DAYS", "30"))
 JWT_EXPIRY_HOURS = 24
 
 _REFRESH_COOKIE = "filegeek_refresh"
+# Optional bearer for /logout: an expired access token must still log out.
+_optional_bearer = HTTPBearer(auto_error=False)
 
 
 def _create_access_token(user: User) -> str:
@@ -91,6 +95,7 @@ async def signup(data: SignupRequest, response: Response, db: AsyncSession = Dep
     db.add(user)
     await db.commit()
     await db.refresh(user)
+    await cache_user(user)
 
     access_token = _create_access_token(user)
     refresh_token = _create_refresh_token(user)
@@ -122,6 +127,7 @@ async def login(data: LoginRequest, response: Response, db: AsyncSession = Depen
     if not pw_matches:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
+    await cache_user(user)
     access_token = _create_access_token(user)
     refresh_token = _create_refresh_token(user)
     _set_refresh_cookie(response, refresh_token)
@@ -159,6 +165,7 @@ async def refresh_token(
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
+    await cache_user(user)
     # Issue a new access token (rotate refresh token for forward secrecy)
     new_access = _create_access_token(user)
     new_refresh = _create_refresh_token(user)
@@ -168,7 +175,23 @@ async def refresh_token(
 
 
 @router.post("/logout")
-async def logout(response: Response):
-    """Clear the refresh token cookie."""
+async def logout(
+    response: Response,
+    credentials: HTTPAuthorizationCredentials = Depends(_optional_bearer),
+):
+    """Clear the refresh token cookie and drop the user from the auth cache.
+
+    The refresh cookie is scoped to /auth/refresh, so the user is identified
+    by the access token in the Authorization header (expiry not checked).
+    """
+    if credentials:
+        try:
+            payload = jwt.decode(
+                credentials.credentials, JWT_SECRET, algorithms=["HS256"], options={"verify_exp": False}
+            )
+            if payload.get("user_id"):
+                await invalidate_user(payload["user_id"])
+        except jwt.InvalidTokenError:
+            pass
     response.delete_cookie(key=_REFRESH_COOKIE, path="/auth/refresh")
     return {"message": "Logged out"}
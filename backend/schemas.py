@@ -1,6 +1,6 @@
 """Pydantic v2 request/response schemas for FastAPI."""
 
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field, ConfigDict
 
 
@@ -46,6 +46,18 @@ class FlashcardProgressCreate(BaseModel):
     status: str = "remaining"  # remaining | reviewing | known
 
 
+class FlashcardReviewResult(BaseModel):
+    message_id: int
+    card_index: int
+    card_front: str = ""
+    status: str = "remaining"  # remaining | reviewing | known
+
+
+class FlashcardProgressBulk(BaseModel):
+    session_id: str
+    results: List[FlashcardReviewResult] = Field(..., min_length=1, max_length=500)
+
+
 class QuizResultCreate(BaseModel):
     session_id: str
     message_id: int
@@ -0,0 +1 @@
+# Developer scripts — run from backend/, e.g. `python -m scripts.explain_queries`
@@ -0,0 +1,48 @@
+"""Migrate legacy ``ChatMessage.artifacts_json`` blobs into the artifact tables.
+
+Creates the ``artifacts`` (and any missing ``flashcards``) rows for assistant
+messages saved before artifacts were normalized, in id order and in batches
+of one transaction each, so it can be interrupted and re-run safely. Until a
+message is migrated its serialized ``artifacts`` list is empty.
+
+Usage (from backend/, against the database in DATABASE_URL):
+    python -m scripts.backfill_artifacts
+    python -m scripts.backfill_artifacts --batch-size 200 --clear-json
+"""
+
+import argparse
+import asyncio
+
+from database import AsyncSessionLocal, engine, init_db
+from services.artifact_store import backfill_artifacts
+
+
+async def _run(batch_size: int, clear_json: bool) -> int:
+    await init_db()  # creates the artifacts table if the API has not started yet
+    last_id, batches = 0, 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            last_id = await backfill_artifacts(db, last_id, batch_size, clear_json)
+            await db.commit()
+        if last_id is None:
+            break
+        batches += 1
+        print(f"batch {batches}: migrated messages through id {last_id}")
+    await engine.dispose()
+    return batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--clear-json", action="store_true",
+        help="reset migrated messages' artifacts_json to '[]' to reclaim space",
+    )
+    args = parser.parse_args()
+    batches = asyncio.run(_run(args.batch_size, args.clear_json))
+    print(f"done ({batches} batch{'es' if batches != 1 else ''})")
+
+
+if __name__ == "__main__":
+    main()
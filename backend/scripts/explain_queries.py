@@ -0,0 +1,173 @@
+"""Index advisor: EXPLAIN every query the API issues and flag full table scans.
+
+Drives the session, message, flashcard, quiz and analytics endpoints through
+an in-process client against a small seeded database, captures each distinct
+SQL statement per endpoint, and runs ``EXPLAIN QUERY PLAN`` (SQLite) or
+``EXPLAIN`` (PostgreSQL, with ``enable_seqscan=off`` so a usable index is
+always chosen over a tiny table) on it. Exits non-zero if any scan is found,
+so it can gate CI.
+
+Usage (from backend/):
+    python -m scripts.explain_queries              # throwaway SQLite database
+    DATABASE_URL=postgresql+asyncpg://... python -m scripts.explain_queries
+"""
+
+import asyncio
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+from collections import OrderedDict
+
+_tmp = tempfile.mkdtemp(prefix="filegeek-explain-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp}/explain.db")
+os.environ.setdefault("SYNC_DATABASE_URL", f"sqlite:///{_tmp}/explain.db")
+os.environ.setdefault("CHROMA_PATH", os.path.join(_tmp, "chroma"))
+os.environ.setdefault("GOOGLE_API_KEY", "explain")
+os.environ.setdefault("JWT_SECRET", "explain")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+# SQLite plan lines that read a whole table. "SCAN t USING (COVERING) INDEX" walks an index, which is fine.
+_SQLITE_SCAN = re.compile(r"^SCAN (\w+)(?! USING (COVERING )?INDEX)")
+_PG_SCAN = re.compile(r"Seq Scan on (\w+)")
+
+_captured: "OrderedDict[str, OrderedDict]" = OrderedDict()
+_current = {"endpoint": None}
+
+
+def _capture(conn, cursor, statement, parameters, context, executemany):
+    endpoint = _current["endpoint"]
+    if endpoint and not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+        _captured.setdefault(endpoint, OrderedDict()).setdefault(statement, parameters)
+
+
+async def _exercise(client, headers):
+    """Call each endpoint once, labelling the statements it issues."""
+    async def call(label, method, url, **kw):
+        _current["endpoint"] = label
+        r = await client.request(method, url, headers=headers, **kw)
+        _current["endpoint"] = None
+        if r.status_code >= 400:
+            print(f"  ! {label} -> HTTP {r.status_code}", file=sys.stderr)
+        return r
+
+    sid = (await call("POST /sessions", "POST", "/sessions", json={"title": "Explain"})).json()["session"]["id"]
+    await call("POST /sessions", "POST", "/sessions", json={"title": "Explain 2"})
+    page = (await call("GET /sessions", "GET", "/sessions?limit=1")).json()
+    await call("GET /sessions?cursor", "GET", f"/sessions?limit=1&cursor={page['next_cursor']}")
+    await call("POST /sessions/{id}/messages", "POST", f"/sessions/{sid}/messages", json={"question": "Make flashcards"})
+    await call("GET /sessions/{id}", "GET", f"/sessions/{sid}")
+    page = (await call("GET /sessions/{id}/messages", "GET", f"/sessions/{sid}/messages?limit=1")).json()
+    await call("GET /sessions/{id}/messages?cursor", "GET",
+               f"/sessions/{sid}/messages?limit=1&fields=id,role,content&cursor={page['next_cursor']}")
+    await call("GET /sessions/{id}/artifacts", "GET", f"/sessions/{sid}/artifacts")
+    await call("GET /sessions/{id}/activity", "GET", f"/sessions/{sid}/activity")
+
+    from database import AsyncSessionLocal
+    from models_async import ChatMessage
+    from sqlalchemy import select
+    async with AsyncSessionLocal() as db:
+        message_id = await db.scalar(
+            select(ChatMessage.id).where(ChatMessage.session_id == sid, ChatMessage.role == "assistant")
+        )
+
+    card = {"session_id": sid, "message_id": message_id, "card_index": 0, "card_front": "Term", "status": "reviewing"}
+    await call("POST /flashcards/progress", "POST", "/flashcards/progress", json=card)
+    await call("GET /flashcards/progress/{sid}/{mid}", "GET", f"/flashcards/progress/{sid}/{message_id}")
+    await call("GET /flashcards/due", "GET", "/flashcards/due")
+    await call("POST /messages/{id}/feedback", "POST", f"/messages/{message_id}/feedback", json={"feedback": "up"})
+    await call("POST /quiz/results", "POST", "/quiz/results", json={
+        "session_id": sid, "message_id": message_id, "topic": "t", "score": 1, "total_questions": 2, "answers": [],
+    })
+    await call("GET /analytics/summary", "GET", "/analytics/summary")
+    await call("DELETE /sessions/{id}", "DELETE", f"/sessions/{sid}")
+
+
+async def _explain(engine):
+    is_sqlite = engine.dialect.name == "sqlite"
+    findings = []
+    async with engine.connect() as conn:
+        if not is_sqlite:
+            await conn.exec_driver_sql("SET enable_seqscan = off")
+        for endpoint, statements in _captured.items():
+            for statement, params in statements.items():
+                prefix = "EXPLAIN QUERY PLAN " if is_sqlite else "EXPLAIN "
+                rows = (await conn.exec_driver_sql(prefix + statement, params)).all()
+                plan = [r[-1] for r in rows]
+                pattern = _SQLITE_SCAN if is_sqlite else _PG_SCAN
+                scans = sorted({m.group(1) for line in plan for m in [pattern.search(line.strip())] if m})
+                findings.append({
+                    "endpoint": endpoint,
+                    "sql": " ".join(statement.split())[:240],
+                    "plan": plan,
+                    "full_scans": scans,
+                })
+    return findings
+
+
+async def _run():
+    import httpx
+    from sqlalchemy import event
+
+    import main
+    from database import engine, init_db
+    from models_async import User
+    from routers.auth import _create_access_token
+
+    # No model calls: the message endpoint gets a canned flashcards answer.
+    def canned_answer(**kw):
+        return {
+            "answer": "Here are your cards.",
+            "artifacts": [{"artifact_type": "flashcards", "content": [{"front": "Term", "back": "Definition"}]}],
+        }
+
+    async def canned_answer_async(**kw):
+        return canned_answer(**kw)
+
+    main.ai_service.answer_with_tools = canned_answer
+    main.ai_service.answer_with_tools_async = canned_answer_async
+    main.memory_service.retrieve_relevant_memory = lambda *a, **kw: []
+    main.memory_service.get_user_preferences = lambda *a, **kw: ""
+    main.memory_service.store_interaction = lambda *a, **kw: None
+
+    await init_db()
+    from database import AsyncSessionLocal
+    async with AsyncSessionLocal() as db:
+        user = User(name="Explain", email=f"explain-{os.getpid()}@example.com", password_hash="x")
+        db.add(user)
+        await db.commit()
+
+    event.listen(engine.sync_engine, "before_cursor_execute", _capture)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://explain") as client:
+        await _exercise(client, {"Authorization": f"Bearer {_create_access_token(user)}"})
+    event.remove(engine.sync_engine, "before_cursor_execute", _capture)
+
+    try:
+        return await _explain(engine)
+    finally:
+        await engine.dispose()
+
+
+def main():
+    verbose = "-v" in sys.argv
+    try:
+        findings = asyncio.run(_run())
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+    flagged = [f for f in findings if f["full_scans"]]
+    for f in findings:
+        mark = "SCAN" if f["full_scans"] else " ok "
+        print(f"[{mark}] {f['endpoint']:<38} {f['sql'][:110]}")
+        if f["full_scans"] or verbose:
+            for line in f["plan"]:
+                print(f"         {line}")
+    print(json.dumps({"statements": len(findings), "full_scans": len(flagged)}))
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == "__main__":
+    main()
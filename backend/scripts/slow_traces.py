@@ -0,0 +1,142 @@
+"""Find the slowest traces in a file-exported trace log and show where the time went.
+
+Reads the JSON-lines files written with ``OTEL_TRACES_EXPORTER=file``
+(several processes' files can be combined: a Celery pipeline's spans are
+joined to the HTTP request that started it by trace id), then prints the
+slowest traces as span trees and a self-time breakdown by span name across
+them.
+
+Usage (from backend/):
+    python -m scripts.slow_traces [traces/*.jsonl ...] [--top 10] [--min-ms 0]
+        [--root "POST /sessions"] [--max-depth 6]
+"""
+
+import argparse
+import glob
+import json
+import sys
+from collections import defaultdict
+from datetime import datetime
+
+
+def _ts(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def load_spans(paths):
+    spans = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                raw = json.loads(line)
+                start, end = _ts(raw["start_time"]), _ts(raw["end_time"])
+                spans.append({
+                    "name": raw["name"],
+                    "trace_id": raw["context"]["trace_id"],
+                    "span_id": raw["context"]["span_id"],
+                    "parent_id": raw.get("parent_id"),
+                    "start": start,
+                    "ms": (end - start) * 1000,
+                    "error": raw.get("status", {}).get("status_code") == "ERROR",
+                    "attributes": raw.get("attributes") or {},
+                    "service": (raw.get("resource") or {}).get("attributes", {}).get("service.name", ""),
+                })
+    return spans
+
+
+def build_traces(spans):
+    """``{trace_id: {"spans", "roots", "children", "ms", "start"}}``."""
+    by_trace = defaultdict(list)
+    for s in spans:
+        by_trace[s["trace_id"]].append(s)
+    traces = {}
+    for trace_id, members in by_trace.items():
+        ids = {s["span_id"] for s in members}
+        children = defaultdict(list)
+        roots = []
+        for s in sorted(members, key=lambda s: s["start"]):
+            if s["parent_id"] in ids:
+                children[s["parent_id"]].append(s)
+            else:
+                roots.append(s)
+        start = min(s["start"] for s in members)
+        end = max(s["start"] + s["ms"] / 1000 for s in members)
+        traces[trace_id] = {
+            "spans": members, "roots": roots, "children": children,
+            "start": start, "ms": (end - start) * 1000,
+        }
+    return traces
+
+
+def self_times(trace) -> dict:
+    """Per span name: duration not covered by its children (overlap-safe lower bound)."""
+    out = defaultdict(float)
+    for s in trace["spans"]:
+        covered = sum(c["ms"] for c in trace["children"].get(s["span_id"], []))
+        out[s["name"]] += max(s["ms"] - covered, 0.0)
+    return out
+
+
+def _label(span) -> str:
+    keep = {k: v for k, v in span["attributes"].items()
+            if k in ("provider", "model", "operation", "texts", "chunks", "pages", "round",
+                     "http.route", "http.status_code", "celery.task_name", "db.statement")}
+    if "db.statement" in keep:
+        keep["db.statement"] = " ".join(str(keep["db.statement"]).split())[:60]
+    extra = " ".join(f"{k}={v}" for k, v in keep.items())
+    return f"{span['name']}{' [ERROR]' if span['error'] else ''}{' ' + extra if extra else ''}"
+
+
+def print_tree(trace, max_depth: int, out=sys.stdout):
+    def walk(span, depth):
+        offset = (span["start"] - trace["start"]) * 1000
+        print(f"  {'  ' * depth}{span['ms']:9.1f} ms  +{offset:8.1f}  {_label(span)}", file=out)
+        if depth + 1 < max_depth:
+            for child in trace["children"].get(span["span_id"], []):
+                walk(child, depth + 1)
+    for root in trace["roots"]:
+        walk(root, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", default=["traces/*.jsonl"])
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--min-ms", type=float, default=0.0, help="ignore traces faster than this")
+    parser.add_argument("--root", default="", help="only traces whose first root span name contains this")
+    parser.add_argument("--max-depth", type=int, default=6)
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.paths for p in glob.glob(pattern)})
+    if not paths:
+        parser.error(f"no trace files match {' '.join(args.paths)}")
+    traces = build_traces(load_spans(paths))
+    selected = sorted(
+        (t for t in traces.values()
+         if t["ms"] >= args.min_ms and args.root in (t["roots"][0]["name"] if t["roots"] else "")),
+        key=lambda t: t["ms"], reverse=True,
+    )[:args.top]
+    print(f"{len(traces)} traces in {len(paths)} file(s); showing the {len(selected)} slowest\n")
+
+    totals = defaultdict(float)
+    for trace in selected:
+        root = trace["roots"][0]
+        services = sorted({s["service"] for s in trace["spans"] if s["service"]})
+        print(f"{trace['ms']:.1f} ms  trace={root['trace_id']}  spans={len(trace['spans'])}  {', '.join(services)}")
+        print_tree(trace, args.max_depth)
+        print()
+        for name, ms in self_times(trace).items():
+            totals[name] += ms
+
+    if totals:
+        grand = sum(totals.values()) or 1.0
+        print("Self time across these traces:")
+        for name, ms in sorted(totals.items(), key=lambda kv: kv[1], reverse=True)[:15]:
+            print(f"  {ms:10.1f} ms  {ms / grand:6.1%}  {name}")
+
+
+if __name__ == "__main__":
+    main()
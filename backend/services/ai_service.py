@@ -1,12 +1,25 @@
 import os
+import asyncio
 import logging
 import base64
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager
 from typing import List, Dict, Optional
 from pathlib import Path
 
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings
 from langchain_core.embeddings import Embeddings as LCEmbeddings
+
+from config import Config
+from services.model_router import detect_tool_intent, log_outcome, route as route_request
+from services.provider_health import provider_health
+from services.provider_limits import current_lane, provider_limiter
+from services.usage import estimate_tokens, record_usage
+from utils.metrics import observe_embedding, observe_llm, observe_resilience
+from utils.timing import run_in_thread, span
 # NOTE: langchain_google_genai is NOT used for embeddings — its default v1beta endpoint
 # dropped support for text-embedding-004. We use a direct REST call to the stable v1 API.
 
@@ -58,20 +71,10 @@ class GeminiV1Embeddings(LCEmbeddings):
         )
 
     def _batch_embed(self, texts: List[str]) -> List[List[float]]:
-        payload = {
-            "requests": [
-                {
-                    "model": f"models/{self.model}",
-                    "content": {"parts": [{"text": t}]},
-                    "task_type": "RETRIEVAL_DOCUMENT",
-                }
-                for t in texts
-            ]
-        }
         resp = self._requests.post(
             self._batch_url,
             params={"key": self.api_key},
-            json=payload,
+            json=self._batch_payload(texts),
             timeout=60,
         )
         if not resp.ok:
@@ -81,6 +84,25 @@ class GeminiV1Embeddings(LCEmbeddings):
         # NOT {"embeddings": [{"embedding": {"values": [...]}}]} — that's the single embedContent format
         return [item["values"] for item in data["embeddings"]]
 
+    def _batch_payload(self, texts: List[str]) -> Dict:
+        return {
+            "requests": [
+                {
+                    "model": f"models/{self.model}",
+                    "content": {"parts": [{"text": t}]},
+                    "task_type": "RETRIEVAL_DOCUMENT",
+                }
+                for t in texts
+            ]
+        }
+
+    def _query_payload(self, text: str) -> Dict:
+        return {
+            "model": f"models/{self.model}",
+            "content": {"parts": [{"text": text}]},
+            "task_type": "RETRIEVAL_QUERY",
+        }
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Embed a list of documents (batched to 100 per call)."""
         results = []
@@ -88,17 +110,36 @@ class GeminiV1Embeddings(LCEmbeddings):
             results.extend(self._batch_embed(texts[i : i + 100]))
         return results
 
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """``embed_documents`` over httpx's async client (no thread held while waiting)."""
+        import httpx
+
+        results = []
+        async with httpx.AsyncClient(timeout=60) as client:
+            for i in range(0, len(texts), 100):
+                resp = await client.post(
+                    self._batch_url, params={"key": self.api_key}, json=self._batch_payload(texts[i : i + 100]),
+                )
+                if resp.status_code >= 400:
+                    raise RuntimeError(f"Error embedding content: {resp.status_code} {resp.text}")
+                results.extend(item["values"] for item in resp.json()["embeddings"])
+        return results
+
+    async def aembed_query(self, text: str) -> List[float]:
+        import httpx
+
+        async with httpx.AsyncClient(timeout=60) as client:
+            resp = await client.post(self._embed_url, params={"key": self.api_key}, json=self._query_payload(text))
+        if resp.status_code >= 400:
+            raise RuntimeError(f"Error embedding query: {resp.status_code} {resp.text}")
+        return resp.json()["embedding"]["values"]
+
     def embed_query(self, text: str) -> List[float]:
         """Embed a single query string."""
-        payload = {
-            "model": f"models/{self.model}",
-            "content": {"parts": [{"text": text}]},
-            "task_type": "RETRIEVAL_QUERY",
-        }
         resp = self._requests.post(
             self._embed_url,
             params={"key": self.api_key},
-            json=payload,
+            json=self._query_payload(text),
             timeout=60,
         )
         if not resp.ok:
@@ -106,6 +147,305 @@ class GeminiV1Embeddings(LCEmbeddings):
         return resp.json()["embedding"]["values"]
 
 
+class TimedEmbeddings(LCEmbeddings):
+    """Wraps an embeddings provider so each call is an ``embed.*`` timing span.
+
+    This is the object Chroma holds as its embedding function, so vector
+    queries show their embedding time separately from the search itself.
+    Calls are also counted for usage accounting, with estimated tokens, and
+    go through the provider limiter.
+    """
+
+    def __init__(self, inner: LCEmbeddings, provider: str, model: str):
+        self.inner = inner
+        self.provider = provider
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        tokens = estimate_tokens(texts)
+        with span("embed.documents", texts=len(texts)), provider_limiter.limit(self.provider, self.model, tokens):
+            start = time.perf_counter()
+            vectors = self.inner.embed_documents(texts)
+        observe_embedding("documents", len(texts), time.perf_counter() - start)
+        record_usage(self.provider, self.model, tokens)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        tokens = estimate_tokens([text])
+        with span("embed.query"), provider_limiter.limit(self.provider, self.model, tokens):
+            start = time.perf_counter()
+            vector = self.inner.embed_query(text)
+        observe_embedding("query", 1, time.perf_counter() - start)
+        record_usage(self.provider, self.model, tokens)
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        tokens = estimate_tokens(texts)
+        with span("embed.documents", texts=len(texts)):
+            async with provider_limiter.limit_async(self.provider, self.model, tokens):
+                start = time.perf_counter()
+                vectors = await self.inner.aembed_documents(texts)
+        observe_embedding("documents", len(texts), time.perf_counter() - start)
+        record_usage(self.provider, self.model, tokens)
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        tokens = estimate_tokens([text])
+        with span("embed.query"):
+            async with provider_limiter.limit_async(self.provider, self.model, tokens):
+                start = time.perf_counter()
+                vector = await self.inner.aembed_query(text)
+        observe_embedding("query", 1, time.perf_counter() - start)
+        record_usage(self.provider, self.model, tokens)
+        return vector
+
+
+def _token_usage(response) -> tuple:
+    """(prompt_tokens, completion_tokens) from an OpenAI or Gemini response; None where absent."""
+    usage = getattr(response, "usage", None)  # OpenAI
+    if usage is not None:
+        return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+    meta = getattr(response, "usage_metadata", None)  # Gemini
+    if meta is not None:
+        return getattr(meta, "prompt_token_count", None), getattr(meta, "candidates_token_count", None)
+    return None, None
+
+
+# Completion tokens reserved in the provider limiter until the real count is known.
+_COMPLETION_RESERVE = 512
+
+
+def _prompt_tokens(payload) -> int:
+    """Rough token count of a prompt (text, OpenAI messages or Gemini contents); inline images are skipped."""
+    chars = 0
+    stack = [payload]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            chars += len(item)
+        elif isinstance(item, dict):
+            stack.extend(v for k, v in item.items() if k not in ("inline_data", "image_url"))
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return chars // 4
+
+
+def _finish_call(provider: str, model: str, kind: str, call: dict, permit, seconds: float, outcome: str) -> None:
+    prompt_tokens, completion_tokens = _token_usage(call.get("response"))
+    observe_llm(provider, model, kind, seconds, prompt_tokens, completion_tokens, outcome)
+    if call.get("response") is not None:
+        if prompt_tokens is not None:
+            permit.settle(prompt_tokens + (completion_tokens or 0))
+        record_usage(provider, model, prompt_tokens, completion_tokens)
+
+
+@contextmanager
+def _llm_call(provider: str, model: str, kind: str, prompt=None, **fields):
+    """Breaker check, limiter slot, timing span, metrics and usage accounting around one provider request.
+
+    ``prompt`` (what is sent) sizes the limiter's token reservation. Set
+    ``call["response"]`` to the provider response so its token usage is counted.
+    Raises ``CircuitOpenError`` without calling the provider while its breaker is open.
+    """
+    call = {}
+    with span(f"llm.{kind}", provider=provider, model=model, **fields) as span_fields:
+        provider_health.check(provider, model)
+        start = None
+        error = None
+        try:
+            with provider_limiter.limit(provider, model, _prompt_tokens(prompt) + _COMPLETION_RESERVE) as permit:
+                span_fields["queued_ms"] = round(permit.waited * 1000, 1)
+                start = time.perf_counter()
+                outcome = "error"
+                try:
+                    yield call
+                    outcome = "ok"
+                finally:
+                    _finish_call(provider, model, kind, call, permit, time.perf_counter() - start, outcome)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            seconds = time.perf_counter() - start if start is not None else 0.0
+            provider_health.record(provider, model, kind, seconds, error)
+
+
+@asynccontextmanager
+async def _llm_call_async(provider: str, model: str, kind: str, prompt=None, **fields):
+    """``_llm_call`` for coroutines; the limiter queues on the event loop."""
+    call = {}
+    with span(f"llm.{kind}", provider=provider, model=model, **fields) as span_fields:
+        provider_health.check(provider, model)
+        start = None
+        error = None
+        try:
+            async with provider_limiter.limit_async(
+                provider, model, _prompt_tokens(prompt) + _COMPLETION_RESERVE,
+            ) as permit:
+                span_fields["queued_ms"] = round(permit.waited * 1000, 1)
+                start = time.perf_counter()
+                outcome = "error"
+                try:
+                    yield call
+                    outcome = "ok"
+                finally:
+                    _finish_call(provider, model, kind, call, permit, time.perf_counter() - start, outcome)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            seconds = time.perf_counter() - start if start is not None else 0.0
+            provider_health.record(provider, model, kind, seconds, error)
+
+
+def _hedge_delay(provider: str, model: str, kind: str) -> Optional[float]:
+    return provider_health.hedge_delay(provider, model, kind) if current_lane() == "interactive" else None
+
+
+# Hedged attempts run here so the caller can return as soon as either finishes.
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+
+
+def _provider_call(provider: str, model: str, kind: str, request, prompt=None, **fields):
+    """Run ``request()`` (one provider request) inside ``_llm_call`` and return its response.
+
+    With hedging enabled, an interactive call still running after the model's
+    p95 latency fires a second identical call and the first to succeed wins.
+    The loser runs to completion in the background and is accounted normally.
+    """
+    def attempt(**extra):
+        with _llm_call(provider, model, kind, prompt=prompt, **fields, **extra) as call:
+            call["response"] = request()
+        return call["response"]
+
+    delay = _hedge_delay(provider, model, kind)
+    if delay is None:
+        return attempt()
+
+    primary = _hedge_pool.submit(contextvars.copy_context().run, attempt)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    observe_resilience(provider, model, "hedge_fired")
+    hedge = _hedge_pool.submit(contextvars.copy_context().run, attempt, hedge=True)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    observe_resilience(provider, model, "hedge_won")
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+async def _provider_call_async(provider: str, model: str, kind: str, request, prompt=None, **fields):
+    """``_provider_call`` for coroutines: ``request()`` returns an awaitable, and a losing hedge is cancelled."""
+    async def attempt(**extra):
+        async with _llm_call_async(provider, model, kind, prompt=prompt, **fields, **extra) as call:
+            call["response"] = await request()
+        return call["response"]
+
+    delay = _hedge_delay(provider, model, kind)
+    if delay is None:
+        return await attempt()
+
+    tasks = [asyncio.ensure_future(attempt())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            observe_resilience(provider, model, "hedge_fired")
+            tasks.append(asyncio.ensure_future(attempt(hedge=True)))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            errors = [task.exception() for task in done if task.exception() is not None]
+            winners = [task for task in done if task.exception() is None]
+            if winners:
+                if winners[0] is not tasks[0]:
+                    observe_resilience(provider, model, "hedge_won")
+                return winners[0].result()
+            error = errors[-1]
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# ── Sync and async drivers ──────────────────────────────────────────────
+# answer_from_context and answer_with_tools are written once, as generators
+# that yield the I/O they need (_Request, _ToolCall) and get the result sent
+# back (or the exception thrown in). _drive runs the steps on the calling
+# thread with the sync clients (Celery, tools); _drive_async awaits them with
+# the async clients, so an API request holds no thread while the provider works.
+class _Request:
+    """One provider request; ``call``/``acall`` send it with the sync/async client."""
+
+    def __init__(self, provider: str, model: str, kind: str, call, acall, prompt=None, **fields):
+        self.provider, self.model, self.kind = provider, model, kind
+        self.call, self.acall = call, acall
+        self.prompt, self.fields = prompt, fields
+
+    def run(self):
+        return _provider_call(self.provider, self.model, self.kind, self.call, prompt=self.prompt, **self.fields)
+
+    async def run_async(self):
+        return await _provider_call_async(
+            self.provider, self.model, self.kind, self.acall, prompt=self.prompt, **self.fields,
+        )
+
+
+class _ToolCall:
+    """One tool execution; tools are synchronous, so the async driver runs them in a thread."""
+
+    def __init__(self, executor, name: str, args: dict, session_id: str, user_id: int):
+        self.executor, self.name, self.args = executor, name, args
+        self.session_id, self.user_id = session_id, user_id
+
+    def run(self):
+        return self.executor.execute(self.name, self.args, self.session_id, self.user_id)
+
+    async def run_async(self):
+        return await run_in_thread(self.executor.execute, self.name, self.args, self.session_id, self.user_id)
+
+
+def _drive(steps):
+    value = error = None
+    while True:
+        try:
+            step = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as done:
+            return done.value
+        value = error = None
+        try:
+            value = step.run()
+        except Exception as e:
+            error = e
+
+
+async def _drive_async(steps):
+    value = error = None
+    while True:
+        try:
+            step = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as done:
+            return done.value
+        value = error = None
+        try:
+            value = await step.run_async()
+        except Exception as e:
+            error = e
+
+
+def _provider_key(provider: str) -> Optional[str]:
+    if provider == "gemini":
+        return os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+    return os.getenv("OPENAI_API_KEY")
+
+
 if _provider == "gemini":
     AI_PROVIDER = "gemini"
 elif _provider == "openai":
@@ -119,16 +459,6 @@ else:
 
 logger.info(f"AI provider: {AI_PROVIDER}")
 
-# Lazy imports based on provider
-genai = None
-OpenAI = None
-
-if AI_PROVIDER == "gemini":
-    import google.generativeai as genai  # noqa: F811
-elif AI_PROVIDER == "openai":
-    from openai import OpenAI  # noqa: F811
-
-
 
 # ── Persona definitions ────────────────────────────────────────────────
 
@@ -282,6 +612,19 @@ def get_persona_prompt(persona: str = "academic", file_type: str = "pdf") -> str
     return PersonaManager.system_prompt(persona, file_type)
 
 
+def _gemini_schema(schema):
+    """Drop JSON-schema keywords that Gemini's OpenAPI-subset ``response_schema`` rejects."""
+    if isinstance(schema, dict):
+        return {
+            k: _gemini_schema(v)
+            for k, v in schema.items()
+            if k not in ("additionalProperties", "strict")
+        }
+    if isinstance(schema, list):
+        return [_gemini_schema(v) for v in schema]
+    return schema
+
+
 # ── AI Service (dual-provider: Gemini + OpenAI) ────────────────────────
 
 class AIService:
@@ -301,6 +644,10 @@ class AIService:
     OPENAI_RESPONSE_MODEL = os.getenv("OPENAI_RESPONSE_MODEL", "gpt-4o")
     OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
 
+    # Smaller models for chat requests the router classifies as easy (MODEL_ROUTING=on)
+    GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-2.0-flash-lite")
+    OPENAI_FAST_MODEL = os.getenv("OPENAI_FAST_MODEL", "gpt-4o-mini")
+
     # Backward-compatible aliases
     CHAT_MODEL = GEMINI_CHAT_MODEL if AI_PROVIDER == "gemini" else OPENAI_CHAT_MODEL
     RESPONSE_MODEL = GEMINI_RESPONSE_MODEL if AI_PROVIDER == "gemini" else OPENAI_RESPONSE_MODEL
@@ -308,6 +655,7 @@ class AIService:
     def __init__(self):
         self.provider = AI_PROVIDER
         self._openai_client_instance = None
+        self._async_openai_client_instance = None
         self._gemini_configured = False
 
         if self.provider == "gemini":
@@ -316,20 +664,20 @@ class AIService:
                 logger.warning("Gemini API key not found. Embeddings will fail if called.")
             else:
                 # We do not globally configure genai here to avoid crashing if it's missing but not used
-                self.embeddings = GeminiV1Embeddings(
+                self.embeddings = TimedEmbeddings(GeminiV1Embeddings(
                     api_key=api_key,
                     model=self.GEMINI_EMBEDDING_MODEL,
                     api_version=self.GEMINI_EMBEDDING_API_VERSION,
-                )
+                ), "gemini", self.GEMINI_EMBEDDING_MODEL)
         else:
             api_key = os.getenv("OPENAI_API_KEY")
             if not api_key:
                 logger.warning("OPENAI API key not found. Embeddings will fail if called.")
             else:
-                self.embeddings = OpenAIEmbeddings(
+                self.embeddings = TimedEmbeddings(OpenAIEmbeddings(
                     model=self.OPENAI_EMBEDDING_MODEL,
                     openai_api_key=api_key,
-                )
+                ), "openai", self.OPENAI_EMBEDDING_MODEL)
 
     @property
     def openai_client(self):
@@ -341,21 +689,105 @@ class AIService:
             self._openai_client_instance = _OpenAI(api_key=api_key)
         return self._openai_client_instance
 
+    @property
+    def async_openai_client(self):
+        """AsyncOpenAI for the ``*_async`` methods; like Gemini's async client it is bound to one event loop."""
+        if self._async_openai_client_instance is None:
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                raise ValueError("OPENAI_API_KEY environment variable is required to use OpenAI models.")
+            from openai import AsyncOpenAI
+            self._async_openai_client_instance = AsyncOpenAI(api_key=api_key)
+        return self._async_openai_client_instance
+
     @property
     def gemini_client(self):
+        # Imported on first use, so OpenAI-only deployments never load the Gemini SDK.
+        import google.generativeai as _genai
         if not self._gemini_configured:
             api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
             if not api_key:
                 raise ValueError("GOOGLE_API_KEY (or GEMINI_API_KEY) environment variable is required to use Gemini models.")
-            genai.configure(api_key=api_key)
+            _genai.configure(api_key=api_key)
             self._gemini_configured = True
-        return genai
+        return _genai
 
     @property
     def client(self):
         """Backward compat: returns OpenAI client for TTS etc."""
         return self.openai_client
 
+    # ── Provider selection and failover ────────────────────────────────
+    def _provider_for(self, model_override: Optional[str]) -> str:
+        if model_override:
+            if model_override.startswith("gpt") or model_override.startswith("o"):
+                return "openai"
+            if model_override.startswith("gemini"):
+                return "gemini"
+            logger.warning(f"Unmapped model_override '{model_override}', falling back to {self.provider}")
+        return self.provider
+
+    def _model_for(self, provider: str, model_override: Optional[str]) -> str:
+        if model_override:
+            return model_override
+        return self.GEMINI_CHAT_MODEL if provider == "gemini" else self.OPENAI_CHAT_MODEL
+
+    def _chat_model(self, provider: str, route=None) -> str:
+        """The provider's chat model, or its fast model when the router picked it and it is healthy."""
+        if provider == "gemini":
+            full, fast = self.GEMINI_CHAT_MODEL, self.GEMINI_FAST_MODEL
+        else:
+            full, fast = self.OPENAI_CHAT_MODEL, self.OPENAI_FAST_MODEL
+        if route is not None and route.use_fast and not provider_health.is_open(provider, fast):
+            return fast
+        return full
+
+    def _candidates(self, model_override: Optional[str]) -> List[tuple]:
+        """(provider, model_override) pairs to try in order.
+
+        The requested provider, then the configured default (with its default
+        model), then, with LLM_FAILOVER_ENABLED, the other provider if its API
+        key is set. Deep-think requests stay on the other provider's response
+        model. Candidates whose circuit is open are skipped.
+        """
+        provider = self._provider_for(model_override)
+        candidates = [(provider, model_override)]
+        if provider != self.provider:
+            candidates.append((self.provider, None))
+        if Config.LLM_FAILOVER_ENABLED:
+            for other in ("gemini", "openai"):
+                if all(p != other for p, _ in candidates) and _provider_key(other):
+                    response_model = self.GEMINI_RESPONSE_MODEL if other == "gemini" else self.OPENAI_RESPONSE_MODEL
+                    candidates.append((other, response_model if model_override else None))
+        healthy = [(p, m) for p, m in candidates if not provider_health.is_open(p, self._model_for(p, m))]
+        return healthy or candidates[:1]
+
+    def _openai_request(self, kind: str, prompt=None, fields: Optional[Dict] = None, **kwargs) -> _Request:
+        """A chat.completions request that either OpenAI client can send."""
+        return _Request(
+            "openai", kwargs["model"], kind,
+            lambda: self.openai_client.chat.completions.create(**kwargs),
+            lambda: self.async_openai_client.chat.completions.create(**kwargs),
+            prompt=prompt, **(fields or {}),
+        )
+
+    @staticmethod
+    def _gemini_request(model, model_name: str, kind: str, contents, fields: Optional[Dict] = None) -> _Request:
+        """A generate_content request on ``model`` (sync or async)."""
+        return _Request(
+            "gemini", model_name, kind,
+            lambda: model.generate_content(contents),
+            lambda: model.generate_content_async(contents),
+            prompt=contents, **(fields or {}),
+        )
+
+    def _failed_over(self, candidates: List[tuple], index: int, operation: str) -> None:
+        if index:
+            provider, model_override = candidates[index]
+            model = self._model_for(provider, model_override)
+            logger.warning(f"{operation} failed over from {candidates[0][0]} to {provider} (model={model})")
+            observe_resilience(provider, model, "failover")
+
     # ── Answer from context ─────────────────────────────────────────────
     def answer_from_context(
         self,
@@ -367,49 +799,47 @@ class AIService:
         file_type: str = "pdf",
         image_paths: Optional[List[str]] = None,
     ) -> Optional[str]:
-        provider = self.provider
-        if model_override:
-            if model_override.startswith("gpt") or model_override.startswith("o"):
-                provider = "openai"
-            elif model_override.startswith("gemini"):
-                provider = "gemini"
-            else:
-                logger.warning(f"Unmapped model_override '{model_override}', falling back to {provider}")
+        return _drive(self._answer_steps(
+            context_chunks, question, chat_history, model_override, persona, file_type, image_paths,
+        ))
 
-        try:
-            if provider == "gemini":
-                # Ensure client is available
-                _ = self.gemini_client
-                return self._answer_gemini(
-                    context_chunks, question, chat_history,
-                    model_override, persona, file_type, image_paths,
-                )
-            else:
-                _ = self.openai_client
-                return self._answer_openai(
+    async def answer_from_context_async(
+        self,
+        context_chunks: List[str],
+        question: str,
+        chat_history: List[Dict],
+        model_override: str = None,
+        persona: str = "academic",
+        file_type: str = "pdf",
+        image_paths: Optional[List[str]] = None,
+    ) -> Optional[str]:
+        """``answer_from_context`` on the async provider clients, for the API's event loop."""
+        return await _drive_async(self._answer_steps(
+            context_chunks, question, chat_history, model_override, persona, file_type, image_paths,
+        ))
+
+    def _answer_steps(self, context_chunks, question, chat_history, model_override, persona, file_type, image_paths):
+        if not question.strip():
+            logger.error("Empty question provided")
+            return None
+
+        candidates = self._candidates(model_override)
+        for index, (provider, override) in enumerate(candidates):
+            error = None
+            try:
+                answer_fn = self._answer_gemini if provider == "gemini" else self._answer_openai
+                answer = yield from answer_fn(
                     context_chunks, question, chat_history,
-                    model_override, persona, file_type, image_paths,
+                    override, persona, file_type, image_paths,
                 )
-        except Exception as e:
-            logger.error(f"Failed to use provider {provider}: {str(e)}. Falling back to default provider {self.provider}")
-            
-            # Fallback to default configured provider if custom override failed
-            if provider != self.provider:
-                try:
-                    if self.provider == "gemini":
-                        return self._answer_gemini(
-                            context_chunks, question, chat_history,
-                            None, persona, file_type, image_paths, # Force default model
-                        )
-                    else:
-                        return self._answer_openai(
-                            context_chunks, question, chat_history,
-                            None, persona, file_type, image_paths,
-                        )
-                except Exception as fallback_e:
-                    logger.error(f"Fallback generation failed: {str(fallback_e)}")
-            
-            return f"System Error: Unable to communicate with the AI provider. {str(e)}"
+            except Exception as e:
+                error, answer = e, None
+            if answer is not None:
+                self._failed_over(candidates, index, "Answer")
+                return answer
+            logger.error(f"Failed to use provider {provider}" + (f": {error}" if error else ""))
+
+        return "System Error: Unable to communicate with the AI provider." + (f" {error}" if error else "")
 
     # ── Gemini implementation ───────────────────────────────────────────
     def _answer_gemini(
@@ -477,7 +907,7 @@ class AIService:
                         logger.warning(f"Could not attach image {img_path}: {e}")
 
             contents.append({"role": "user", "parts": user_parts})
-            response = model.generate_content(contents)
+            response = yield self._gemini_request(model, model_name, "answer", contents)
             answer = response.text
             logger.info(f"Gemini answered ({len(context_chunks)} chunks, model={model_name}, images={len(image_paths or [])})")
             return answer
@@ -539,10 +969,7 @@ class AIService:
                 messages.append({"role": "user", "content": text_part})
 
             model = model_override or self.OPENAI_CHAT_MODEL
-            response = self.openai_client.chat.completions.create(
-                model=model,
-                messages=messages,
-            )
+            response = yield self._openai_request("answer", prompt=messages, model=model, messages=messages)
             answer = response.choices[0].message.content
             logger.info(f"OpenAI answered ({len(context_chunks)} chunks, model={model})")
             return answer
@@ -551,6 +978,115 @@ class AIService:
             logger.error(f"OpenAI error: {e}")
             return None
 
+    # ── Structured (schema-constrained) generation ─────────────────────
+    def generate_structured(
+        self,
+        context_chunks: List[str],
+        instruction: str,
+        item_schema: Dict,
+        schema_name: str,
+        model_override: str = None,
+        persona: str = "academic",
+    ) -> Optional[List[Dict]]:
+        """Generate a JSON array of objects matching ``item_schema``.
+
+        The schema is enforced by the provider (OpenAI ``response_format`` with
+        a strict JSON schema, Gemini ``response_schema``), so the response never
+        needs free-text scanning. Returns None if the call fails or the
+        provider returns something that is not a list.
+        """
+        candidates = self._candidates(model_override)
+        for index, (provider, override) in enumerate(candidates):
+            try:
+                if provider == "gemini":
+                    items = self._structured_gemini(
+                        context_chunks, instruction, item_schema, override, persona,
+                    )
+                else:
+                    items = self._structured_openai(
+                        context_chunks, instruction, item_schema, schema_name, override, persona,
+                    )
+                self._failed_over(candidates, index, "Structured generation")
+                break
+            except Exception as e:
+                logger.error(f"Structured generation failed (provider={provider}, schema={schema_name}): {e}")
+        else:
+            return None
+
+        if not isinstance(items, list):
+            logger.error(f"Structured generation returned non-list (provider={provider}, schema={schema_name})")
+            return None
+        return items
+
+    def _structured_openai(
+        self, context_chunks, instruction, item_schema, schema_name, model_override, persona,
+    ) -> Optional[List[Dict]]:
+        import json
+
+        context = "\n\n---\n\n".join(context_chunks) if context_chunks else ""
+        user_text = f"Context from the document:\n\n{context}\n\n---\n\n{instruction}" if context else instruction
+        # Strict mode requires an object at the root, so the array is wrapped.
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": schema_name,
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {"items": {"type": "array", "items": item_schema}},
+                    "required": ["items"],
+                    "additionalProperties": False,
+                },
+            },
+        }
+        model = model_override or self.OPENAI_CHAT_MODEL
+        response = _provider_call(
+            "openai", model, "structured",
+            lambda: self.openai_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": PersonaManager.system_prompt(persona)},
+                    {"role": "user", "content": user_text},
+                ],
+                response_format=response_format,
+            ),
+            prompt=user_text, schema=schema_name,
+        )
+        message = response.choices[0].message
+        if getattr(message, "refusal", None):
+            logger.warning(f"OpenAI refused structured request (schema={schema_name}): {message.refusal}")
+            return None
+        items = json.loads(message.content or "{}").get("items")
+        logger.info(f"OpenAI structured answer (schema={schema_name}, model={model}, items={len(items or [])})")
+        return items
+
+    def _structured_gemini(
+        self, context_chunks, instruction, item_schema, model_override, persona,
+    ) -> Optional[List[Dict]]:
+        import json
+
+        context = "\n\n---\n\n".join(context_chunks) if context_chunks else ""
+        user_text = f"Context from the document:\n\n{context}\n\n---\n\n{instruction}" if context else instruction
+        model_name = model_override or self.GEMINI_CHAT_MODEL
+        model = self.gemini_client.GenerativeModel(
+            model_name=model_name,
+            system_instruction=PersonaManager.system_prompt(persona),
+        )
+        response = _provider_call(
+            "gemini", model_name, "structured",
+            lambda: model.generate_content(
+                [{"role": "user", "parts": [user_text]}],
+                generation_config={
+                    "response_mime_type": "application/json",
+                    "response_schema": {"type": "array", "items": _gemini_schema(item_schema)},
+                },
+            ),
+            prompt=user_text,
+        )
+        items = json.loads(response.text)
+        logger.info(f"Gemini structured answer (model={model_name}, items={len(items) if isinstance(items, list) else 0})")
+        return items
+
     # ── Agentic answer with tool calling ──────────────────────────────
     def answer_with_tools(
         self,
@@ -565,30 +1101,68 @@ class AIService:
         memory_context: str = "",
         preference_context: str = "",
     ) -> Dict:
-        """Agentic loop: send message, handle tool calls, return final answer + artifacts."""
-        provider = self.provider
-        if model_override:
-            if model_override.startswith("gpt") or model_override.startswith("o"):
-                provider = "openai"
-            elif model_override.startswith("gemini"):
-                provider = "gemini"
-            else:
-                logger.warning(f"Unmapped model_override '{model_override}', falling back to {provider}")
+        """Agentic loop: send message, handle tool calls, return final answer + artifacts.
+
+        Without a model override the request is routed by complexity
+        (services/model_router.py). A provider that fails before its first
+        round completes (no tool has run yet) is failed over like
+        ``answer_from_context``.
+        """
+        return _drive(self._agentic_steps(
+            question, chat_history, tool_executor, session_id, user_id,
+            persona, file_type, model_override, memory_context, preference_context,
+        ))
+
+    async def answer_with_tools_async(
+        self,
+        question: str,
+        chat_history: List[Dict],
+        tool_executor,
+        session_id: str,
+        user_id: int,
+        persona: str = "academic",
+        file_type: str = "pdf",
+        model_override: str = None,
+        memory_context: str = "",
+        preference_context: str = "",
+    ) -> Dict:
+        """``answer_with_tools`` on the async provider clients; tools still run in a worker thread."""
+        return await _drive_async(self._agentic_steps(
+            question, chat_history, tool_executor, session_id, user_id,
+            persona, file_type, model_override, memory_context, preference_context,
+        ))
 
-        if provider == "gemini":
-            return self._agentic_gemini(
-                question, chat_history, tool_executor, session_id, user_id,
-                persona, file_type, model_override, memory_context, preference_context,
-            )
-        else:
-            return self._agentic_openai(
-                question, chat_history, tool_executor, session_id, user_id,
-                persona, file_type, model_override, memory_context, preference_context,
+    def _agentic_steps(
+        self, question, chat_history, tool_executor, session_id, user_id,
+        persona, file_type, model_override, memory_context, preference_context,
+    ):
+        route = route_request(question, chat_history, model_override)
+        start = time.perf_counter()
+        result = {"answer": "I encountered an error processing your request.", "sources": [], "artifacts": [], "suggestions": []}
+        candidates = self._candidates(model_override)
+        for index, (provider, override) in enumerate(candidates):
+            agentic_fn = self._agentic_gemini if provider == "gemini" else self._agentic_openai
+            try:
+                result = yield from agentic_fn(
+                    question, chat_history, tool_executor, session_id, user_id,
+                    persona, file_type, override, memory_context, preference_context, route,
+                )
+            except Exception as e:
+                logger.error(f"{provider} agentic call failed: {e}")
+                continue
+            self._failed_over(candidates, index, "Agentic answer")
+            break
+        if route is not None:
+            # Only completed loops report tool_calls; the error replies do not.
+            log_outcome(
+                route, "ok" if "tool_calls" in result else "error", time.perf_counter() - start,
+                len(result.get("answer") or ""), [tc["tool"] for tc in result.get("tool_calls", [])],
             )
+        return result
 
     def _agentic_openai(
         self, question, chat_history, tool_executor, session_id, user_id,
-        persona, file_type, model_override, memory_context, preference_context,
+        persona, file_type, model_override, memory_context, preference_context, route=None,
     ) -> Dict:
         from services.tools import TOOL_DEFINITIONS
         import json
@@ -616,27 +1190,20 @@ class AIService:
                 messages.append({"role": entry["role"], "content": entry["content"]})
         messages.append({"role": "user", "content": question})
 
-        model = model_override or self.OPENAI_CHAT_MODEL
+        model = model_override or self._chat_model("openai", route)
         artifacts = []
         tool_calls_log = []
         max_rounds = 3
 
-        # Map keyword → exact tool name to force on the first round.
+        # Keyword-detected tool to force on the first round.
         # Using {"type": "function", "function": {"name": "..."}} forces the model
         # to call THAT specific tool — it cannot satisfy the requirement by calling
         # a different one (e.g. search_documents) and then answering in text.
-        _q_lower = question.lower()
-        _forced_tool: str | None = None
-        if any(kw in _q_lower for kw in ("flashcard", "flash card", "study card", "spaced repetition")):
-            _forced_tool = "generate_flashcards"
-        elif any(kw in _q_lower for kw in ("quiz", "test me", "multiple choice", "test my knowledge")):
-            _forced_tool = "generate_quiz"
-        elif any(kw in _q_lower for kw in ("study guide", "outline", "summarize")):
-            _forced_tool = "create_study_guide"
-        elif any(kw in _q_lower for kw in ("diagram", "mind map", "visualization", "chart")):
-            _forced_tool = "generate_visualization"
+        _forced_tool = detect_tool_intent(question)
 
         for _round in range(max_rounds):
+            if route is not None:
+                route.model, route.rounds = model, _round + 1
             # Round 0: force the specific tool if one was detected.
             # Later rounds: fall back to auto so the model can process tool results.
             if _round == 0 and _forced_tool:
@@ -645,13 +1212,14 @@ class AIService:
                 _tool_choice = "auto"
 
             try:
-                response = self.openai_client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    tools=TOOL_DEFINITIONS,
-                    tool_choice=_tool_choice,
+                # A snapshot of the messages, since a hedged call may still be sending them.
+                response = yield self._openai_request(
+                    "round", prompt=messages, fields={"round": _round},
+                    model=model, messages=list(messages), tools=TOOL_DEFINITIONS, tool_choice=_tool_choice,
                 )
             except Exception as e:
+                if _round == 0:
+                    raise  # nothing has run yet; answer_with_tools can fail over
                 logger.error(f"OpenAI agentic call failed: {e}")
                 return {"answer": "I encountered an error processing your request.", "sources": [], "artifacts": [], "suggestions": []}
 
@@ -660,6 +1228,7 @@ class AIService:
 
             if choice.finish_reason == "tool_calls" or (choice.message.tool_calls and len(choice.message.tool_calls) > 0):
                 messages.append(choice.message)
+                round_results = []
 
                 for tc in choice.message.tool_calls:
                     fn_name = tc.function.name
@@ -671,8 +1240,9 @@ class AIService:
                     if model_override:
                         fn_args["model"] = model_override
 
-                    result = tool_executor.execute(fn_name, fn_args, session_id, user_id)
+                    result = yield _ToolCall(tool_executor, fn_name, fn_args, session_id, user_id)
                     tool_calls_log.append({"tool": fn_name, "args": fn_args, "result_keys": list(result.keys())})
+                    round_results.append((fn_name, result))
 
                     if result.get("artifact_type"):
                         artifacts.append(result)
@@ -682,6 +1252,10 @@ class AIService:
                         "tool_call_id": tc.id,
                         "content": json.dumps(result),
                     })
+
+                if route is not None and route.observe_tool_results(round_results):
+                    model = self._chat_model("openai", route)
+                    logger.info(f"Routing escalated to {model} ({route.escalated})")
             else:
                 answer = choice.message.content or ""
                 sources, suggestions = self._parse_response_extras(answer, tool_calls_log)
@@ -694,10 +1268,11 @@ class AIService:
                 }
 
         # Max rounds reached — get final response
+        if route is not None:
+            route.model, route.rounds = model, max_rounds + 1
         try:
-            response = self.openai_client.chat.completions.create(
-                model=model,
-                messages=messages,
+            response = yield self._openai_request(
+                "round", prompt=messages, fields={"round": max_rounds}, model=model, messages=messages,
             )
             answer = response.choices[0].message.content or ""
         except Exception:
@@ -714,7 +1289,7 @@ class AIService:
 
     def _agentic_gemini(
         self, question, chat_history, tool_executor, session_id, user_id,
-        persona, file_type, model_override, memory_context, preference_context,
+        persona, file_type, model_override, memory_context, preference_context, route=None,
     ) -> Dict:
         from services.tools import GEMINI_TOOL_DEFINITIONS
         import json
@@ -736,13 +1311,17 @@ class AIService:
         if model_override:
             system_instruction += "\n\nThink step by step. Be thorough, exhaustive, and analytical."
 
-        model_name = model_override or self.GEMINI_CHAT_MODEL
         gemini_genai = self.gemini_client
-        model = gemini_genai.GenerativeModel(
-            model_name=model_name,
-            system_instruction=system_instruction,
-            tools=[{"function_declarations": GEMINI_TOOL_DEFINITIONS}],
-        )
+
+        def build_model(name):
+            return gemini_genai.GenerativeModel(
+                model_name=name,
+                system_instruction=system_instruction,
+                tools=[{"function_declarations": GEMINI_TOOL_DEFINITIONS}],
+            )
+
+        model_name = model_override or self._chat_model("gemini", route)
+        model = build_model(model_name)
 
         contents = []
         for entry in (chat_history or []):
@@ -759,9 +1338,14 @@ class AIService:
         max_rounds = 3
 
         for _round in range(max_rounds):
+            if route is not None:
+                route.model, route.rounds = model_name, _round + 1
             try:
-                response = model.generate_content(contents)
+                # A snapshot of the contents, since a hedged call may still be sending them.
+                response = yield self._gemini_request(model, model_name, "round", list(contents), {"round": _round})
             except Exception as e:
+                if _round == 0:
+                    raise  # nothing has run yet; answer_with_tools can fail over
                 logger.error(f"Gemini agentic call failed: {e}")
                 return {"answer": "I encountered an error processing your request.", "sources": [], "artifacts": [], "suggestions": []}
 
@@ -772,6 +1356,7 @@ class AIService:
 
             has_function_call = False
             function_responses = []
+            round_results = []
 
             for part in candidate.content.parts:
                 if hasattr(part, 'function_call') and part.function_call:
@@ -782,8 +1367,9 @@ class AIService:
                     if model_override:
                         fn_args["model"] = model_override
 
-                    result = tool_executor.execute(fn_name, fn_args, session_id, user_id)
+                    result = yield _ToolCall(tool_executor, fn_name, fn_args, session_id, user_id)
                     tool_calls_log.append({"tool": fn_name, "args": fn_args, "result_keys": list(result.keys())})
+                    round_results.append((fn_name, result))
 
                     if result.get("artifact_type"):
                         artifacts.append(result)
@@ -798,6 +1384,10 @@ class AIService:
             if has_function_call:
                 contents.append(candidate.content)
                 contents.append({"role": "user", "parts": function_responses})
+                if route is not None and route.observe_tool_results(round_results):
+                    model_name = self._chat_model("gemini", route)
+                    model = build_model(model_name)
+                    logger.info(f"Routing escalated to {model_name} ({route.escalated})")
             else:
                 answer = response.text or ""
                 sources, suggestions = self._parse_response_extras(answer, tool_calls_log)
@@ -810,8 +1400,10 @@ class AIService:
                 }
 
         # Max rounds — get final text
+        if route is not None:
+            route.model, route.rounds = model_name, max_rounds + 1
         try:
-            response = model.generate_content(contents)
+            response = yield self._gemini_request(model, model_name, "round", contents, {"round": max_rounds})
             answer = response.text or ""
         except Exception:
             answer = "I reached the maximum processing steps."
@@ -851,6 +1443,11 @@ class AIService:
             return []
         return self.embeddings.embed_documents(text_list)
 
+    async def get_embeddings_async(self, text_list: List[str]) -> List[List[float]]:
+        if not text_list:
+            return []
+        return await self.embeddings.aembed_documents(text_list)
+
     # ── File validation ─────────────────────────────────────────────────
     def validate_file(self, filepath: str) -> bool:
         try:
@@ -0,0 +1,127 @@
+"""Normalized artifact rows, written when an assistant message is saved.
+
+Each tool artifact becomes one ``artifacts`` row (type, topic, item count and
+the deferred full payload); flashcard decks are additionally split into
+``flashcards`` rows. Messages then serialize lightweight references and the
+payload is only read when a client opens an artifact. Messages saved before
+the table existed are migrated by ``python -m scripts.backfill_artifacts``.
+"""
+
+import json
+import logging
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+
+from models_async import Artifact, ChatMessage, Flashcard
+from services.flashcard_store import add_message_flashcards
+
+logger = logging.getLogger(__name__)
+
+
+def _item_count(content) -> int:
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except json.JSONDecodeError:
+            return 1 if content else 0
+    if isinstance(content, dict):
+        content = content.get("cards", content.get("questions", [content]))
+    if isinstance(content, list):
+        return len(content)
+    return 1 if content else 0
+
+
+def artifact_rows(artifacts) -> List[Dict]:
+    """Column values for each artifact dict in a message (``artifacts`` may be the JSON blob)."""
+    if isinstance(artifacts, str):
+        try:
+            artifacts = json.loads(artifacts or "[]")
+        except json.JSONDecodeError:
+            return []
+    rows = []
+    for position, art in enumerate(artifacts or []):
+        if not isinstance(art, dict) or not art.get("artifact_type"):
+            continue
+        rows.append({
+            "position": position,
+            "artifact_type": str(art["artifact_type"])[:30],
+            "topic": (str(art.get("topic") or art.get("description") or "")[:255] or None),
+            "item_count": _item_count(art.get("content")),
+            "payload_json": json.dumps(art),
+        })
+    return rows
+
+
+def add_message_artifacts(
+    db: AsyncSession, session_id: str, message_id: int, artifacts, with_flashcards: bool = True
+) -> List[Artifact]:
+    """Stage Artifact (and Flashcard) rows for a saved message (caller commits).
+
+    Only adds to ``db``, so the legacy Celery path passes its sync session too.
+    """
+    rows = [
+        Artifact(session_id=session_id, message_id=message_id, **values)
+        for values in artifact_rows(artifacts)
+    ]
+    db.add_all(rows)
+    if with_flashcards:
+        add_message_flashcards(db, session_id, message_id, artifacts)
+    return rows
+
+
+async def load_artifact(db: AsyncSession, session_id: str, artifact_id: int) -> Optional[Artifact]:
+    result = await db.execute(
+        select(Artifact)
+        .where(Artifact.id == artifact_id, Artifact.session_id == session_id)
+        .options(undefer(Artifact.payload_json))
+    )
+    return result.scalar_one_or_none()
+
+
+async def backfill_artifacts(
+    db: AsyncSession, after_id: int = 0, batch_size: int = 500, clear_json: bool = False
+) -> Optional[int]:
+    """Migrate one batch of legacy ``artifacts_json`` blobs (caller commits).
+
+    Walks assistant messages by id after ``after_id`` and creates the missing
+    artifact and flashcard rows. Returns the last message id examined, or
+    None when there is nothing left.
+    """
+    rows = (await db.execute(
+        select(ChatMessage.id, ChatMessage.session_id, ChatMessage.artifacts_json)
+        .where(
+            ChatMessage.id > after_id,
+            ChatMessage.role == "assistant",
+            ChatMessage.artifacts_json.is_not(None),
+            ChatMessage.artifacts_json.not_in(("", "[]")),
+        )
+        .order_by(ChatMessage.id)
+        .limit(batch_size)
+    )).all()
+    if not rows:
+        return None
+
+    ids = [message_id for message_id, _, _ in rows]
+    have_artifacts = set((await db.scalars(
+        select(Artifact.message_id).where(Artifact.message_id.in_(ids)).distinct()
+    )).all())
+    have_cards = set((await db.scalars(
+        select(Flashcard.message_id).where(Flashcard.message_id.in_(ids)).distinct()
+    )).all())
+
+    created = 0
+    for message_id, session_id, artifacts_json in rows:
+        if message_id not in have_artifacts:
+            created += len(add_message_artifacts(
+                db, session_id, message_id, artifacts_json,
+                with_flashcards=message_id not in have_cards,
+            ))
+    if clear_json:
+        await db.execute(
+            update(ChatMessage).where(ChatMessage.id.in_(ids)).values(artifacts_json="[]")
+        )
+    logger.info(f"Backfilled {created} artifacts from {len(rows)} messages (through id {ids[-1]})")
+    return ids[-1]
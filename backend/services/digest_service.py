@@ -0,0 +1,172 @@
+import logging
+import re
+from typing import Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "summary": {"type": "string"},
+        "pages": {"type": "array", "items": {"type": "integer"}},
+        "key_terms": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "term": {"type": "string"},
+                    "definition": {"type": "string"},
+                },
+                "required": ["term", "definition"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["title", "summary", "pages", "key_terms"],
+    "additionalProperties": False,
+}
+
+# Topics the tools treat as "the whole document" rather than a retrieval query.
+_WHOLE_DOCUMENT_RE = re.compile(
+    r"^(the |this |my |entire |whole |full )*"
+    r"(document|documents|file|files|pdf|paper|text|notes|material|upload)s?"
+    r"( content| contents)?$"
+)
+_WHOLE_DOCUMENT_TOPICS = {"", "everything", "all", "overview", "summary", "all topics"}
+
+
+def is_whole_document_topic(topic: Optional[str]) -> bool:
+    """True when a tool topic refers to the document as a whole, not a specific subject."""
+    normalized = " ".join((topic or "").lower().strip(" .!?'\"").split())
+    return normalized in _WHOLE_DOCUMENT_TOPICS or bool(_WHOLE_DOCUMENT_RE.match(normalized))
+
+
+class DigestService:
+    """Builds per-document digests after indexing and serves them to the tools.
+
+    A digest is an outline, per-section summaries with page ranges, and a
+    de-duplicated key-term list. It is produced once per document by a Celery
+    stage that runs after ``index_document_task``, so whole-document study
+    guides and visualizations can be answered without retrieval or a long
+    generation call.
+    """
+
+    def __init__(self, rag_service, ai_service):
+        self.rag_service = rag_service
+        self.ai_service = ai_service
+
+    def build(self, chroma_document_id: str, file_name: str) -> Optional[Dict]:
+        """Summarise every stored chunk of a document. Returns None if nothing could be generated."""
+        chunks = self.rag_service.get_document_chunks(chroma_document_id)
+        if not chunks:
+            logger.warning(f"Digest skipped: no chunks for doc={chroma_document_id}")
+            return None
+
+        window = max(1, Config.DIGEST_CHUNKS_PER_CALL)
+        sections: List[Dict] = []
+        for start in range(0, len(chunks), window):
+            part = chunks[start:start + window]
+            context = "\n\n".join(
+                f"[pages {', '.join(str(p) for p in c['pages']) or '?'}]\n{c['text']}" for c in part
+            )
+            instruction = (
+                f"This is part {start // window + 1} of '{file_name}'. Split it into its main sections "
+                "in reading order. For each section give a short title, a 2-4 sentence summary, the page "
+                "numbers it covers (from the [pages ...] markers), and up to 5 key terms with one-sentence "
+                "definitions taken from the text."
+            )
+            items = self.ai_service.generate_structured(
+                context_chunks=[context],
+                instruction=instruction,
+                item_schema=DIGEST_SECTION_SCHEMA,
+                schema_name="document_digest",
+            )
+            sections.extend(s for s in (items or []) if isinstance(s, dict) and s.get("title"))
+
+        if not sections:
+            logger.error(f"Digest generation produced no sections for doc={chroma_document_id}")
+            return None
+
+        key_terms, seen = [], set()
+        for section in sections:
+            for kt in section.pop("key_terms", None) or []:
+                term = (kt.get("term") or "").strip()
+                if term and term.lower() not in seen:
+                    seen.add(term.lower())
+                    key_terms.append({"term": term, "definition": kt.get("definition", "")})
+
+        logger.info(f"Digest built for doc={chroma_document_id}: sections={len(sections)} key_terms={len(key_terms)}")
+        return {
+            "outline": [s["title"] for s in sections],
+            "sections": sections,
+            "key_terms": key_terms,
+        }
+
+    def load_for_session(self, session_id: str) -> List[Dict]:
+        """Return the digests of every document in a session, each with its file name.
+
+        Returns [] unless every document has a digest (some may still be
+        building, or have failed), so callers fall back to retrieval rather
+        than answering about part of the session.
+        """
+        from sqlalchemy import select
+        from celery_db import SyncSession
+        from models_async import DocumentDigest, SessionDocument
+
+        try:
+            with SyncSession() as db:
+                rows = db.execute(
+                    select(DocumentDigest, SessionDocument.file_name)
+                    .select_from(SessionDocument)
+                    .outerjoin(DocumentDigest, DocumentDigest.document_id == SessionDocument.id)
+                    .where(SessionDocument.session_id == session_id)
+                    .order_by(SessionDocument.id)
+                ).all()
+        except Exception as e:
+            logger.warning(f"Digest lookup failed for session={session_id}: {e}")
+            return []
+        missing = sum(1 for digest, _ in rows if digest is None)
+        if missing:
+            logger.info(f"Digests incomplete for session={session_id}: {missing}/{len(rows)} documents missing")
+            return []
+        return [{**digest.to_dict(), "file_name": file_name} for digest, file_name in rows]
+
+    # ── Rendering ────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def render_study_guide(digests: List[Dict], depth: str = "standard") -> str:
+        """Render stored digests as a Markdown study guide (no model call)."""
+        out = []
+        for d in digests:
+            out.append(f"# Study Guide: {d.get('file_name', 'Document')}")
+            out.append("## Overview")
+            out.append("\n".join(f"{i}. {title}" for i, title in enumerate(d["outline"], start=1)))
+
+            terms = d["key_terms"] if depth != "brief" else d["key_terms"][:10]
+            if terms:
+                out.append("## Key Concepts")
+                out.append("\n".join(f"- **{kt['term']}**: {kt['definition']}" for kt in terms))
+
+            if depth != "brief":
+                out.append("## Detailed Notes")
+                for section in d["sections"]:
+                    pages = section.get("pages") or []
+                    page_ref = f" (p. {min(pages)}–{max(pages)})" if len(pages) > 1 else (
+                        f" (p. {pages[0]})" if pages else ""
+                    )
+                    out.append(f"### {section['title']}{page_ref}")
+                    out.append(section.get("summary", ""))
+        return "\n\n".join(out)
+
+    @staticmethod
+    def outline_context(digests: List[Dict]) -> str:
+        """Compact outline + summaries used as model context for whole-document requests."""
+        parts = []
+        for d in digests:
+            parts.append(f"Document: {d.get('file_name', 'Document')}")
+            for section in d["sections"]:
+                parts.append(f"- {section['title']}: {section.get('summary', '')}")
+        return "\n".join(parts)
@@ -42,11 +42,14 @@ class FileService:
             return 'audio'
         return 'unknown'
 
-    def extract_text_universal(self, filepath: str) -> Optional[List[dict]]:
-        """Route to the correct extractor based on file type. Returns [{page, text}]."""
+    def extract_text_universal(self, filepath: str, on_page=None) -> Optional[List[dict]]:
+        """Route to the correct extractor based on file type. Returns [{page, text}].
+
+        ``on_page(done, total)`` is called after each PDF page, for progress reporting.
+        """
         file_type = self.detect_file_type(filepath)
         if file_type == 'pdf':
-            return self.extract_text_with_pages(filepath)
+            return self.extract_text_with_pages(filepath, on_page=on_page)
         elif file_type == 'docx':
             return self._extract_docx(filepath)
         elif file_type == 'txt':
@@ -186,7 +189,7 @@ class FileService:
             logger.warning(f"PyMuPDF extraction failed: {str(e)}")
             return None
 
-    def extract_text_with_pages(self, filepath: str) -> Optional[list]:
+    def extract_text_with_pages(self, filepath: str, on_page=None) -> Optional[list]:
         """Extract text from PDF with page numbers."""
         try:
             if not self._validate_file(filepath):
@@ -195,10 +198,13 @@ class FileService:
             pages = []
             try:
                 with pdfplumber.open(filepath) as pdf:
+                    total = len(pdf.pages)
                     for i, page in enumerate(pdf.pages, start=1):
                         text = page.extract_text() or ""
                         if text.strip():
                             pages.append({"page": i, "text": text.strip()})
+                        if on_page:
+                            on_page(i, total)
             except Exception as e:
                 logger.warning(f"pdfplumber page extraction failed: {e}")
 
@@ -0,0 +1,195 @@
+"""Normalized flashcard rows, written when an assistant message is saved.
+
+Review endpoints read card fronts/backs from the ``flashcards`` table instead
+of parsing every message's ``artifacts_json``. Messages saved before the table
+existed are backfilled lazily, in one batched query, the first time one of
+their cards is needed.
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models_async import ChatMessage, Flashcard, FlashcardProgress
+from services.user_stats import flashcard_status_deltas
+
+logger = logging.getLogger(__name__)
+
+
+def cards_from_artifacts(artifacts) -> List[Dict]:
+    """Return [{card_index, front, back}] from the first flashcards artifact in a message."""
+    if isinstance(artifacts, str):
+        try:
+            artifacts = json.loads(artifacts or "[]")
+        except json.JSONDecodeError:
+            return []
+    for art in artifacts or []:
+        if not isinstance(art, dict) or art.get("artifact_type") != "flashcards":
+            continue
+        cards_data = art.get("content")
+        if isinstance(cards_data, str):
+            try:
+                cards_data = json.loads(cards_data)
+            except json.JSONDecodeError:
+                return []
+        if isinstance(cards_data, dict):
+            cards_data = cards_data.get("cards", [])
+        if not isinstance(cards_data, list):
+            return []
+        cards = []
+        for i, card in enumerate(cards_data):
+            if not isinstance(card, dict):
+                continue
+            cards.append({
+                "card_index": i,
+                "front": str(card.get("front") or card.get("question") or card.get("term") or ""),
+                "back": card.get("back") or card.get("answer") or card.get("definition"),
+            })
+        return cards
+    return []
+
+
+def add_message_flashcards(db: AsyncSession, session_id: str, message_id: int, artifacts) -> int:
+    """Stage Flashcard rows for a saved message (caller commits). Returns the number added."""
+    cards = cards_from_artifacts(artifacts)
+    db.add_all(
+        Flashcard(session_id=session_id, message_id=message_id, **card) for card in cards
+    )
+    return len(cards)
+
+
+async def backfill_flashcards(
+    db: AsyncSession, message_ids: Iterable[int]
+) -> Dict[Tuple[int, int], Flashcard]:
+    """Create Flashcard rows for messages that predate the table.
+
+    Loads all the given messages in a single query and stages their cards on
+    ``db`` (caller commits). Returns {(message_id, card_index): Flashcard}.
+    """
+    ids = sorted(set(message_ids))
+    if not ids:
+        return {}
+    rows = await db.execute(
+        select(ChatMessage.id, ChatMessage.session_id, ChatMessage.artifacts_json)
+        .where(ChatMessage.id.in_(ids))
+    )
+    created: Dict[Tuple[int, int], Flashcard] = {}
+    for message_id, session_id, artifacts_json in rows:
+        for card in cards_from_artifacts(artifacts_json):
+            fc = Flashcard(session_id=session_id, message_id=message_id, **card)
+            db.add(fc)
+            created[(message_id, card["card_index"])] = fc
+    logger.info(f"Backfilled {len(created)} flashcards from {len(ids)} messages")
+    return created
+
+
+# ── Spaced repetition ─────────────────────────────────────────────────────────
+
+REVIEW_STATUSES = ("remaining", "reviewing", "known")
+
+
+def sm2_review(ease_factor: float, interval_days: int, status: str, now: datetime) -> Dict:
+    """Simplified SM-2 step for one card result. Returns the new scheduling fields."""
+    if status == "known":
+        ease_factor = min(2.5, ease_factor + 0.1)
+        interval_days = max(1, int(interval_days * ease_factor))
+        next_review = now + timedelta(days=interval_days)
+    elif status == "reviewing":
+        ease_factor = max(1.3, ease_factor - 0.15)
+        interval_days = 1
+        next_review = now + timedelta(days=1)
+    else:  # remaining
+        ease_factor = max(1.3, ease_factor - 0.3)
+        interval_days = 1
+        next_review = None
+    return {"ease_factor": ease_factor, "interval_days": interval_days, "next_review_date": next_review}
+
+
+def _dialect_insert(db: AsyncSession):
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+async def upsert_review_results(
+    db: AsyncSession, session_id: str, results: List
+) -> Tuple[List[FlashcardProgress], Dict[str, int]]:
+    """Apply a deck of card results for one session in a single upsert (caller commits).
+
+    ``results`` are items with message_id, card_index, card_front and status,
+    in review order; a card reviewed twice in the deck gets both SM-2 steps.
+    Existing rows are read in one query, scheduled in memory, and written back
+    with one ``INSERT ... ON CONFLICT DO UPDATE`` on ``_session_message_card_uc``.
+
+    Returns the saved rows and the summed user_stats counter deltas.
+    """
+    keys = {(r.message_id, r.card_index) for r in results}
+    rows = await db.execute(
+        select(
+            FlashcardProgress.message_id, FlashcardProgress.card_index,
+            FlashcardProgress.status, FlashcardProgress.ease_factor,
+            FlashcardProgress.interval_days, FlashcardProgress.review_count,
+        ).where(
+            FlashcardProgress.session_id == session_id,
+            FlashcardProgress.message_id.in_({m for m, _ in keys}),
+        )
+    )
+    state: Dict[Tuple[int, int], Dict] = {}
+    old_status: Dict[Tuple[int, int], str] = {}
+    for message_id, card_index, status, ease, interval, count in rows:
+        if (message_id, card_index) in keys:
+            old_status[(message_id, card_index)] = status
+            state[(message_id, card_index)] = {
+                "ease_factor": ease, "interval_days": interval, "review_count": count,
+            }
+
+    now = datetime.utcnow()
+    for r in results:
+        key = (r.message_id, r.card_index)
+        card = state.setdefault(key, {"ease_factor": 2.5, "interval_days": 1, "review_count": 0})
+        card.setdefault("card_front", r.card_front[:255])
+        card["status"] = r.status
+        card["review_count"] += 1
+        card.update(sm2_review(card["ease_factor"], card["interval_days"], r.status, now))
+
+    values = [
+        {
+            "session_id": session_id, "message_id": message_id, "card_index": card_index,
+            "card_front": card.get("card_front", ""), "created_at": now, "updated_at": now,
+            **{k: v for k, v in card.items() if k != "card_front"},
+        }
+        for (message_id, card_index), card in state.items()
+    ]
+    stmt = _dialect_insert(db)(FlashcardProgress).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["session_id", "message_id", "card_index"],
+        set_={
+            col: stmt.excluded[col]
+            for col in ("status", "ease_factor", "interval_days", "next_review_date",
+                        "review_count", "updated_at")
+        },
+    )
+    await db.execute(stmt)
+
+    deltas: Dict[str, int] = {}
+    for key, card in state.items():
+        for col, n in flashcard_status_deltas(old_status.get(key), card["status"]).items():
+            deltas[col] = deltas.get(col, 0) + n
+
+    saved = await db.execute(
+        select(FlashcardProgress)
+        .where(
+            FlashcardProgress.session_id == session_id,
+            FlashcardProgress.message_id.in_({m for m, _ in keys}),
+        )
+        .order_by(FlashcardProgress.message_id, FlashcardProgress.card_index)
+        .execution_options(populate_existing=True)
+    )
+    progress = [p for p in saved.scalars() if (p.message_id, p.card_index) in keys]
+    return progress, deltas
@@ -0,0 +1,125 @@
+"""Complexity-based model routing for chat requests.
+
+``route()`` scores a chat question from cheap local signals (length,
+reasoning/math keywords, lookup phrasing, tool intent, short follow-ups)
+and picks a tier. ``AIService.answer_with_tools`` sends "fast" requests to
+the provider's fast model. When a document search during the request comes
+back empty or below ``MODEL_ROUTING_MIN_RELEVANCE``, the remaining rounds
+escalate to the full model. Requests with an explicit model (deep think,
+custom model) are never routed.
+
+``MODEL_ROUTING``: ``off``, ``shadow`` (decide and log, but keep the full
+model, for tuning thresholds on real traffic) or ``on``. Each routed
+request logs one ``model_route`` line with the decision and its outcome.
+"""
+
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from config import Config
+from utils.metrics import observe_route
+
+logger = logging.getLogger(__name__)
+
+_REASONING = re.compile(
+    r"\b(why|explain|compare|contrast|analy[sz]e|evaluate|critique|assess|implications?|derive|prove|"
+    r"justify|interpret|relationship|differences? between|pros and cons|trade-?offs?|step by step|in (?:detail|depth))\b"
+)
+_MATH_OR_CODE = re.compile(r"\$|```|\b(calculate|compute|solve|equation|formula|proof|code|algorithm)\b")
+_LOOKUP = re.compile(
+    r"^(what|which|where|who|when|how many|list|find|define|quote|show)\b"
+    r"|\b(what page|which page|mention(?:s|ed)?|definition of|stand for|title of)\b"
+)
+
+
+def detect_tool_intent(question: str) -> Optional[str]:
+    """The tool a question explicitly asks for (flashcards, quiz, study guide, diagram), if any."""
+    q = question.lower()
+    if any(kw in q for kw in ("flashcard", "flash card", "study card", "spaced repetition")):
+        return "generate_flashcards"
+    if any(kw in q for kw in ("quiz", "test me", "multiple choice", "test my knowledge")):
+        return "generate_quiz"
+    if any(kw in q for kw in ("study guide", "outline", "summarize")):
+        return "create_study_guide"
+    if any(kw in q for kw in ("diagram", "mind map", "visualization", "chart")):
+        return "generate_visualization"
+    return None
+
+
+@dataclass
+class RouteDecision:
+    tier: str  # "fast" | "full"
+    score: float
+    reasons: List[str] = field(default_factory=list)
+    forced_tool: Optional[str] = None
+    escalated: Optional[str] = None
+    model: Optional[str] = None  # last model actually used
+    rounds: int = 0
+
+    @property
+    def use_fast(self) -> bool:
+        return Config.MODEL_ROUTING == "on" and self.tier == "fast" and not self.escalated
+
+    def observe_tool_results(self, results: List[tuple]) -> bool:
+        """Escalate on weak retrieval. ``results`` are (tool name, result) from one round; True if escalated now."""
+        if self.tier != "fast" or self.escalated:
+            return False
+        searches = [result for name, result in results if name == "search_documents"]
+        if not searches:
+            return False
+        confidence = max((r.get("relevance") or 0.0 for s in searches for r in s.get("results", [])), default=0.0)
+        if confidence >= Config.MODEL_ROUTING_MIN_RELEVANCE:
+            return False
+        self.escalated = f"low_relevance:{confidence:.2f}"
+        return Config.MODEL_ROUTING == "on"
+
+
+def route(question: str, chat_history: Optional[List[dict]], model_override: Optional[str]) -> Optional[RouteDecision]:
+    """Classify a chat request; None when routing is off or a model was chosen explicitly."""
+    if Config.MODEL_ROUTING not in ("shadow", "on") or model_override:
+        return None
+
+    q = question.strip().lower()
+    words = len(q.split())
+    score = 0.0
+    reasons = []
+    if words > 40:
+        score += 0.4
+        reasons.append("long")
+    elif words > 20:
+        score += 0.2
+        reasons.append("medium")
+    if _REASONING.search(q):
+        score += 0.4
+        reasons.append("reasoning")
+    if _MATH_OR_CODE.search(q):
+        score += 0.3
+        reasons.append("math_or_code")
+    if q.count("?") > 1:
+        score += 0.2
+        reasons.append("multi_question")
+    if words <= 6 and len(chat_history or []) >= 4:
+        score += 0.3  # short follow-ups lean on the conversation so far
+        reasons.append("follow_up")
+    if _LOOKUP.search(q) and "reasoning" not in reasons:
+        score -= 0.2
+        reasons.append("lookup")
+    forced_tool = detect_tool_intent(q)
+    if forced_tool:
+        score -= 0.3  # the tool does the heavy generation with its own model
+        reasons.append(f"tool:{forced_tool}")
+
+    tier = "fast" if score < Config.MODEL_ROUTING_THRESHOLD else "full"
+    return RouteDecision(tier=tier, score=round(score, 2), reasons=reasons, forced_tool=forced_tool)
+
+
+def log_outcome(decision: RouteDecision, outcome: str, seconds: float, answer_chars: int, tools: List[str]) -> None:
+    logger.info(
+        f"model_route mode={Config.MODEL_ROUTING} tier={decision.tier} score={decision.score} "
+        f"reasons={','.join(decision.reasons) or '-'} model={decision.model} "
+        f"escalated={decision.escalated or '-'} rounds={decision.rounds} tools={','.join(tools) or '-'} "
+        f"outcome={outcome} latency_ms={seconds * 1000:.0f} answer_chars={answer_chars}"
+    )
+    observe_route(Config.MODEL_ROUTING, decision.tier, "escalated" if decision.escalated else outcome)
@@ -0,0 +1,166 @@
+"""Circuit breakers and latency tracking for LLM provider calls.
+
+Every request through ``ai_service._llm_call`` is checked against the
+breaker for its provider:model and reports its outcome and latency here.
+
+Breaker: when at least ``LLM_BREAKER_MIN_CALLS`` calls in the last
+``LLM_BREAKER_WINDOW`` seconds failed at a rate of ``LLM_BREAKER_ERROR_RATE``
+or more, the breaker opens and calls fail immediately with
+``CircuitOpenError`` (``AIService`` then moves on to the alternate
+provider). After ``LLM_BREAKER_OPEN_SECONDS`` one probe call is let
+through; its success closes the breaker, its failure re-opens it. Only
+provider-side failures count: 5xx, 408/429, timeouts and connection
+errors, not rejected requests (other 4xx) or the local limiter's
+``ProviderBusyError``. State is per process.
+
+Latency: the last ``_LATENCY_SAMPLES`` successful call durations per
+provider:model:kind give the p95 that hedged requests wait before firing a
+second call.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from config import Config
+from services.provider_limits import ProviderBusyError
+from utils.metrics import observe_breaker
+
+logger = logging.getLogger(__name__)
+
+_LATENCY_SAMPLES = 200
+_MIN_LATENCY_SAMPLES = 20
+
+
+class CircuitOpenError(RuntimeError):
+    """The provider:model breaker is open; the call was not attempted."""
+
+
+def counts_as_failure(exc: BaseException) -> bool:
+    """True for errors that say something about the provider's health."""
+    if isinstance(exc, (ProviderBusyError, CircuitOpenError, asyncio.CancelledError)):
+        return False  # cancelled: a hedged call that lost, or the client went away
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in (408, 429):
+        return False
+    return True
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self._lock = threading.Lock()
+        self._calls = deque()  # (timestamp, failed)
+        self._opened_at = 0.0
+        self._probing = False
+
+    def _transition(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Circuit {self.name}: {self.state} -> {state}")
+            self.state = state
+            provider, _, model = self.name.partition(":")
+            observe_breaker(provider, model, state)
+
+    def allow(self) -> bool:
+        """Whether a call may be attempted now (claims the probe when half-open)."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < Config.LLM_BREAKER_OPEN_SECONDS:
+                    return False
+                self._transition("half_open")
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def is_open(self) -> bool:
+        """Read-only check for routing decisions (does not claim a probe)."""
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self._opened_at < Config.LLM_BREAKER_OPEN_SECONDS
+
+    def record(self, failed: Optional[bool]) -> None:
+        """Count one call outcome; ``None`` (not the provider's fault) only frees the probe."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "half_open":
+                self._probing = False
+                if failed is None:
+                    return
+                if failed:
+                    self._opened_at = now
+                    self._transition("open")
+                else:
+                    self._calls.clear()
+                    self._transition("closed")
+                return
+            if failed is None:
+                return
+            self._calls.append((now, failed))
+            while self._calls and self._calls[0][0] < now - Config.LLM_BREAKER_WINDOW:
+                self._calls.popleft()
+            failures = sum(1 for _, f in self._calls if f)
+            if (
+                self.state == "closed"
+                and len(self._calls) >= Config.LLM_BREAKER_MIN_CALLS
+                and failures / len(self._calls) >= Config.LLM_BREAKER_ERROR_RATE
+            ):
+                self._opened_at = now
+                self._calls.clear()
+                self._transition("open")
+
+
+class ProviderHealth:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers: Dict[tuple, CircuitBreaker] = {}
+        self._latencies: Dict[tuple, deque] = {}
+
+    def breaker(self, provider: str, model: str) -> CircuitBreaker:
+        key = (provider, model or "default")
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(f"{key[0]}:{key[1]}")
+            return self._breakers[key]
+
+    def check(self, provider: str, model: str) -> None:
+        """Raise ``CircuitOpenError`` when calls to this provider:model should fail fast."""
+        if Config.LLM_BREAKER_ENABLED and not self.breaker(provider, model).allow():
+            raise CircuitOpenError(f"{provider}:{model or 'default'} circuit is open")
+
+    def is_open(self, provider: str, model: str) -> bool:
+        return Config.LLM_BREAKER_ENABLED and self.breaker(provider, model).is_open()
+
+    def record(self, provider: str, model: str, kind: str, seconds: float,
+               error: Optional[BaseException] = None) -> None:
+        if error is None:
+            with self._lock:
+                samples = self._latencies.setdefault((provider, model, kind), deque(maxlen=_LATENCY_SAMPLES))
+            samples.append(seconds)
+        if Config.LLM_BREAKER_ENABLED:
+            failed = None if error is not None and not counts_as_failure(error) else error is not None
+            self.breaker(provider, model).record(failed)
+
+    def p95(self, provider: str, model: str, kind: str) -> Optional[float]:
+        samples = list(self._latencies.get((provider, model, kind), ()))
+        if len(samples) < _MIN_LATENCY_SAMPLES:
+            return None
+        samples.sort()
+        return samples[int(len(samples) * 0.95) - 1]
+
+    def hedge_delay(self, provider: str, model: str, kind: str) -> Optional[float]:
+        """Seconds to wait before hedging a call, or None when it should not be hedged."""
+        if not Config.LLM_HEDGING_ENABLED or self.breaker(provider, model).state != "closed":
+            return None
+        p95 = self.p95(provider, model, kind)
+        if p95 is None:
+            return None
+        return max(p95, Config.LLM_HEDGE_MIN_DELAY)
+
+
+provider_health = ProviderHealth()
@@ -0,0 +1,429 @@
+"""Concurrency and token-rate limits (bulkheads) for LLM and embedding provider calls.
+
+Each provider:model has two lanes with separate budgets: ``interactive``
+(chat, tools, direct generation) and ``background`` (the usage-scope
+features in ``LLM_BACKGROUND_FEATURES``: indexing, digests, memory writes),
+so a bulk upload cannot take the capacity chat replies need. A lane caps
+concurrent calls and tokens per minute; the token bucket is charged an
+estimate when a call starts and settled with the provider-reported usage
+when it ends. Calls wait in FIFO order up to the lane's max wait and then
+fail with ``ProviderBusyError`` instead of piling onto the provider. A
+provider 429 pauses the lane for its Retry-After (or
+``LLM_RATE_LIMIT_COOLDOWN``) seconds so queued calls do not retry into it.
+
+Limits are per process unless ``LLM_LIMITS_REDIS`` is set, in which case
+the lanes are shared through Redis (slot leases expire, so a crashed
+process cannot leak capacity; ordering across processes is not FIFO). If
+Redis is unreachable the local lanes are used.
+
+``limit`` blocks the calling thread while queued; ``limit_async`` is the
+same limiter for coroutines and waits without holding a thread.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from config import Config
+from services.usage import current_scope
+from utils.metrics import observe_limiter_event, observe_limiter_wait
+
+logger = logging.getLogger(__name__)
+
+LANES = ("interactive", "background")
+_LEASE_MS = 10 * 60 * 1000  # Redis slot lease; longer than any provider call
+_REDIS_RETRY_SECONDS = 30
+_ASYNC_POLL_SECONDS = 0.05  # how often a queued coroutine re-checks a local lane
+
+
+class ProviderBusyError(RuntimeError):
+    """No provider capacity became free before the lane's max wait."""
+
+
+@dataclass(frozen=True)
+class LaneLimits:
+    concurrency: int  # 0 = unlimited
+    tpm: int          # tokens per minute, 0 = unlimited
+    max_wait: float   # seconds
+
+
+def _load_overrides() -> Dict[str, dict]:
+    if not Config.LLM_LIMITS:
+        return {}
+    try:
+        overrides = json.loads(Config.LLM_LIMITS)
+        if not isinstance(overrides, dict):
+            raise ValueError("expected an object")
+        return overrides
+    except ValueError as e:
+        logger.warning(f"Ignoring invalid LLM_LIMITS: {e}")
+        return {}
+
+
+_OVERRIDES = _load_overrides()
+
+
+def lane_limits(provider: str, model: str, lane: str) -> LaneLimits:
+    """Config defaults, overridden by ``LLM_LIMITS["provider"]`` then ``["provider:model"]``."""
+    values = {
+        "concurrency": getattr(Config, f"LLM_{lane.upper()}_CONCURRENCY"),
+        "tpm": getattr(Config, f"LLM_{lane.upper()}_TPM"),
+        "max_wait": getattr(Config, f"LLM_{lane.upper()}_MAX_WAIT"),
+    }
+    for key in (provider, f"{provider}:{model}"):
+        for name in values:
+            value = _OVERRIDES.get(key, {}).get(f"{lane}_{name}")
+            if value is not None:
+                values[name] = type(values[name])(value)
+    return LaneLimits(**values)
+
+
+def current_lane() -> str:
+    return "background" if current_scope().feature in Config.LLM_BACKGROUND_FEATURES else "interactive"
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds to pause after a provider rate-limit error; None for any other error."""
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    if status != 429 and type(exc).__name__ not in ("RateLimitError", "ResourceExhausted", "TooManyRequests"):
+        return None
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return Config.LLM_RATE_LIMIT_COOLDOWN
+
+
+# ── Local lanes ─────────────────────────────────────────────────────────
+class _LocalLane:
+    """Slots and a token bucket shared by the threads of this process; waiters are served FIFO."""
+
+    def __init__(self, limits: LaneLimits):
+        self.limits = limits
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._active = 0
+        self._tokens = float(limits.tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _delay(self, cost: int, now: float) -> float:
+        """Seconds until a call of ``cost`` tokens may start: 0 = now, inf = after a release."""
+        if self.limits.tpm:
+            self._tokens = min(self.limits.tpm, self._tokens + (now - self._updated) * self.limits.tpm / 60)
+            self._updated = now
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.limits.concurrency and self._active >= self.limits.concurrency:
+            return math.inf
+        # A call larger than the whole bucket goes once the bucket is full.
+        need = min(cost, self.limits.tpm)
+        if self.limits.tpm and self._tokens < need:
+            return (need - self._tokens) * 60 / self.limits.tpm
+        return 0.0
+
+    def _try_take(self, ticket, cost: int, deadline: float) -> float:
+        """Take a slot for ``ticket`` (0.0) or return how long to wait; caller holds ``_cond``."""
+        now = time.monotonic()
+        delay = self._delay(cost, now) if self._queue[0] is ticket else math.inf
+        if delay == 0:
+            self._active += 1
+            if self.limits.tpm:
+                self._tokens -= cost
+            return 0.0
+        if now >= deadline:
+            raise ProviderBusyError("provider lane at capacity")
+        return min(delay, deadline - now)
+
+    def acquire(self, cost: int, deadline: float):
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    delay = self._try_take(ticket, cost, deadline)
+                    if delay == 0:
+                        return None
+                    self._cond.wait(delay)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    async def acquire_async(self, cost: int, deadline: float):
+        """``acquire`` for coroutines: keeps its place in the FIFO queue and polls without blocking the loop."""
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_take(ticket, cost, deadline)
+                if delay == 0:
+                    return None
+                await asyncio.sleep(min(delay, _ASYNC_POLL_SECONDS))
+        finally:
+            with self._cond:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def release(self, handle, adjust: int) -> None:
+        with self._cond:
+            self._active -= 1
+            if self.limits.tpm:
+                self._tokens -= adjust
+            self._cond.notify_all()
+
+    def cooldown(self, seconds: float) -> None:
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# ── Redis lanes ─────────────────────────────────────────────────────────
+# KEYS: holders (zset of lease expiries), bucket (hash), cooldown (string)
+# ARGV: holder id, concurrency, tpm, cost, lease ms. Returns 0 or ms to wait.
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local paused = redis.call('PTTL', KEYS[3])
+if paused > 0 then return paused end
+local concurrency = tonumber(ARGV[2])
+if concurrency > 0 then
+  redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+  if redis.call('ZCARD', KEYS[1]) >= concurrency then return 50 end
+end
+local tpm = tonumber(ARGV[3])
+if tpm > 0 then
+  local cost = tonumber(ARGV[4])
+  local state = redis.call('HMGET', KEYS[2], 'tokens', 'ts')
+  local tokens = tonumber(state[1]) or tpm
+  local ts = tonumber(state[2]) or now
+  tokens = math.min(tpm, tokens + (now - ts) * tpm / 60000)
+  local need = math.min(cost, tpm)
+  if tokens < need then
+    redis.call('HSET', KEYS[2], 'tokens', tokens, 'ts', now)
+    return math.max(1, math.ceil((need - tokens) * 60000 / tpm))
+  end
+  redis.call('HSET', KEYS[2], 'tokens', tokens - cost, 'ts', now)
+  redis.call('PEXPIRE', KEYS[2], 120000)
+end
+if concurrency > 0 then
+  redis.call('ZADD', KEYS[1], now + tonumber(ARGV[5]), ARGV[1])
+  redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[5]))
+end
+return 0
+"""
+
+# KEYS: holders, bucket. ARGV: holder id, token adjustment.
+_RELEASE_LUA = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+local adjust = tonumber(ARGV[2])
+if adjust ~= 0 and redis.call('EXISTS', KEYS[2]) == 1 then
+  redis.call('HINCRBYFLOAT', KEYS[2], 'tokens', -adjust)
+end
+return 0
+"""
+
+
+class _RedisLane:
+    """A lane shared by every process using the same Redis; falls back to ``local`` on errors."""
+
+    def __init__(self, client, aclient, name: str, limits: LaneLimits, local: _LocalLane):
+        self.limits = limits
+        self.local = local
+        self._redis = client
+        self._keys = [f"llm:limits:{name}:holders", f"llm:limits:{name}:bucket", f"llm:limits:{name}:cooldown"]
+        self._acquire = client.register_script(_ACQUIRE_LUA)
+        self._release = client.register_script(_RELEASE_LUA)
+        self._aacquire = aclient.register_script(_ACQUIRE_LUA)
+        self._arelease = aclient.register_script(_RELEASE_LUA)
+        self._down_until = 0.0
+
+    def _failed(self, e: Exception) -> None:
+        logger.warning(f"Provider limiter Redis unavailable, using local limits: {e}")
+        self._down_until = time.monotonic() + _REDIS_RETRY_SECONDS
+
+    def acquire(self, cost: int, deadline: float):
+        if time.monotonic() < self._down_until:
+            return ("local", self.local.acquire(cost, deadline))
+        holder = uuid.uuid4().hex
+        while True:
+            try:
+                wait_ms = int(self._acquire(
+                    keys=self._keys,
+                    args=[holder, self.limits.concurrency, self.limits.tpm, cost, _LEASE_MS],
+                ))
+            except Exception as e:
+                self._failed(e)
+                return ("local", self.local.acquire(cost, deadline))
+            if wait_ms == 0:
+                return ("redis", holder)
+            now = time.monotonic()
+            if now >= deadline:
+                raise ProviderBusyError("provider lane at capacity")
+            time.sleep(min(wait_ms / 1000 * random.uniform(1.0, 1.5), deadline - now, 0.5))
+
+    async def acquire_async(self, cost: int, deadline: float):
+        if time.monotonic() < self._down_until:
+            return ("local", await self.local.acquire_async(cost, deadline))
+        holder = uuid.uuid4().hex
+        while True:
+            try:
+                wait_ms = int(await self._aacquire(
+                    keys=self._keys,
+                    args=[holder, self.limits.concurrency, self.limits.tpm, cost, _LEASE_MS],
+                ))
+            except Exception as e:
+                self._failed(e)
+                return ("local", await self.local.acquire_async(cost, deadline))
+            if wait_ms == 0:
+                return ("redis", holder)
+            now = time.monotonic()
+            if now >= deadline:
+                raise ProviderBusyError("provider lane at capacity")
+            await asyncio.sleep(min(wait_ms / 1000 * random.uniform(1.0, 1.5), deadline - now, 0.5))
+
+    def release(self, handle, adjust: int) -> None:
+        where, holder = handle
+        if where == "local":
+            self.local.release(holder, adjust)
+            return
+        try:
+            self._release(keys=self._keys[:2], args=[holder, adjust])
+        except Exception as e:
+            self._failed(e)  # the lease expires on its own
+
+    async def release_async(self, handle, adjust: int) -> None:
+        where, holder = handle
+        if where == "local":
+            self.local.release(holder, adjust)
+            return
+        try:
+            await self._arelease(keys=self._keys[:2], args=[holder, adjust])
+        except Exception as e:
+            self._failed(e)
+
+    def cooldown(self, seconds: float) -> None:
+        self.local.cooldown(seconds)
+        try:
+            key, ms = self._keys[2], int(seconds * 1000)
+            if self._redis.pttl(key) < ms:
+                self._redis.set(key, 1, px=ms)
+        except Exception as e:
+            self._failed(e)
+
+
+# ── Limiter ─────────────────────────────────────────────────────────────
+class Permit:
+    """Handed to the caller while it holds capacity; ``settle`` records the real token usage."""
+
+    def __init__(self, reserved: int, waited: float):
+        self.reserved = reserved
+        self.waited = waited
+        self.actual: Optional[int] = None
+
+    def settle(self, tokens: int) -> None:
+        self.actual = tokens
+
+
+class ProviderLimiter:
+    def __init__(self):
+        self._lanes: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        self._aredis = None
+
+    def _lane(self, provider: str, model: str, lane: str):
+        key = (provider, model, lane)
+        with self._lock:
+            if key not in self._lanes:
+                limits = lane_limits(provider, model, lane)
+                local = _LocalLane(limits)
+                if Config.LLM_LIMITS_REDIS:
+                    if self._redis is None:
+                        import redis
+                        import redis.asyncio as aioredis
+                        self._redis = redis.from_url(Config.REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+                        self._aredis = aioredis.from_url(Config.REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+                    self._lanes[key] = _RedisLane(
+                        self._redis, self._aredis, f"{provider}:{model}:{lane}", limits, local,
+                    )
+                else:
+                    self._lanes[key] = local
+            return self._lanes[key]
+
+    def _busy(self, provider: str, model: str, lane_name: str, lane) -> ProviderBusyError:
+        observe_limiter_event(provider, model, lane_name, "deadline")
+        return ProviderBusyError(
+            f"{provider}:{model} is at capacity ({lane_name} lane, waited {lane.limits.max_wait:g}s)"
+        )
+
+    def _throttled(self, provider: str, model: str, lane_name: str, lane, exc: BaseException) -> None:
+        pause = retry_after(exc)
+        if pause is not None:
+            observe_limiter_event(provider, model, lane_name, "throttled")
+            logger.warning(f"{provider}:{model} rate limited; pausing {lane_name} lane for {pause:g}s")
+            lane.cooldown(pause)
+
+    @contextmanager
+    def limit(self, provider: str, model: str, est_tokens: int = 0):
+        """Hold a slot in the current lane for one provider call (raises ``ProviderBusyError``)."""
+        if not Config.LLM_LIMITS_ENABLED:
+            yield Permit(est_tokens, 0.0)
+            return
+        model = model or "default"
+        lane_name = current_lane()
+        lane = self._lane(provider, model, lane_name)
+        start = time.monotonic()
+        try:
+            handle = lane.acquire(est_tokens, start + lane.limits.max_wait)
+        except ProviderBusyError:
+            raise self._busy(provider, model, lane_name, lane) from None
+        permit = Permit(est_tokens, time.monotonic() - start)
+        observe_limiter_wait(provider, model, lane_name, permit.waited)
+        try:
+            yield permit
+        except Exception as e:
+            self._throttled(provider, model, lane_name, lane, e)
+            raise
+        finally:
+            lane.release(handle, permit.actual - est_tokens if permit.actual is not None else 0)
+
+    @asynccontextmanager
+    async def limit_async(self, provider: str, model: str, est_tokens: int = 0):
+        """``limit`` for coroutines: queued calls wait on the event loop instead of a thread."""
+        if not Config.LLM_LIMITS_ENABLED:
+            yield Permit(est_tokens, 0.0)
+            return
+        model = model or "default"
+        lane_name = current_lane()
+        lane = self._lane(provider, model, lane_name)
+        start = time.monotonic()
+        try:
+            handle = await lane.acquire_async(est_tokens, start + lane.limits.max_wait)
+        except ProviderBusyError:
+            raise self._busy(provider, model, lane_name, lane) from None
+        permit = Permit(est_tokens, time.monotonic() - start)
+        observe_limiter_wait(provider, model, lane_name, permit.waited)
+        try:
+            yield permit
+        except Exception as e:
+            self._throttled(provider, model, lane_name, lane, e)
+            raise
+        finally:
+            adjust = permit.actual - est_tokens if permit.actual is not None else 0
+            if isinstance(lane, _RedisLane):
+                await lane.release_async(handle, adjust)
+            else:
+                lane.release(handle, adjust)
+
+
+provider_limiter = ProviderLimiter()
@@ -1,14 +1,16 @@
-import asyncio
 import os
 import json
 import logging
+import time
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 
 import chromadb
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 from config import Config
+from utils.metrics import observe_vector_query
+from utils.timing import run_in_thread, span, timed
 
 logger = logging.getLogger(__name__)
 
@@ -29,30 +31,40 @@ class RAGService:
         # Keep raw collection reference for metadata-filtered deletes
         self.collection = self.vectorstore._collection
 
+    def _similarity_search(self, operation: str, **kwargs) -> List[Tuple[Document, float]]:
+        """``vectorstore.similarity_search_with_score`` as (doc, relevance) pairs, latency recorded per operation."""
+        start = time.perf_counter()
+        try:
+            with span("vector.search", operation=operation, k=kwargs.get("k", 0)):
+                results = self.vectorstore.similarity_search_with_score(**kwargs)
+        finally:
+            observe_vector_query(operation, time.perf_counter() - start)
+        return [(doc, self._relevance(distance)) for doc, distance in results]
+
+    @staticmethod
+    def _relevance(distance: float) -> float:
+        """Chroma's default space is squared L2; for unit-length embeddings 1 - d/2 is the cosine similarity."""
+        return round(max(0.0, min(1.0, 1.0 - distance / 2)), 4)
+
     def index_document(self, filepath: str, document_id: str, session_id: str, user_id: int) -> Dict:
         """Extract, chunk, embed, and store a local file. Returns indexing stats."""
-        page_texts = self.file_service.extract_text_universal(filepath)
+        page_texts, chunks_with_pages = self.extract_chunks(filepath)
         if not page_texts:
             return {"chunk_count": 0, "page_count": 0, "text": ""}
 
         extracted_text = "\n\n".join(p["text"] for p in page_texts)
-        chunks_with_pages = self.file_service.chunking_function_with_pages(page_texts)
 
         if chunks_with_pages:
             docs = [
                 Document(
                     page_content=c["text"],
-                    metadata={
-                        "document_id": document_id,
-                        "session_id": session_id,
-                        "user_id": str(user_id),
-                        "pages": json.dumps(c["pages"]),
-                    },
+                    metadata=self.chunk_metadata(c, document_id, session_id, user_id),
                 )
                 for c in chunks_with_pages
             ]
-            ids = [f"{document_id}_chunk_{i}" for i in range(len(docs))]
-            self.vectorstore.add_documents(docs, ids=ids)
+            ids = self.chunk_ids(document_id, 0, len(docs))
+            with span("vector.upsert", chunks=len(docs)):
+                self.vectorstore.add_documents(docs, ids=ids)
             logger.info(f"Indexed {len(docs)} chunks for doc={document_id} session={session_id}")
 
         return {
@@ -61,9 +73,9 @@ class RAGService:
             "text": extracted_text,
         }
 
+    @timed("rag.index_from_url")
     def index_from_url(self, url: str, name: str, document_id: str, session_id: str, user_id: int) -> Dict:
         """Download a file from CDN and index it."""
-        import requests as http_requests
         from werkzeug.utils import secure_filename
 
         filename = secure_filename(name) or "file"
@@ -71,15 +83,7 @@ class RAGService:
         safe_filename = f"{timestamp}_{filename}"
         filepath = os.path.join(Config.UPLOAD_FOLDER, safe_filename)
 
-        try:
-            dl_resp = http_requests.get(url, timeout=30, stream=True)
-            dl_resp.raise_for_status()
-            with open(filepath, "wb") as fout:
-                for chunk in dl_resp.iter_content(chunk_size=8192):
-                    fout.write(chunk)
-        except Exception as e:
-            logger.error(f"Failed to download {url}: {e}")
-            raise
+        self.download(url, filepath)
 
         try:
             result = self.index_document(filepath, document_id, session_id, user_id)
@@ -94,8 +98,80 @@ class RAGService:
             except Exception:
                 pass
 
+    # ── Indexing building blocks (shared with the staged Celery pipeline) ────
+
+    @timed("rag.download")
+    def download(self, url: str, filepath: str) -> str:
+        """Stream a remote file to ``filepath``. Written via a temp file so a partial download never looks complete."""
+        import requests as http_requests
+
+        tmp_path = f"{filepath}.part"
+        try:
+            dl_resp = http_requests.get(url, timeout=30, stream=True)
+            dl_resp.raise_for_status()
+            with open(tmp_path, "wb") as fout:
+                for chunk in dl_resp.iter_content(chunk_size=8192):
+                    fout.write(chunk)
+            os.replace(tmp_path, filepath)
+        except Exception as e:
+            logger.error(f"Failed to download {url}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return filepath
+
+    @timed("rag.extract_chunks")
+    def extract_chunks(self, filepath: str, on_page=None):
+        """Extract page texts and page-tagged chunks from a local file. Returns (page_texts, chunks)."""
+        with span("file.extract", file_type=self.file_service.detect_file_type(filepath)) as fields:
+            page_texts = self.file_service.extract_text_universal(filepath, on_page=on_page)
+            fields["pages"] = len(page_texts or [])
+        if not page_texts:
+            return [], []
+        with span("file.chunk") as fields:
+            chunks = self.file_service.chunking_function_with_pages(page_texts)
+            fields["chunks"] = len(chunks)
+        return page_texts, chunks
+
+    @staticmethod
+    def chunk_ids(document_id: str, start: int, end: int) -> List[str]:
+        return [f"{document_id}_chunk_{i}" for i in range(start, end)]
+
+    @staticmethod
+    def chunk_metadata(chunk: Dict, document_id: str, session_id: str, user_id: int) -> Dict:
+        return {
+            "document_id": document_id,
+            "session_id": session_id,
+            "user_id": str(user_id),
+            "pages": json.dumps(chunk["pages"]),
+        }
+
+    @timed("vector.upsert")
+    def store_embedded_chunks(
+        self,
+        chunks: List[Dict],
+        embeddings: List[List[float]],
+        document_id: str,
+        session_id: str,
+        user_id: int,
+    ) -> int:
+        """Write pre-computed embeddings straight to Chroma. Upsert keeps re-runs idempotent."""
+        if not chunks:
+            return 0
+        self.collection.upsert(
+            ids=self.chunk_ids(document_id, 0, len(chunks)),
+            embeddings=embeddings,
+            documents=[c["text"] for c in chunks],
+            metadatas=[self.chunk_metadata(c, document_id, session_id, user_id) for c in chunks],
+        )
+        logger.info(f"Stored {len(chunks)} pre-embedded chunks for doc={document_id} session={session_id}")
+        return len(chunks)
+
+    @timed("rag.query")
     def query(self, question: str, session_id: str, user_id: int, n_results: int = 5) -> Dict:
-        """Session-scoped retrieval. Returns chunks, metas, and image paths."""
+        """Session-scoped retrieval. Returns chunks, metas, and relevance scores (0-1)."""
         try:
             # Primary: compound filter by session_id AND user_id
             filter_dict = {
@@ -105,7 +181,8 @@ class RAGService:
                 ]
             }
 
-            results = self.vectorstore.similarity_search(
+            results = self._similarity_search(
+                "session",
                 query=question,
                 k=n_results,
                 filter=filter_dict,
@@ -118,43 +195,70 @@ class RAGService:
                     f"RAG compound filter returned 0 chunks for session={session_id} "
                     f"user={user_id} — retrying with session_id-only filter"
                 )
-                results = self.vectorstore.similarity_search(
+                results = self._similarity_search(
+                    "session_fallback",
                     query=question,
                     k=n_results,
                     filter={"session_id": session_id},
                 )
 
-            chunks = [doc.page_content for doc in results]
-            metas = [doc.metadata for doc in results]
+            chunks = [doc.page_content for doc, _ in results]
+            metas = [doc.metadata for doc, _ in results]
+            scores = [score for _, score in results]
 
             logger.info(
                 f"RAG query: session={session_id} user={user_id} "
                 f"chunks_returned={len(chunks)} question_prefix={question[:60]!r}"
             )
-            return {"chunks": chunks, "metas": metas}
+            return {"chunks": chunks, "metas": metas, "scores": scores}
 
         except Exception as e:
             logger.warning(f"RAG query failed: {e}")
-            return {"chunks": [], "metas": []}
+            return {"chunks": [], "metas": [], "scores": []}
 
+    @timed("rag.query_all_sessions")
     def query_all_sessions(self, question: str, user_id: int, n_results: int = 5) -> Dict:
         """Cross-session retrieval: search ALL documents belonging to a user."""
         try:
-            results = self.vectorstore.similarity_search(
+            results = self._similarity_search(
+                "all_sessions",
                 query=question,
                 k=n_results,
                 filter={"user_id": str(user_id)},
             )
-            chunks = [doc.page_content for doc in results]
-            metas = [doc.metadata for doc in results]
+            chunks = [doc.page_content for doc, _ in results]
+            metas = [doc.metadata for doc, _ in results]
+            scores = [score for _, score in results]
             logger.info(
                 f"RAG cross-session query: user={user_id} chunks_returned={len(chunks)} "
                 f"question_prefix={question[:60]!r}"
             )
-            return {"chunks": chunks, "metas": metas}
+            return {"chunks": chunks, "metas": metas, "scores": scores}
         except Exception as e:
             logger.warning(f"RAG cross-session query failed: {e}")
-            return {"chunks": [], "metas": []}
+            return {"chunks": [], "metas": [], "scores": []}
+
+    def get_document_chunks(self, document_id: str) -> List[Dict]:
+        """Return every stored chunk of one document in original order: [{text, pages}]."""
+        try:
+            res = self.collection.get(
+                where={"document_id": document_id},
+                include=["documents", "metadatas"],
+            )
+        except Exception as e:
+            logger.warning(f"Chunk fetch failed for doc={document_id}: {e}")
+            return []
+
+        rows = []
+        for chunk_id, text, meta in zip(res.get("ids") or [], res.get("documents") or [], res.get("metadatas") or []):
+            try:
+                order = int(chunk_id.rsplit("_chunk_", 1)[1])
+            except (IndexError, ValueError):
+                order = len(rows)
+            pages = json.loads(meta.get("pages", "[]")) if meta else []
+            rows.append((order, {"text": text, "pages": pages}))
+        rows.sort(key=lambda r: r[0])
+        return [r[1] for r in rows]
 
     def delete_session_documents(self, session_id: str, user_id: Optional[int] = None):
         """Delete all ChromaDB entries for a session.
@@ -193,19 +297,13 @@ class RAGService:
         self, question: str, session_id: str, user_id: int, n_results: int = 5
     ) -> Dict:
         """Async wrapper around the sync query() method (runs in thread pool)."""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None, self.query, question, session_id, user_id, n_results
-        )
+        return await run_in_thread(self.query, question, session_id, user_id, n_results)
 
     async def index_from_url_async(
         self, url: str, name: str, document_id: str, session_id: str, user_id: int
     ) -> Dict:
         """Async wrapper around the sync index_from_url() method."""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None, self.index_from_url, url, name, document_id, session_id, user_id
-        )
+        return await run_in_thread(self.index_from_url, url, name, document_id, session_id, user_id)
 
     def build_sources(self, chunks: List[str], metas: List[dict]) -> List[dict]:
         """Build source citation list from RAG results."""
@@ -251,20 +349,25 @@ class MemoryService:
         except Exception as e:
             logger.warning(f"Failed to store memory: {e}")
 
+    @timed("memory.retrieve")
     def retrieve_relevant_memory(self, user_id: int, question: str, n: int = 3) -> List[str]:
         """Retrieve past interactions relevant to the current question."""
         try:
             embedding = self.ai_service.get_embeddings([question])[0]
-            results = self.collection.query(
-                query_embeddings=[embedding],
-                n_results=n,
-                where={"user_id": str(user_id)},
-            )
+            start = time.perf_counter()
+            with span("vector.search", operation="memory", k=n):
+                results = self.collection.query(
+                    query_embeddings=[embedding],
+                    n_results=n,
+                    where={"user_id": str(user_id)},
+                )
+            observe_vector_query("memory", time.perf_counter() - start)
             return results["documents"][0] if results["documents"] else []
         except Exception as e:
             logger.warning(f"Memory retrieval failed: {e}")
             return []
 
+    @timed("memory.preferences")
     def get_user_preferences(self, user_id: int) -> str:
         """Aggregate feedback patterns into a preference string."""
         try:
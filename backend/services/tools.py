@@ -1,10 +1,49 @@
 import json
 import logging
 import re
+from collections import Counter
 from typing import Dict, List, Optional
 
+from services.digest_service import is_whole_document_topic
+from services.usage import usage_scope
+from utils.timing import span
+
 logger = logging.getLogger(__name__)
 
+# Item schemas for structured generation. Written in the strict subset shared by
+# OpenAI json_schema mode (every property required, no extra keys) and Gemini's
+# response_schema, so the same definition drives both providers.
+QUIZ_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "options": {"type": "array", "items": {"type": "string"}},
+        "correct_index": {"type": "integer"},
+        "explanation": {"type": "string"},
+    },
+    "required": ["question", "options", "correct_index", "explanation"],
+    "additionalProperties": False,
+}
+
+FLASHCARD_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "front": {"type": "string"},
+        "back": {"type": "string"},
+        "difficulty": {"type": "string", "enum": ["easy", "medium", "hard"]},
+        "tags": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["front", "back", "difficulty", "tags"],
+    "additionalProperties": False,
+}
+
+# Structured-output outcome counters, keyed "<artifact_type>.<outcome>":
+#   ok            — structured call returned only schema-valid items
+#   invalid_items — some items failed validation and were dropped
+#   schema_failed — structured call failed or returned no valid items
+#   fallback_ok / fallback_failed — result of the free-text parsing fallback
+STRUCTURED_OUTPUT_METRICS: Counter = Counter()
+
 # Tool definitions in OpenAI function-calling format
 TOOL_DEFINITIONS = [
     {
@@ -138,12 +177,23 @@ for tool in TOOL_DEFINITIONS:
     })
 
 
+# Usage-accounting feature for LLM/embedding calls made inside each tool.
+_TOOL_FEATURES = {
+    "search_documents": "search",
+    "generate_quiz": "quiz",
+    "create_study_guide": "study_guide",
+    "generate_visualization": "visualization",
+    "generate_flashcards": "flashcards",
+}
+
+
 class ToolExecutor:
     """Executes tool calls from the AI model."""
 
-    def __init__(self, rag_service, ai_service):
+    def __init__(self, rag_service, ai_service, digest_service=None):
         self.rag_service = rag_service
         self.ai_service = ai_service
+        self.digest_service = digest_service
 
     def execute(self, tool_name: str, arguments: dict, session_id: str, user_id: int) -> dict:
         handler = {
@@ -158,7 +208,9 @@ class ToolExecutor:
             return {"error": f"Unknown tool: {tool_name}"}
 
         try:
-            return handler(arguments, session_id, user_id)
+            with span(f"tool.{tool_name}", session_id=session_id), \
+                    usage_scope(user_id, session_id, _TOOL_FEATURES[tool_name]):
+                return handler(arguments, session_id, user_id)
         except Exception as e:
             logger.error(f"Tool {tool_name} execution error: {e}")
             return {"error": str(e)}
@@ -170,17 +222,19 @@ class ToolExecutor:
         result = self.rag_service.query(query, session_id, user_id, n_results=n_results)
         chunks = result.get("chunks", [])
         metas = result.get("metas", [])
+        scores = result.get("scores") or [None] * len(chunks)
 
         if not chunks:
             return {"results": [], "message": "No relevant passages found in the uploaded documents."}
 
         formatted = []
-        for i, (chunk, meta) in enumerate(zip(chunks, metas)):
+        for i, (chunk, meta, score) in enumerate(zip(chunks, metas, scores)):
             pages = json.loads(meta.get("pages", "[]")) if meta else []
             formatted.append({
                 "index": i + 1,
                 "text": chunk,
                 "pages": pages,
+                "relevance": score,
             })
 
         return {"results": formatted, "total": len(formatted)}
@@ -226,14 +280,9 @@ Example format:
 ]"""
 
         # Sub-call: generate quiz content directly via AI, don't rely on outer agentic loop
-        raw = self.ai_service.answer_from_context(
-            context_chunks=[context],
-            question=instruction,
-            chat_history=[],
-            model_override=model_override,
-            persona="academic",
+        content = self._generate_items(
+            context, instruction, QUIZ_ITEM_SCHEMA, "quiz", session_id, model_override,
         )
-        content = self._parse_json_array(raw, "quiz", session_id)
 
         return {
             "artifact_type": "quiz",
@@ -247,6 +296,16 @@ Example format:
         depth = args.get("depth", "standard")
         model_override = args.get("model")
 
+        digests = self._whole_document_digests(topic, session_id)
+        if digests:
+            logger.info(f"create_study_guide: session={session_id} served from {len(digests)} digest(s)")
+            return {
+                "artifact_type": "study_guide",
+                "content": self.digest_service.render_study_guide(digests, depth),
+                "topic": topic,
+                "depth": depth,
+            }
+
         result = self.rag_service.query(topic, session_id, user_id, n_results=8)
         chunks = result.get("chunks", [])
         logger.info(f"create_study_guide: session={session_id} chunks_retrieved={len(chunks)} topic={topic!r}")
@@ -280,8 +339,12 @@ Example format:
         description = args.get("description", "")
         viz_type = args.get("type", "mermaid")
 
-        result = self.rag_service.query(description, session_id, user_id, n_results=5)
-        context = "\n\n".join(result.get("chunks", []))
+        digests = self._whole_document_digests(description, session_id)
+        if digests:
+            context = self.digest_service.outline_context(digests)
+        else:
+            result = self.rag_service.query(description, session_id, user_id, n_results=5)
+            context = "\n\n".join(result.get("chunks", []))
 
         return {
             "artifact_type": "visualization",
@@ -343,14 +406,9 @@ Example format:
 ]"""
 
         # Sub-call: generate flashcard content directly via AI, don't rely on outer agentic loop
-        raw = self.ai_service.answer_from_context(
-            context_chunks=[context],
-            question=instruction,
-            chat_history=[],
-            model_override=model_override,
-            persona="academic",
+        content = self._generate_items(
+            context, instruction, FLASHCARD_ITEM_SCHEMA, "flashcards", session_id, model_override,
         )
-        content = self._parse_json_array(raw, "flashcards", session_id)
 
         return {
             "artifact_type": "flashcards",
@@ -361,6 +419,63 @@ Example format:
 
     # ── Shared helpers ──────────────────────────────────────────────────────────
 
+    def _whole_document_digests(self, topic: str, session_id: str) -> List[Dict]:
+        """Precomputed digests for every document in the session, when the request is about the whole document."""
+        if not self.digest_service or not is_whole_document_topic(topic):
+            return []
+        return self.digest_service.load_for_session(session_id)
+
+    def _generate_items(
+        self,
+        context: str,
+        instruction: str,
+        item_schema: Dict,
+        artifact_type: str,
+        session_id: str,
+        model_override: Optional[str],
+    ) -> Optional[List]:
+        """Generate artifact items with provider-enforced JSON schema.
+
+        Items that still fail local validation are dropped and counted. Only
+        when the structured call yields nothing usable do we fall back to the
+        free-text prompt plus ``_parse_json_array``.
+        """
+        items = self.ai_service.generate_structured(
+            context_chunks=[context],
+            instruction=instruction,
+            item_schema=item_schema,
+            schema_name=artifact_type,
+            model_override=model_override,
+            persona="academic",
+        )
+        if items is not None:
+            valid = [item for item in items if _matches_schema(item, item_schema)]
+            dropped = len(items) - len(valid)
+            if dropped:
+                STRUCTURED_OUTPUT_METRICS[f"{artifact_type}.invalid_items"] += dropped
+                logger.warning(
+                    f"structured_output.validation_failed type={artifact_type} "
+                    f"dropped={dropped} kept={len(valid)} session={session_id}"
+                )
+            if valid:
+                STRUCTURED_OUTPUT_METRICS[f"{artifact_type}.ok"] += 1
+                return valid
+
+        STRUCTURED_OUTPUT_METRICS[f"{artifact_type}.schema_failed"] += 1
+        logger.warning(f"structured_output.fallback type={artifact_type} session={session_id}")
+
+        raw = self.ai_service.answer_from_context(
+            context_chunks=[context],
+            question=instruction,
+            chat_history=[],
+            model_override=model_override,
+            persona="academic",
+        )
+        content = self._parse_json_array(raw, artifact_type, session_id)
+        outcome = "fallback_ok" if content else "fallback_failed"
+        STRUCTURED_OUTPUT_METRICS[f"{artifact_type}.{outcome}"] += 1
+        return content
+
     def _parse_json_array(self, raw: Optional[str], artifact_type: str, session_id: str) -> Optional[List]:
         """Extract and parse the first valid JSON array from a raw AI response string."""
         if not raw:
@@ -401,3 +516,24 @@ Example format:
 
         logger.error(f"_parse_json_array: no valid array found type={artifact_type} raw_len={len(raw)}")
         return None
+
+
+def _matches_schema(value, schema: Dict) -> bool:
+    """Minimal validator for the JSON-schema subset used by the item schemas above."""
+    expected = schema.get("type")
+    if expected == "object":
+        if not isinstance(value, dict):
+            return False
+        props = schema.get("properties", {})
+        if any(key not in value for key in schema.get("required", [])):
+            return False
+        return all(_matches_schema(value[k], sub) for k, sub in props.items() if k in value)
+    if expected == "array":
+        return isinstance(value, list) and all(_matches_schema(v, schema.get("items", {})) for v in value)
+    if expected == "string":
+        if not isinstance(value, str):
+            return False
+        return "enum" not in schema or value in schema["enum"]
+    if expected == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    return True
@@ -0,0 +1,360 @@
+"""Token usage and cost accounting per user, session, model and feature.
+
+Every provider request already passes through ``ai_service._llm_call``
+(answers, agentic rounds, structured generation) or ``TimedEmbeddings``;
+both call ``record_usage``. The call is attributed to the innermost
+``usage_scope`` (user, session, feature) — endpoints and tasks open one, and
+``ToolExecutor.execute`` narrows the feature to the tool — and added to an
+in-process ledger. The ledger is flushed into ``token_usage`` as additive
+upserts, one row per UTC day and bucket:
+
+  * API: every ``USAGE_FLUSH_INTERVAL`` seconds and at shutdown, through the
+    write queue;
+  * Celery: after every task (``install_celery_usage``).
+
+Budgets (``USAGE_DAILY_TOKEN_BUDGET``, ``USAGE_MONTHLY_COST_BUDGET_USD``) are
+checked before user-initiated LLM work against the stored totals plus this
+process's unflushed counts, so the last few seconds of other processes'
+calls can be missed. Our embedding clients do not return usage; embedding
+tokens are estimated at four characters per token.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import math
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Config
+from models_async import TokenUsage
+
+logger = logging.getLogger(__name__)
+
+
+# ── Attribution ─────────────────────────────────────────────────────────
+@dataclass(frozen=True)
+class UsageScope:
+    user_id: int = 0
+    session_id: str = ""
+    feature: str = "other"
+
+
+_scope: contextvars.ContextVar[UsageScope] = contextvars.ContextVar("usage_scope", default=UsageScope())
+
+
+def current_scope() -> UsageScope:
+    return _scope.get()
+
+
+@contextmanager
+def usage_scope(user_id: Optional[int] = None, session_id: Optional[str] = None, feature: Optional[str] = None):
+    """Attribute provider calls made in the block; unset fields are inherited from the enclosing scope.
+
+    Like ``utils.timing.span``, the scope reaches worker threads only through
+    ``run_in_thread``. Do not hold it open across a ``yield`` in a generator.
+    """
+    outer = _scope.get()
+    token = _scope.set(UsageScope(
+        user_id=outer.user_id if user_id is None else user_id,
+        session_id=outer.session_id if session_id is None else (session_id or ""),
+        feature=feature or outer.feature,
+    ))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+# ── Pricing ─────────────────────────────────────────────────────────────
+# USD per 1M tokens (input, output); the longest matching model prefix wins.
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "o3-mini": (1.10, 4.40),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+    "gemini-embedding-001": (0.15, 0.0),
+}
+
+
+def _load_prices() -> Dict[str, Tuple[float, float]]:
+    prices = dict(DEFAULT_PRICES)
+    if Config.MODEL_PRICES:
+        try:
+            prices.update({k: (float(v[0]), float(v[1])) for k, v in json.loads(Config.MODEL_PRICES).items()})
+        except (ValueError, TypeError, IndexError, AttributeError) as e:
+            logger.warning(f"Ignoring invalid MODEL_PRICES: {e}")
+    return prices
+
+
+PRICES = _load_prices()
+
+
+def cost_usd(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated cost of one call; 0 for models without a price."""
+    match = max((p for p in PRICES if model.startswith(p)), key=len, default=None)
+    if match is None:
+        return 0.0
+    input_price, output_price = PRICES[match]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def estimate_tokens(texts: Iterable[str]) -> int:
+    return sum(math.ceil(len(t) / 4) for t in texts)
+
+
+# ── In-process ledger ───────────────────────────────────────────────────
+_KEY_COLUMNS = ("day", "user_id", "session_id", "provider", "model", "feature")
+
+
+class UsageLedger:
+    """Thread-safe totals not yet written to ``token_usage``, keyed by bucket."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [requests, prompt_tokens, completion_tokens, max_prompt_tokens, cost_usd]
+        self._rows: Dict[tuple, list] = {}
+
+    def _merge(self, key: tuple, requests: int, prompt: int, completion: int, max_prompt: int, cost: float) -> None:
+        row = self._rows.setdefault(key, [0, 0, 0, 0, 0.0])
+        row[0] += requests
+        row[1] += prompt
+        row[2] += completion
+        row[3] = max(row[3], max_prompt)
+        row[4] += cost
+
+    def add(self, key: tuple, prompt: int, completion: int, cost: float) -> None:
+        with self._lock:
+            self._merge(key, 1, prompt, completion, prompt, cost)
+
+    def drain(self) -> List[dict]:
+        """Take every pending row (as ``token_usage`` insert values)."""
+        with self._lock:
+            rows, self._rows = self._rows, {}
+        return [
+            {**dict(zip(_KEY_COLUMNS, key)), "requests": r[0], "prompt_tokens": r[1],
+             "completion_tokens": r[2], "max_prompt_tokens": r[3], "cost_usd": r[4]}
+            for key, r in rows.items()
+        ]
+
+    def restore(self, rows: List[dict]) -> None:
+        """Put drained rows back after a failed flush."""
+        with self._lock:
+            for row in rows:
+                self._merge(
+                    tuple(row[c] for c in _KEY_COLUMNS), row["requests"], row["prompt_tokens"],
+                    row["completion_tokens"], row["max_prompt_tokens"], row["cost_usd"],
+                )
+
+    def pending(self, user_id: int, today: date) -> Tuple[int, float]:
+        """Unflushed (tokens today, cost this month) for one user."""
+        tokens, cost = 0, 0.0
+        with self._lock:
+            for key, r in self._rows.items():
+                if key[1] != user_id or (key[0].year, key[0].month) != (today.year, today.month):
+                    continue
+                cost += r[4]
+                if key[0] == today:
+                    tokens += r[1] + r[2]
+        return tokens, cost
+
+
+ledger = UsageLedger()
+
+
+def record_usage(provider: str, model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int] = 0) -> None:
+    """Count one provider call against the current ``usage_scope``."""
+    scope = _scope.get()
+    model = model or "default"
+    prompt_tokens, completion_tokens = prompt_tokens or 0, completion_tokens or 0
+    key = (datetime.utcnow().date(), scope.user_id, scope.session_id, provider, model, scope.feature)
+    ledger.add(key, prompt_tokens, completion_tokens, cost_usd(model, prompt_tokens, completion_tokens))
+
+
+# ── Flushing ────────────────────────────────────────────────────────────
+_FLUSH_CHUNK = 500  # rows per statement, well under SQLite's bound-parameter limit
+
+
+def _upsert_statement(dialect: str, rows: List[dict]):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        greatest = func.greatest
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+        greatest = func.max  # two-argument max() is scalar in SQLite
+    stmt = insert(TokenUsage).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=list(_KEY_COLUMNS),
+        set_={
+            "requests": TokenUsage.requests + stmt.excluded.requests,
+            "prompt_tokens": TokenUsage.prompt_tokens + stmt.excluded.prompt_tokens,
+            "completion_tokens": TokenUsage.completion_tokens + stmt.excluded.completion_tokens,
+            "max_prompt_tokens": greatest(TokenUsage.max_prompt_tokens, stmt.excluded.max_prompt_tokens),
+            "cost_usd": TokenUsage.cost_usd + stmt.excluded.cost_usd,
+        },
+    )
+
+
+def _chunks(rows: List[dict]):
+    for i in range(0, len(rows), _FLUSH_CHUNK):
+        yield rows[i:i + _FLUSH_CHUNK]
+
+
+async def flush_usage() -> int:
+    """Write the ledger through the API's write queue. Returns the number of buckets written."""
+    from write_queue import write_queue
+
+    rows = ledger.drain()
+    if not rows:
+        return 0
+
+    async def job(db: AsyncSession):
+        for chunk in _chunks(rows):
+            await db.execute(_upsert_statement(db.bind.dialect.name, chunk))
+
+    try:
+        await write_queue.submit(job)
+    except Exception as e:
+        ledger.restore(rows)
+        logger.warning(f"Token usage flush failed, will retry: {e}")
+        return 0
+    return len(rows)
+
+
+async def run_usage_flusher(interval: float) -> None:
+    """Background task for the API process (cancelled at shutdown, then flushed once more)."""
+    while True:
+        await asyncio.sleep(interval)
+        await flush_usage()
+
+
+def flush_usage_sync() -> int:
+    """Celery-side flush on the workers' sync session."""
+    from celery_db import SyncSession
+
+    rows = ledger.drain()
+    if not rows:
+        return 0
+    try:
+        with SyncSession() as session:
+            for chunk in _chunks(rows):
+                session.execute(_upsert_statement(session.bind.dialect.name, chunk))
+            session.commit()
+    except Exception as e:
+        ledger.restore(rows)
+        logger.warning(f"Token usage flush failed, will retry: {e}")
+        return 0
+    return len(rows)
+
+
+def install_celery_usage() -> None:
+    """Flush the worker's ledger after each task and when the process exits."""
+    from celery.signals import task_postrun, worker_process_shutdown
+
+    @task_postrun.connect(weak=False)
+    def _on_postrun(**_):
+        flush_usage_sync()
+
+    @worker_process_shutdown.connect(weak=False)
+    def _on_shutdown(**_):
+        flush_usage_sync()
+
+
+# ── Budgets ─────────────────────────────────────────────────────────────
+def budgets_enabled() -> bool:
+    return bool(Config.USAGE_DAILY_TOKEN_BUDGET or Config.USAGE_MONTHLY_COST_BUDGET_USD)
+
+
+async def get_user_usage(db: AsyncSession, user_id: int) -> dict:
+    """Tokens used today and cost this month (UTC), stored plus pending in this process."""
+    today = datetime.utcnow().date()
+    tokens, cost = (await db.execute(
+        select(
+            func.coalesce(func.sum(case(
+                (TokenUsage.day == today, TokenUsage.prompt_tokens + TokenUsage.completion_tokens),
+                else_=0,
+            )), 0),
+            func.coalesce(func.sum(TokenUsage.cost_usd), 0.0),
+        ).where(TokenUsage.user_id == user_id, TokenUsage.day >= today.replace(day=1))
+    )).one()
+    pending_tokens, pending_cost = ledger.pending(user_id, today)
+    return {"tokens_today": int(tokens) + pending_tokens, "cost_month_usd": float(cost) + pending_cost}
+
+
+def budget_exceeded(usage: dict) -> Optional[str]:
+    """The reason a user is over budget, or None."""
+    if Config.USAGE_DAILY_TOKEN_BUDGET and usage["tokens_today"] >= Config.USAGE_DAILY_TOKEN_BUDGET:
+        return f"Daily token budget of {Config.USAGE_DAILY_TOKEN_BUDGET} reached; resets at 00:00 UTC"
+    if Config.USAGE_MONTHLY_COST_BUDGET_USD and usage["cost_month_usd"] >= Config.USAGE_MONTHLY_COST_BUDGET_USD:
+        return f"Monthly usage budget of ${Config.USAGE_MONTHLY_COST_BUDGET_USD:.2f} reached"
+    return None
+
+
+# ── Reporting ───────────────────────────────────────────────────────────
+USAGE_DIMENSIONS = _KEY_COLUMNS
+USAGE_ORDERS = {
+    "cost": lambda: func.sum(TokenUsage.cost_usd),
+    "tokens": lambda: func.sum(TokenUsage.prompt_tokens + TokenUsage.completion_tokens),
+    "requests": lambda: func.sum(TokenUsage.requests),
+    "max_prompt": lambda: func.max(TokenUsage.max_prompt_tokens),
+}
+
+
+def _metrics():
+    return (
+        func.coalesce(func.sum(TokenUsage.requests), 0).label("requests"),
+        func.coalesce(func.sum(TokenUsage.prompt_tokens), 0).label("prompt_tokens"),
+        func.coalesce(func.sum(TokenUsage.completion_tokens), 0).label("completion_tokens"),
+        func.coalesce(func.max(TokenUsage.max_prompt_tokens), 0).label("max_prompt_tokens"),
+        func.coalesce(func.sum(TokenUsage.cost_usd), 0.0).label("cost_usd"),
+    )
+
+
+def _row_dict(row) -> dict:
+    out = dict(row._mapping)
+    if isinstance(out.get("day"), date):
+        out["day"] = out["day"].isoformat()
+    out["cost_usd"] = round(out["cost_usd"], 6)
+    return out
+
+
+async def usage_report(
+    db: AsyncSession, start: date, end: date, group_by: List[str],
+    user_id: Optional[int] = None, order: str = "cost", limit: int = 50,
+) -> dict:
+    """Usage between ``start`` and ``end`` (inclusive) grouped by ``group_by`` dimensions."""
+    conditions = [TokenUsage.day >= start, TokenUsage.day <= end]
+    if user_id is not None:
+        conditions.append(TokenUsage.user_id == user_id)
+    columns = [getattr(TokenUsage, d) for d in group_by]
+
+    totals = (await db.execute(select(*_metrics()).where(*conditions))).one()
+    rows = (await db.execute(
+        select(*columns, *_metrics())
+        .where(*conditions)
+        .group_by(*columns)
+        .order_by(USAGE_ORDERS[order]().desc())
+        .limit(limit)
+    )).all()
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "group_by": group_by,
+        "totals": _row_dict(totals),
+        "rows": [_row_dict(r) for r in rows],
+    }
@@ -0,0 +1,128 @@
+"""Incrementally maintained per-user dashboard counters (``user_stats``)."""
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models_async import FlashcardProgress, QuizResult, StudySession, UserStats
+
+logger = logging.getLogger(__name__)
+
+# FlashcardProgress.status -> UserStats counter it contributes to
+_STATUS_COLUMNS = {"known": "known_flashcards", "reviewing": "reviewing_flashcards"}
+
+
+def quiz_percent(score: int, total_questions: int) -> float:
+    return score / total_questions * 100 if total_questions > 0 else 0.0
+
+
+def _user_sessions(user_id: int):
+    return select(StudySession.id).where(StudySession.user_id == user_id)
+
+
+def _dialect_insert(db: AsyncSession):
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+async def _aggregate(db: AsyncSession, user_id: int) -> dict:
+    """A user's counters computed from the source tables with two aggregate queries."""
+    quiz_count, percent_sum = (await db.execute(
+        select(
+            func.count(QuizResult.id),
+            func.coalesce(func.sum(case(
+                (QuizResult.total_questions > 0,
+                 QuizResult.score * 100.0 / QuizResult.total_questions),
+                else_=0.0,
+            )), 0.0),
+        ).where(QuizResult.session_id.in_(_user_sessions(user_id)))
+    )).one()
+
+    by_status = dict((await db.execute(
+        select(FlashcardProgress.status, func.count(FlashcardProgress.id))
+        .where(FlashcardProgress.session_id.in_(_user_sessions(user_id)))
+        .group_by(FlashcardProgress.status)
+    )).all())
+
+    return {
+        "total_quizzes": quiz_count,
+        "quiz_percent_sum": float(percent_sum),
+        "total_flashcards": sum(by_status.values()),
+        "known_flashcards": by_status.get("known", 0),
+        "reviewing_flashcards": by_status.get("reviewing", 0),
+        "updated_at": datetime.utcnow(),
+    }
+
+
+async def _insert_stats(db: AsyncSession, user_id: int, values: dict, overwrite: bool) -> bool:
+    """INSERT the row; on conflict overwrite it or leave it. True if this statement wrote it."""
+    stmt = _dialect_insert(db)(UserStats).values(user_id=user_id, **values)
+    if overwrite:
+        stmt = stmt.on_conflict_do_update(index_elements=[UserStats.user_id], set_=values)
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[UserStats.user_id])
+    result = await db.execute(stmt)
+    return result.rowcount > 0
+
+
+async def rebuild_user_stats(db: AsyncSession, user_id: int) -> UserStats:
+    """Recompute a user's counters from the source tables and upsert the row (caller commits)."""
+    await _insert_stats(db, user_id, await _aggregate(db, user_id), overwrite=True)
+    return await db.get(UserStats, user_id, populate_existing=True)
+
+
+async def get_user_stats(db: AsyncSession, user_id: int) -> UserStats:
+    """Return the user's counters without writing.
+
+    A user with no row yet gets them computed on the fly in an unsaved
+    ``UserStats``; the row itself is created by their next counted write.
+    """
+    stats = await db.get(UserStats, user_id)
+    if stats is None:
+        stats = UserStats(user_id=user_id, **await _aggregate(db, user_id))
+    return stats
+
+
+async def bump_user_stats(db: AsyncSession, user_id: int, **deltas) -> None:
+    """Atomically add ``deltas`` to a user's counters (caller commits).
+
+    The write that caused the change must already be added to ``db``: when the
+    row does not exist yet it is built from the tables, which then include it.
+    Concurrent first writes for a user are safe: the insert that loses the
+    race adds its deltas to the winner's row instead.
+    """
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    bump = (
+        update(UserStats)
+        .where(UserStats.user_id == user_id)
+        .values(
+            updated_at=datetime.utcnow(),
+            **{k: getattr(UserStats, k) + v for k, v in deltas.items()},
+        )
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(bump)
+    if result.rowcount == 0:
+        await db.flush()
+        if not await _insert_stats(db, user_id, await _aggregate(db, user_id), overwrite=False):
+            # A concurrent request created the row first. Its totals cannot
+            # include our uncommitted write, so add the deltas to it.
+            await db.execute(bump)
+
+
+def flashcard_status_deltas(old_status, new_status) -> dict:
+    """Counter changes for one card moving from ``old_status`` (None if new) to ``new_status``."""
+    deltas = {"total_flashcards": 1} if old_status is None else {}
+    if old_status != new_status:
+        if old_status in _STATUS_COLUMNS:
+            deltas[_STATUS_COLUMNS[old_status]] = deltas.get(_STATUS_COLUMNS[old_status], 0) - 1
+        if new_status in _STATUS_COLUMNS:
+            deltas[_STATUS_COLUMNS[new_status]] = deltas.get(_STATUS_COLUMNS[new_status], 0) + 1
+    return deltas
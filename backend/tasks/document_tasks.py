@@ -1,93 +1,399 @@
 """Async document indexing via Celery."""
 
+import atexit
 import json
+import os
+import shutil
+import threading
+import time
 from datetime import datetime
 
-from celery_app import celery_app
+from sqlalchemy import select
+
+from celery_app import PRIORITY_BULK, PRIORITY_HIGH, PerUserSlots, celery_app
 from celery_db import SyncSession
 from logging_config import get_logger
-from models_async import SessionDocument
+from config import Config
+from models_async import DocumentDigest, SessionDocument
 from services.ai_service import AIService
+from services.digest_service import DigestService
 from services.file_service import FileService
 from services.rag_service import RAGService
+from services.usage import usage_scope
 
 logger = get_logger(__name__)
 
 ai_service = AIService()
 file_service = FileService()
 rag_service = RAGService(ai_service, file_service)
+digest_service = DigestService(rag_service, ai_service)
+indexing_slots = PerUserSlots("indexing", Config.INDEXING_MAX_PER_USER)
+
+
+class ProgressEmitter:
+    """Worker-lifetime, fire-and-forget Socket.IO emitter for indexing progress.
+
+    One write-only ``socketio.RedisManager`` (and so one Redis connection
+    pool) is created lazily per worker process and reused for every event.
+    ``emit`` only records the latest payload per task and returns; a daemon
+    thread publishes it, so a slow or unreachable Redis never blocks a task.
+    Updates for the same task arriving faster than ``min_interval`` seconds are
+    coalesced into the most recent one, which lets stages report per-page or
+    per-batch progress without flooding Redis or the browser. Terminal phases
+    are always published immediately.
+    """
+
+    TERMINAL_PHASES = ("completed", "failure")
+
+    def __init__(self, redis_url, min_interval=0.25):
+        self.redis_url = redis_url
+        self.min_interval = min_interval
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._pending = {}    # task_id -> (payload, terminal)
+        self._last_sent = {}  # task_id -> monotonic time of last publish
+        self._in_flight = 0
+        self._manager = None
+        self._thread = None
+
+    def emit(self, task_id, payload):
+        if self._pid != os.getpid():
+            # Forked into a new worker process: start with fresh state and connection.
+            self._reset()
+        terminal = payload.get("phase") in self.TERMINAL_PHASES
+        with self._cond:
+            self._pending[task_id] = (payload, terminal)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="progress-emitter", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def flush(self, timeout=2.0):
+        """Wait briefly for queued events to go out (used at process exit)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._pending or self._in_flight) and time.monotonic() < deadline:
+                self._cond.wait(timeout=0.05)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                due, next_at = [], None
+                for task_id, (payload, terminal) in list(self._pending.items()):
+                    ready_at = self._last_sent.get(task_id, 0.0) + self.min_interval
+                    if terminal or now >= ready_at:
+                        due.append((task_id, payload))
+                        del self._pending[task_id]
+                        if terminal:
+                            self._last_sent.pop(task_id, None)
+                        else:
+                            self._last_sent[task_id] = now
+                    else:
+                        next_at = ready_at if next_at is None else min(next_at, ready_at)
+                if not due:
+                    self._cond.wait(timeout=next_at - now)
+                    continue
+                self._in_flight = len(due)
+
+            for task_id, payload in due:
+                self._publish(task_id, payload)
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+
+    def _publish(self, task_id, payload):
+        try:
+            if self._manager is None:
+                import socketio as _sio
+                self._manager = _sio.RedisManager(self.redis_url, write_only=True)
+            self._manager.emit("progress", payload, room=f"task:{task_id}")
+        except Exception:
+            # Best-effort: the result backend state is the polling fallback.
+            self._manager = None
+
+
+progress_emitter = ProgressEmitter(Config.REDIS_URL, Config.PROGRESS_MIN_INTERVAL_MS / 1000)
+atexit.register(progress_emitter.flush)
 
 
 def _publish_progress(task_id, phase, progress, data=None):
-    """Publish indexing progress via Socket.IO Redis manager (best-effort)."""
+    """Publish indexing progress via the worker's shared Socket.IO emitter (non-blocking)."""
+    progress_emitter.emit(task_id, {
+        "task_id": task_id,
+        "phase": phase,
+        "progress": progress,
+        **(data or {}),
+    })
+
+
+def _report(ctx, state, phase, progress, **data):
+    """Record pipeline progress under the pipeline id (polled via /tasks/{id}) and push it to Socket.IO."""
     try:
-        import socketio as _sio
-        from config import Config
-
-        external_sio = _sio.RedisManager(Config.REDIS_URL, write_only=True)
-        payload = {
-            "task_id": task_id,
-            "phase": phase,
-            "progress": progress,
-            **(data or {}),
-        }
-        external_sio.emit("progress", payload, room=f"task:{task_id}")
-    except Exception:
-        pass  # Fail silently — update_state() still works as fallback
-
-
-@celery_app.task(bind=True, max_retries=2, default_retry_delay=5)
+        celery_app.backend.store_result(
+            ctx["task_id"],
+            {"phase": phase, "progress": progress, "file_name": ctx["file_name"], **data},
+            state,
+        )
+    except Exception as exc:
+        logger.warning("document.progress.store_failed", error=str(exc), task_id=ctx["task_id"])
+    _publish_progress(ctx["task_id"], phase, progress, data)
+
+
+def _write_json(path, payload):
+    """Write atomically so a crashed stage never leaves a half-written artifact behind."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _manifest_path(ctx):
+    return os.path.join(ctx["work_dir"], "manifest.json")
+
+
+def _batch_path(ctx, kind, start):
+    return os.path.join(ctx["work_dir"], kind, f"{start:06d}.json")
+
+
+class IndexStage(celery_app.Task):
+    """Base class for pipeline stages.
+
+    Every stage receives the pipeline context dict and retries on its own, so
+    a failure only re-runs that stage. Once a stage gives up, the whole
+    pipeline is marked failed under the pipeline id that the client polls,
+    and its work directory is removed.
+    """
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        ctx = kwargs.get("ctx") or next((a for a in args if isinstance(a, dict) and "work_dir" in a), None)
+        if not ctx:
+            return
+        if task_id != ctx["task_id"]:
+            try:
+                celery_app.backend.mark_as_failure(ctx["task_id"], exc)
+            except Exception:
+                pass
+        _publish_progress(ctx["task_id"], "failure", 0, {"error": str(exc)})
+        # Several stages can give up for one pipeline (each failing embed_batch,
+        # then the chord's store_stage), but the pipeline holds one slot.
+        indexing_slots.release_once(ctx["user_id"], ctx["task_id"])
+        # The pipeline is dead, so nothing will resume from its artifacts.
+        shutil.rmtree(ctx["work_dir"], ignore_errors=True)
+
+
+@celery_app.task(bind=True, priority=PRIORITY_HIGH)
 def index_document_task(self, session_id, user_id, file_url, file_name):
-    """Download, extract, and index a document into ChromaDB.
+    """Start the staged indexing pipeline for a document.
+
+    download_stage → extract_stage → group(embed_batch …) → store_stage
 
-    Phases reported via update_state and Redis pub/sub:
-      DOWNLOADING → EXTRACTING → INDEXING → completed
+    Intermediate artifacts (source file, chunk batches, embedding batches)
+    are kept under Config.INDEX_WORK_DIR/<document_id> until the store stage
+    succeeds, so each stage is skipped when its artifact already exists and a
+    retry resumes from the stage that failed. This task's id is the pipeline
+    id: stages report progress under it and store_stage writes the final
+    result to it.
+
+    A user may have at most Config.INDEXING_MAX_PER_USER pipelines running;
+    further uploads wait on the queue so one bulk upload cannot occupy every
+    indexing worker.
     """
+    from celery import chain
+    from celery.exceptions import Ignore
     from werkzeug.utils import secure_filename
 
     document_id = f"{session_id}_{secure_filename(file_name)}_{datetime.now().strftime('%H%M%S')}"
-    task_id = self.request.id
+    work_dir = os.path.join(Config.INDEX_WORK_DIR, document_id)
+    ctx = {
+        "task_id": self.request.id,
+        "session_id": session_id,
+        "user_id": user_id,
+        "file_url": file_url,
+        "file_name": file_name,
+        "document_id": document_id,
+        "work_dir": work_dir,
+        "source_path": os.path.join(work_dir, secure_filename(file_name) or "file"),
+    }
+    if not indexing_slots.acquire(user_id):
+        _report(ctx, "PENDING", "queued", 5, waiting_for_slot=True)
+        raise self.retry(countdown=Config.INDEXING_FAIRNESS_RETRY_SECONDS, max_retries=None)
+
+    os.makedirs(work_dir, exist_ok=True)
+    _report(ctx, "PENDING", "queued", 5)
 
+    chain(download_stage.s(ctx), extract_stage.s()).apply_async()
+    logger.info("document.pipeline.started", document_id=document_id, session_id=session_id)
+    # Leave the pipeline id's state to the stages; store_stage writes the final result.
+    raise Ignore()
+
+
+@celery_app.task(bind=True, base=IndexStage, max_retries=2, default_retry_delay=5, priority=PRIORITY_HIGH)
+def download_stage(self, ctx):
+    try:
+        if not os.path.exists(ctx["source_path"]):
+            _report(ctx, "DOWNLOADING", "downloading", 10)
+            logger.info("document.download.start", file_url=ctx["file_url"], session_id=ctx["session_id"])
+            rag_service.download(ctx["file_url"], ctx["source_path"])
+        return ctx
+    except Exception as exc:
+        logger.error("document.download.failed", error=str(exc), document_id=ctx["document_id"])
+        raise self.retry(exc=exc)
+
+
+@celery_app.task(bind=True, base=IndexStage, max_retries=2, default_retry_delay=5, priority=PRIORITY_HIGH)
+def extract_stage(self, ctx):
+    from celery import chord, group
+
+    try:
+        if not os.path.exists(_manifest_path(ctx)):
+            _report(ctx, "EXTRACTING", "extracting", 15)
+            page_texts, chunks = rag_service.extract_chunks(
+                ctx["source_path"],
+                # Per-page events go only to Socket.IO; the emitter coalesces them.
+                on_page=lambda done, total: _publish_progress(
+                    ctx["task_id"], "extracting", 15 + (9 * done) // max(total, 1),
+                    {"pages_done": done, "pages_total": total},
+                ),
+            )
+
+            batch_size = max(1, Config.EMBED_BATCH_SIZE)
+            os.makedirs(os.path.join(ctx["work_dir"], "chunks"), exist_ok=True)
+            os.makedirs(os.path.join(ctx["work_dir"], "embeddings"), exist_ok=True)
+            starts = list(range(0, len(chunks), batch_size))
+            for start in starts:
+                _write_json(_batch_path(ctx, "chunks", start), chunks[start:start + batch_size])
+            # Manifest last: its presence means extraction completed.
+            _write_json(_manifest_path(ctx), {
+                "file_type": file_service.detect_file_type(ctx["source_path"]),
+                "page_count": len(page_texts),
+                "chunk_count": len(chunks),
+                "batches": starts,
+            })
+            logger.info("document.extracted", document_id=ctx["document_id"], chunks=len(chunks))
+
+        manifest = _read_json(_manifest_path(ctx))
+    except Exception as exc:
+        logger.error("document.extract.failed", error=str(exc), document_id=ctx["document_id"])
+        raise self.retry(exc=exc)
+
+    store = store_stage.s(ctx=ctx).set(task_id=ctx["task_id"])
+    batches = manifest["batches"]
+    if not batches:
+        store.apply_async(args=([],))
+    else:
+        _report(ctx, "EMBEDDING", "embedding", 25, batches_done=0, batches_total=len(batches))
+        chord(group(embed_batch.s(ctx, start) for start in batches))(store)
+    return ctx
+
+
+@celery_app.task(bind=True, base=IndexStage, max_retries=3, default_retry_delay=10, priority=PRIORITY_BULK)
+def embed_batch(self, ctx, start):
+    """Embed one batch of chunks and persist the vectors next to the chunk batch."""
+    out_path = _batch_path(ctx, "embeddings", start)
+    try:
+        if not os.path.exists(out_path):
+            chunks = _read_json(_batch_path(ctx, "chunks", start))
+            with usage_scope(ctx["user_id"], ctx["session_id"], "indexing"):
+                vectors = ai_service.get_embeddings([c["text"] for c in chunks])
+            _write_json(out_path, vectors)
+    except Exception as exc:
+        logger.error("document.embed.failed", error=str(exc), document_id=ctx["document_id"], batch=start)
+        raise self.retry(exc=exc)
+
+    total = len(_read_json(_manifest_path(ctx))["batches"])
+    done = sum(1 for f in os.listdir(os.path.dirname(out_path)) if f.endswith(".json"))
+    _report(ctx, "EMBEDDING", "embedding", 25 + (65 * done) // total, batches_done=done, batches_total=total)
+    return start
+
+
+@celery_app.task(bind=True, base=IndexStage, max_retries=2, default_retry_delay=5, soft_time_limit=300, time_limit=360)
+def store_stage(self, batch_results, ctx):
+    """Write all embedded chunks to Chroma, record the SessionDocument, and clean up artifacts."""
+    session_id, document_id = ctx["session_id"], ctx["document_id"]
     try:
-        # Phase 1: Downloading
-        self.update_state(state="DOWNLOADING", meta={"phase": "downloading", "file_name": file_name})
-        _publish_progress(task_id, "downloading", 20)
-        logger.info("document.download.start", file_url=file_url, session_id=session_id)
+        _report(ctx, "STORING", "storing", 92)
+        manifest = _read_json(_manifest_path(ctx))
+        chunks, vectors = [], []
+        for start in manifest["batches"]:
+            chunks.extend(_read_json(_batch_path(ctx, "chunks", start)))
+            vectors.extend(_read_json(_batch_path(ctx, "embeddings", start)))
+        rag_service.store_embedded_chunks(chunks, vectors, document_id, session_id, ctx["user_id"])
+
+        with SyncSession() as session:
+            doc_record = session.execute(
+                select(SessionDocument).where(SessionDocument.chroma_document_id == document_id)
+            ).scalar_one_or_none()
+            if doc_record is None:
+                doc_record = SessionDocument(
+                    session_id=session_id,
+                    file_name=ctx["file_name"],
+                    file_type=manifest["file_type"],
+                    file_url=ctx["file_url"],
+                    chroma_document_id=document_id,
+                    chunk_count=manifest["chunk_count"],
+                    page_count=manifest["page_count"],
+                )
+                session.add(doc_record)
+                session.commit()
+                session.refresh(doc_record)
+            doc_dict = doc_record.to_dict()
+    except Exception as exc:
+        logger.error("document.store.failed", error=str(exc), session_id=session_id)
+        raise self.retry(exc=exc)
+
+    shutil.rmtree(ctx["work_dir"], ignore_errors=True)
+    indexing_slots.release_once(ctx["user_id"], ctx["task_id"])
+    logger.info("document.indexed", document_id=document_id, chunks=manifest["chunk_count"])
+    _publish_progress(ctx["task_id"], "completed", 100, {"document": doc_dict})
+
+    if Config.DOCUMENT_DIGESTS_ENABLED and manifest["chunk_count"]:
+        build_document_digest_task.delay(
+            session_id, doc_dict["id"], document_id, ctx["file_name"], user_id=ctx["user_id"],
+        )
 
-        # Phase 2: Extracting + Indexing
-        self.update_state(state="EXTRACTING", meta={"phase": "extracting", "file_name": file_name})
-        _publish_progress(task_id, "extracting", 50)
+    return {
+        "status": "completed",
+        "document": doc_dict,
+    }
 
-        result = rag_service.index_from_url(file_url, file_name, document_id, session_id, user_id)
 
-        # Phase 3: Storing DB record
-        self.update_state(state="INDEXING", meta={"phase": "indexing", "file_name": file_name})
-        _publish_progress(task_id, "indexing", 80)
+@celery_app.task(bind=True, max_retries=1, default_retry_delay=30, soft_time_limit=600, time_limit=660)
+def build_document_digest_task(self, session_id, document_id, chroma_document_id, file_name, user_id=0):
+    """Post-index stage: build and store the document's outline, section summaries and key terms.
+
+    Optional (DOCUMENT_DIGESTS_ENABLED). Failure only means whole-document
+    tool requests fall back to retrieval + generation.
+    """
+    try:
+        with usage_scope(user_id, session_id, "digest"):
+            digest = digest_service.build(chroma_document_id, file_name)
+        if not digest:
+            return {"status": "skipped", "document_id": document_id}
 
         with SyncSession() as session:
-            doc_record = SessionDocument(
+            session.add(DocumentDigest(
                 session_id=session_id,
-                file_name=file_name,
-                file_type=result.get("file_type", "unknown"),
-                file_url=file_url,
-                chroma_document_id=document_id,
-                chunk_count=result.get("chunk_count", 0),
-                page_count=result.get("page_count", 0),
-            )
-            session.add(doc_record)
+                document_id=document_id,
+                outline_json=json.dumps(digest["outline"]),
+                sections_json=json.dumps(digest["sections"]),
+                key_terms_json=json.dumps(digest["key_terms"]),
+            ))
             session.commit()
-            session.refresh(doc_record)
-            doc_dict = doc_record.to_dict()
-
-        logger.info("document.indexed", document_id=document_id, chunks=result.get("chunk_count", 0))
-        _publish_progress(task_id, "completed", 100, {"document": doc_dict})
 
-        return {
-            "status": "completed",
-            "document": doc_dict,
-        }
+        logger.info("document.digest.stored", document_id=document_id, sections=len(digest["sections"]))
+        return {"status": "completed", "document_id": document_id}
 
     except Exception as exc:
-        logger.error("document.index.failed", error=str(exc), session_id=session_id)
-        _publish_progress(task_id, "failure", 0, {"error": str(exc)})
+        logger.error("document.digest.failed", error=str(exc), document_id=document_id)
         raise self.retry(exc=exc)
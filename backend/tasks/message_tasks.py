@@ -7,9 +7,12 @@ from celery_app import celery_app
 from logging_config import get_logger
 from models import db, StudySession, ChatMessage
 from services.ai_service import AIService
+from services.artifact_store import add_message_artifacts
+from services.digest_service import DigestService
 from services.file_service import FileService
 from services.rag_service import RAGService, MemoryService
 from services.tools import ToolExecutor
+from services.usage import usage_scope
 
 logger = get_logger(__name__)
 
@@ -17,7 +20,8 @@ ai_service = AIService()
 file_service = FileService()
 rag_service = RAGService(ai_service, file_service)
 memory_service = MemoryService(ai_service)
-tool_executor = ToolExecutor(rag_service, ai_service)
+digest_service = DigestService(rag_service, ai_service)
+tool_executor = ToolExecutor(rag_service, ai_service, digest_service)
 
 
 @celery_app.task(bind=True, max_retries=1, default_retry_delay=5)
@@ -39,53 +43,65 @@ def send_message_task(self, session_id, user_id, question, deep_think=False):
         ).limit(20).all()
         chat_history = [{"role": m.role, "content": m.content} for m in recent_msgs]
 
+        feature = "deep_think" if deep_think else "chat"
+
         # Memory context
         memory_context = ""
         preference_context = ""
         try:
-            memories = memory_service.retrieve_relevant_memory(user_id, question, n=3)
-            if memories:
-                memory_context = " | ".join(memories[:3])
-            preference_context = memory_service.get_user_preferences(user_id)
+            with usage_scope(user_id, session_id, feature):
+                memories = memory_service.retrieve_relevant_memory(user_id, question, n=3)
+                if memories:
+                    memory_context = " | ".join(memories[:3])
+                preference_context = memory_service.get_user_preferences(user_id)
         except Exception as e:
             logger.warning("memory.retrieval.failed", error=str(e))
 
         # Agentic RAG pipeline
-        result = ai_service.answer_with_tools(
-            question=question,
-            chat_history=chat_history,
-            tool_executor=tool_executor,
-            session_id=session_id,
-            user_id=user_id,
-            persona=session.persona or "academic",
-            file_type="pdf",
-            model_override=model_override,
-            memory_context=memory_context,
-            preference_context=preference_context,
-        )
-
-        # Save assistant message
+        with usage_scope(user_id, session_id, feature):
+            result = ai_service.answer_with_tools(
+                question=question,
+                chat_history=chat_history,
+                tool_executor=tool_executor,
+                session_id=session_id,
+                user_id=user_id,
+                persona=session.persona or "academic",
+                file_type="pdf",
+                model_override=model_override,
+                memory_context=memory_context,
+                preference_context=preference_context,
+            )
+
+        # Save assistant message; artifacts get their own rows, as in the API path.
+        artifacts = result.get("artifacts", [])
         assistant_msg = ChatMessage(
             session_id=session_id,
             role="assistant",
             content=result.get("answer", ""),
             sources_json=json.dumps(result.get("sources", [])),
-            artifacts_json=json.dumps(result.get("artifacts", [])),
             suggestions_json=json.dumps(result.get("suggestions", [])),
             tool_calls_json=json.dumps(result.get("tool_calls", [])),
         )
         db.session.add(assistant_msg)
+        db.session.flush()
+        artifact_rows = add_message_artifacts(db.session, session_id, assistant_msg.id, artifacts)
 
         session.updated_at = datetime.utcnow()
         db.session.commit()
 
+        artifact_ids = {row.position: row.id for row in artifact_rows}
+        for position, artifact in enumerate(artifacts):
+            artifact["id"] = artifact_ids.get(position)
+            artifact["message_id"] = assistant_msg.id
+            artifact["session_id"] = session_id
+
         logger.info("message.sent", session_id=session_id, message_id=assistant_msg.id)
 
         return {
             "message_id": assistant_msg.id,
             "answer": result.get("answer", ""),
             "sources": result.get("sources", []),
-            "artifacts": result.get("artifacts", []),
+            "artifacts": artifacts,
             "suggestions": result.get("suggestions", []),
         }
 
@@ -0,0 +1,150 @@
+"""OpenTelemetry tracing for the API and the Celery workers.
+
+Off unless ``OTEL_TRACES_EXPORTER`` is set:
+
+  console   spans printed to stdout
+  file      one JSON span per line in ``OTEL_TRACES_FILE`` ("{pid}" is
+            replaced per process); read it with ``python -m scripts.slow_traces``
+  otlp      OTLP/gRPC to ``OTEL_EXPORTER_OTLP_ENDPOINT`` (collector, Jaeger, Tempo...)
+
+What is traced:
+  * HTTP requests (FastAPI instrumentation) and DB statements (SQLAlchemy
+    instrumentation on the async API engine and the sync Celery engine);
+  * every ``utils.timing.span`` — chat stages, LLM calls, tool handlers,
+    embeddings, vector queries, extraction — as a child of the current span;
+  * Celery tasks: the trace context travels in the task message headers, so
+    an upload is one trace from the HTTP request through download, extract,
+    embed and store stages.
+"""
+
+import os
+
+from config import Config
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+_configured_pid = None
+
+
+def _exporter():
+    kind = Config.TRACING_EXPORTER
+    if kind == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        return ConsoleSpanExporter()
+    if kind == "file":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        path = Config.TRACING_FILE.format(pid=os.getpid())
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return ConsoleSpanExporter(
+            out=open(path, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    if kind == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    raise ValueError(f"Unknown OTEL_TRACES_EXPORTER: {kind!r} (use console, file, otlp or none)")
+
+
+def configure_tracing(service_name: str) -> bool:
+    """Install the tracer provider for this process. Returns False when tracing is off."""
+    global _configured_pid
+    if Config.TRACING_EXPORTER in ("", "none"):
+        return False
+    if _configured_pid == os.getpid():
+        return True
+
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", service_name)}),
+        sampler=ParentBased(TraceIdRatioBased(Config.TRACING_SAMPLE_RATIO)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(_exporter()))
+    trace.set_tracer_provider(provider)
+    _configured_pid = os.getpid()
+    logger.info("tracing.configured", service=service_name, exporter=Config.TRACING_EXPORTER)
+    return True
+
+
+def instrument_sqlalchemy(engine) -> None:
+    """Trace statements on a sync engine (pass ``async_engine.sync_engine`` for async ones)."""
+    try:
+        from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor
+    except ImportError:
+        logger.warning("tracing.sqlalchemy.unavailable")
+        return
+    SQLAlchemyInstrumentor().instrument(engine=engine)
+
+
+def instrument_celery() -> None:
+    """Inject the trace context into published task headers; open a span per executed task."""
+    try:
+        from opentelemetry.instrumentation.celery import CeleryInstrumentor
+    except ImportError:
+        logger.warning("tracing.celery.unavailable")
+        return
+    instrumentor = CeleryInstrumentor()
+    if not instrumentor.is_instrumented_by_opentelemetry:
+        instrumentor.instrument()
+
+
+def setup_api_tracing(app, engine) -> None:
+    """Called once by main.py for the FastAPI process."""
+    if not configure_tracing("filegeek-api"):
+        return
+    try:
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        FastAPIInstrumentor.instrument_app(
+            app, excluded_urls="metrics,health", exclude_spans=["receive", "send"],
+        )
+    except ImportError:
+        logger.warning("tracing.fastapi.unavailable")
+    instrument_sqlalchemy(engine.sync_engine)
+    instrument_celery()
+
+
+def install_celery_tracing() -> None:
+    """Set tracing up in each worker process that executes tasks.
+
+    Prefork children are initialised after the fork (span export threads do
+    not survive it); solo/threads pools run tasks in the main worker process.
+    """
+    if Config.TRACING_EXPORTER in ("", "none"):
+        return
+    from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+
+    def setup():
+        if configure_tracing("filegeek-worker"):
+            from celery_db import sync_engine
+            instrument_sqlalchemy(sync_engine)
+            instrument_celery()
+
+    @worker_process_init.connect(weak=False)
+    def _on_process_init(**_):
+        setup()
+
+    @worker_init.connect(weak=False)
+    def _on_worker_init(sender=None, **_):
+        pool = getattr(sender, "pool_cls", None)
+        if "prefork" not in str(getattr(pool, "__module__", pool)):
+            setup()
+
+    @worker_process_shutdown.connect(weak=False)
+    def _on_process_shutdown(**_):
+        shutdown_tracing()
+
+
+def shutdown_tracing() -> None:
+    """Flush buffered spans (the batch processor exports in the background)."""
+    if _configured_pid != os.getpid():
+        return
+    from opentelemetry import trace
+
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "shutdown"):
+        provider.shutdown()
@@ -0,0 +1,166 @@
+"""Small TTL caches for hot per-request lookups (auth user, session ownership)."""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_caches: List["TTLCache"] = []
+
+# Deletes are published here so every process drops the key from its local tier.
+_INVALIDATION_CHANNEL = "cache:invalidate"
+_listeners: Dict[str, asyncio.Task] = {}  # redis_url -> subscriber task
+
+
+class TTLCache:
+    """In-process LRU cache with per-entry TTL and an optional shared Redis tier.
+
+    The local tier is a plain dict, safe under asyncio because nothing awaits
+    while it is touched. When ``redis_url`` is given, misses fall through to
+    Redis and writes/deletes go to both tiers. A delete is also published on
+    ``cache:invalidate``; each process runs one subscriber that drops the key
+    from its local tier, so other API processes stop serving the entry within
+    a round trip rather than after the local TTL. While the subscriber is
+    disconnected the bound falls back to the local TTL (the local tier is
+    cleared when it reconnects). Redis errors are logged and treated as
+    misses. Values must round-trip through ``dumps`` / ``loads`` to use the
+    Redis tier.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        maxsize: int = 10_000,
+        redis_url: Optional[str] = None,
+        dumps: Callable[[Any], str] = json.dumps,
+        loads: Callable[[str], Any] = json.loads,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.redis_url = redis_url
+        self._dumps = dumps
+        self._loads = loads
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._redis = None
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        _caches.append(self)
+
+    def _redis_client(self):
+        if self._redis is None:
+            import redis.asyncio as aioredis
+            self._redis = aioredis.from_url(self.redis_url)
+        return self._redis
+
+    def _ensure_listener(self) -> None:
+        task = _listeners.get(self.redis_url)
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            _listeners[self.redis_url] = asyncio.ensure_future(_listen_for_invalidations(self.redis_url))
+
+    def _redis_key(self, key: str) -> str:
+        return f"cache:{self.name}:{key}"
+
+    def _store_local(self, key: str, value: Any) -> None:
+        self._local[key] = (time.monotonic() + self.ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Any]:
+        if self.redis_url:
+            self._ensure_listener()
+        entry = self._local.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._local.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._local[key]
+
+        if self.redis_url:
+            try:
+                raw = await self._redis_client().get(self._redis_key(key))
+                if raw is not None:
+                    value = self._loads(raw)
+                    self._store_local(key, value)
+                    self.hits += 1
+                    self.redis_hits += 1
+                    return value
+            except Exception as e:
+                logger.warning(f"Cache {self.name}: redis get failed: {e}")
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        self._store_local(key, value)
+        if self.redis_url:
+            try:
+                await self._redis_client().set(self._redis_key(key), self._dumps(value), ex=max(1, int(self.ttl)))
+            except Exception as e:
+                logger.warning(f"Cache {self.name}: redis set failed: {e}")
+
+    async def delete(self, key: str) -> None:
+        self._local.pop(key, None)
+        if self.redis_url:
+            try:
+                client = self._redis_client()
+                await client.delete(self._redis_key(key))
+                await client.publish(_INVALIDATION_CHANNEL, json.dumps({"cache": self.name, "key": key}))
+            except Exception as e:
+                logger.warning(f"Cache {self.name}: redis delete failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._local),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+async def _listen_for_invalidations(redis_url: str) -> None:
+    """Drop keys deleted by any process from this process's local tiers; reconnects on errors."""
+    import redis.asyncio as aioredis
+
+    while True:
+        client = aioredis.from_url(redis_url)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(_INVALIDATION_CHANNEL)
+            # Deletes published while unsubscribed were missed; forget everything.
+            for cache in _caches:
+                if cache.redis_url == redis_url:
+                    cache._local.clear()
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                data = json.loads(message["data"])
+                for cache in _caches:
+                    if cache.name == data["cache"] and cache.redis_url == redis_url:
+                        cache._local.pop(data["key"], None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Cache invalidation subscriber failed, retrying: {e}")
+            await asyncio.sleep(1)
+        finally:
+            try:
+                await pubsub.aclose()
+                await client.aclose()
+            except Exception:
+                pass
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Hit/miss counters for every cache created in this process."""
+    return {c.name: c.stats() for c in _caches}
@@ -0,0 +1,308 @@
+"""Prometheus metrics for the API and the Celery workers.
+
+Metrics are recorded through the ``observe_*`` helpers so call sites stay
+one line; without ``prometheus_client`` installed the helpers are no-ops and
+``/metrics`` answers 503.
+
+Processes:
+  * single process — ``/metrics`` serves the default registry.
+  * several processes on one host (uvicorn workers, Celery prefork children)
+    — set ``PROMETHEUS_MULTIPROC_DIR`` to the same empty directory in every
+    process's environment before it starts; ``/metrics`` on the API then
+    aggregates all of them.
+  * workers on other hosts — set ``PROMETHEUS_PUSHGATEWAY_URL`` on the
+    workers; each child pushes its registry to the Pushgateway after tasks,
+    at most every ``PROMETHEUS_PUSH_INTERVAL`` seconds.
+
+Cache hit ratios, structured-output outcomes and Celery queue depth are read
+at scrape time by collectors attached in ``render_latest``.
+"""
+
+import logging
+import os
+import socket
+import time
+from typing import Dict, Iterable, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest,
+    )
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+    logger.warning("prometheus_client not installed, metrics disabled")
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir")
+
+_HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_LLM_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+_TASK_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+if PROMETHEUS_AVAILABLE:
+    HTTP_LATENCY = Histogram(
+        "filegeek_http_request_duration_seconds",
+        "API request latency to response start (streaming bodies continue after it)",
+        ["method", "route", "status"], buckets=_HTTP_BUCKETS,
+    )
+    LLM_LATENCY = Histogram(
+        "filegeek_llm_request_duration_seconds",
+        "Latency of one LLM provider request",
+        ["provider", "model", "kind", "outcome"], buckets=_LLM_BUCKETS,
+    )
+    LLM_TOKENS = Counter(
+        "filegeek_llm_tokens",
+        "Tokens reported by the LLM provider",
+        ["provider", "model", "direction"],
+    )
+    EMBED_BATCH = Histogram(
+        "filegeek_embedding_batch_size",
+        "Texts per embeddings call",
+        ["kind"], buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+    )
+    EMBED_LATENCY = Histogram(
+        "filegeek_embedding_duration_seconds",
+        "Latency of one embeddings call",
+        ["kind"], buckets=_HTTP_BUCKETS,
+    )
+    VECTOR_LATENCY = Histogram(
+        "filegeek_vector_query_duration_seconds",
+        "Vector store query latency (similarity searches include embedding the query)",
+        ["operation"], buckets=_HTTP_BUCKETS,
+    )
+    LIMITER_WAIT = Histogram(
+        "filegeek_llm_limiter_wait_seconds",
+        "Time a provider call queued in the provider limiter",
+        ["provider", "model", "lane"], buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 15, 30, 60, 120),
+    )
+    LIMITER_EVENTS = Counter(
+        "filegeek_llm_limiter_events",
+        "Provider limiter rejections (deadline) and provider 429s (throttled)",
+        ["provider", "model", "lane", "event"],
+    )
+    RESILIENCE_EVENTS = Counter(
+        "filegeek_llm_resilience_events",
+        "Circuit breaker transitions (breaker_<state>), failovers and hedged calls",
+        ["provider", "model", "event"],
+    )
+    ROUTES = Counter(
+        "filegeek_llm_routes",
+        "Chat requests by routing mode, chosen tier and outcome (ok, error, escalated)",
+        ["mode", "tier", "outcome"],
+    )
+    TASK_LATENCY = Histogram(
+        "filegeek_celery_task_duration_seconds",
+        "Celery task run time by final state",
+        ["task", "state"], buckets=_TASK_BUCKETS,
+    )
+
+
+# ── Recording helpers ───────────────────────────────────────────────────
+def observe_http(method: str, route: str, status: int, seconds: float) -> None:
+    if PROMETHEUS_AVAILABLE:
+        HTTP_LATENCY.labels(method, route, str(status)).observe(seconds)
+
+
+def observe_llm(
+    provider: str, model: str, kind: str, seconds: float,
+    prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None,
+    outcome: str = "ok",
+) -> None:
+    if not PROMETHEUS_AVAILABLE:
+        return
+    model = model or "default"
+    LLM_LATENCY.labels(provider, model, kind, outcome).observe(seconds)
+    if prompt_tokens:
+        LLM_TOKENS.labels(provider, model, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(provider, model, "completion").inc(completion_tokens)
+
+
+def observe_embedding(kind: str, batch_size: int, seconds: float) -> None:
+    if PROMETHEUS_AVAILABLE:
+        EMBED_BATCH.labels(kind).observe(batch_size)
+        EMBED_LATENCY.labels(kind).observe(seconds)
+
+
+def observe_vector_query(operation: str, seconds: float) -> None:
+    if PROMETHEUS_AVAILABLE:
+        VECTOR_LATENCY.labels(operation).observe(seconds)
+
+
+def observe_limiter_wait(provider: str, model: str, lane: str, seconds: float) -> None:
+    if PROMETHEUS_AVAILABLE:
+        LIMITER_WAIT.labels(provider, model or "default", lane).observe(seconds)
+
+
+def observe_limiter_event(provider: str, model: str, lane: str, event: str) -> None:
+    if PROMETHEUS_AVAILABLE:
+        LIMITER_EVENTS.labels(provider, model or "default", lane, event).inc()
+
+
+def observe_breaker(provider: str, model: str, state: str) -> None:
+    observe_resilience(provider, model, f"breaker_{state}")
+
+
+def observe_resilience(provider: str, model: str, event: str) -> None:
+    if PROMETHEUS_AVAILABLE:
+        RESILIENCE_EVENTS.labels(provider, model or "default", event).inc()
+
+
+def observe_route(mode: str, tier: str, outcome: str) -> None:
+    if PROMETHEUS_AVAILABLE:
+        ROUTES.labels(mode, tier, outcome).inc()
+
+
+def observe_task(task: str, state: str, seconds: float) -> None:
+    if PROMETHEUS_AVAILABLE:
+        TASK_LATENCY.labels(task, state).observe(seconds)
+
+
+# ── Scrape-time collectors ──────────────────────────────────────────────
+class AppStatsCollector:
+    """In-process cache counters and structured-output outcomes (this API process only)."""
+
+    def collect(self) -> Iterable:
+        from services.tools import STRUCTURED_OUTPUT_METRICS
+        from utils.cache import cache_stats
+
+        lookups = CounterMetricFamily(
+            "filegeek_cache_lookups", "Request-path cache lookups", labels=["cache", "result"],
+        )
+        ratio = GaugeMetricFamily(
+            "filegeek_cache_hit_ratio", "Cache hits / lookups since start", labels=["cache"],
+        )
+        for name, stats in cache_stats().items():
+            lookups.add_metric([name, "hit"], stats["hits"])
+            lookups.add_metric([name, "miss"], stats["misses"])
+            if stats["hit_rate"] is not None:
+                ratio.add_metric([name], stats["hit_rate"])
+        yield lookups
+        yield ratio
+
+        structured = CounterMetricFamily(
+            "filegeek_structured_output", "Structured generation outcomes",
+            labels=["artifact_type", "outcome"],
+        )
+        for key, count in STRUCTURED_OUTPUT_METRICS.items():
+            artifact_type, _, outcome = key.partition(".")
+            structured.add_metric([artifact_type, outcome], count)
+        yield structured
+
+
+class CeleryQueueCollector:
+    """Messages waiting in each Celery queue (Redis broker; priority sub-queues summed)."""
+
+    def __init__(self, broker_url: str, queues: Iterable[str], priority_steps: Iterable[int] = range(10), sep: str = ":"):
+        self.broker_url = broker_url
+        self.queues = list(queues)
+        self.priority_steps = list(priority_steps)
+        self.sep = sep
+        self._redis = None
+
+    def _keys(self, queue: str):
+        # kombu's Redis transport keeps priority 0 under the bare name.
+        return [queue if p == 0 else f"{queue}{self.sep}{p}" for p in self.priority_steps]
+
+    def depths(self) -> Dict[str, int]:
+        if self._redis is None:
+            import redis
+            self._redis = redis.from_url(self.broker_url, socket_timeout=1, socket_connect_timeout=1)
+        pipe = self._redis.pipeline()
+        for queue in self.queues:
+            for key in self._keys(queue):
+                pipe.llen(key)
+        counts = iter(pipe.execute())
+        return {queue: sum(next(counts) for _ in self.priority_steps) for queue in self.queues}
+
+    def collect(self) -> Iterable:
+        depth = GaugeMetricFamily(
+            "filegeek_celery_queue_depth", "Messages waiting in the Celery queue", labels=["queue"],
+        )
+        try:
+            for queue, count in self.depths().items():
+                depth.add_metric([queue], count)
+        except Exception as e:
+            logger.warning(f"Celery queue depth unavailable: {e}")
+        yield depth
+
+
+_scrape_collectors = []
+
+
+def register_scrape_collector(collector) -> None:
+    """Add a collector evaluated on every ``/metrics`` scrape of this process."""
+    _scrape_collectors.append(collector)
+
+
+def render_latest() -> bytes:
+    """The Prometheus text exposition for ``/metrics``."""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    extra = CollectorRegistry(auto_describe=False)
+    extra.register(AppStatsCollector())
+    for collector in _scrape_collectors:
+        extra.register(collector)
+    return generate_latest(registry) + generate_latest(extra)
+
+
+# ── Celery worker wiring ────────────────────────────────────────────────
+_task_started: Dict[str, float] = {}
+_last_push = 0.0
+
+
+def _push(force: bool = False) -> None:
+    """Push this worker process's registry to the Pushgateway (throttled)."""
+    global _last_push
+    now = time.monotonic()
+    if not Config.PROMETHEUS_PUSHGATEWAY_URL or (not force and now - _last_push < Config.PROMETHEUS_PUSH_INTERVAL):
+        return
+    _last_push = now
+    try:
+        prometheus_client.pushadd_to_gateway(
+            Config.PROMETHEUS_PUSHGATEWAY_URL,
+            job="filegeek-celery",
+            registry=prometheus_client.REGISTRY,
+            grouping_key={"instance": f"{socket.gethostname()}-{os.getpid()}"},
+            timeout=5,
+        )
+    except Exception as e:
+        logger.warning(f"Pushgateway push failed: {e}")
+
+
+def install_celery_metrics() -> None:
+    """Time every task on the workers and export the results (multiprocess dir or push)."""
+    if not PROMETHEUS_AVAILABLE:
+        return
+    from celery.signals import task_postrun, task_prerun, worker_process_shutdown
+
+    @task_prerun.connect(weak=False)
+    def _on_prerun(task_id=None, **_):
+        _task_started[task_id] = time.perf_counter()
+
+    @task_postrun.connect(weak=False)
+    def _on_postrun(task_id=None, task=None, state=None, **_):
+        started = _task_started.pop(task_id, None)
+        if started is not None and task is not None:
+            observe_task(task.name, state or "UNKNOWN", time.perf_counter() - started)
+        _push()
+
+    @worker_process_shutdown.connect(weak=False)
+    def _on_shutdown(**_):
+        _push(force=True)
+        if MULTIPROC_DIR:
+            from prometheus_client import multiprocess
+
+            multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,49 @@
+"""Keyset pagination cursors and conditional (ETag) JSON responses for list endpoints."""
+
+import base64
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+
+def encode_cursor(sort_value: datetime, row_id: Any) -> str:
+    """Opaque cursor for the row after which the next page starts."""
+    raw = json.dumps([sort_value.isoformat() if sort_value else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], Any]:
+    """Inverse of encode_cursor. Raises ValueError on a malformed cursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(sort_value) if sort_value else None), row_id
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def parse_fields(fields: Optional[str], allowed: Tuple[str, ...]) -> Optional[frozenset]:
+    """``?fields=a,b`` -> frozenset, or None for all fields. Raises ValueError on unknown names."""
+    if not fields:
+        return None
+    requested = frozenset(f.strip() for f in fields.split(",") if f.strip())
+    unknown = requested - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return requested
+
+
+def etag_json_response(request: Request, payload: Any) -> Response:
+    """Serialize ``payload`` with an ETag; answer 304 if the client already has it."""
+    body = json.dumps(jsonable_encoder(payload), separators=(",", ":")).encode()
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    client_tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    if "*" in client_tags or etag in client_tags:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
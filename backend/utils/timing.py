@@ -0,0 +1,124 @@
+"""Per-request timing spans.
+
+``with span("rag.query", session_id=sid) as fields:`` times a block, logs a
+``timing.span`` event (debug level) through the structlog pipeline and, when
+the code runs inside an HTTP request, records the duration on that request's
+``Timings``. The ``log_requests`` middleware opens a ``Timings`` per request,
+logs the aggregated breakdown with ``request.completed`` and returns it in a
+``Server-Timing`` header. Streaming endpoints can send ``Timings.summary()``
+as an SSE event, since their work finishes after the headers are sent.
+
+Each span is also an OpenTelemetry span (a no-op unless ``tracing`` has
+installed a tracer provider), with the fields as attributes.
+
+The current ``Timings`` lives in a contextvar, so blocking work pushed to a
+thread must go through ``run_in_thread`` (or ``asyncio.to_thread``) for its
+spans to be recorded; a bare ``loop.run_in_executor`` does not copy the
+context. Code without a request (Celery tasks, scripts) still logs spans.
+"""
+
+import asyncio
+import contextvars
+import functools
+import re
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import structlog
+from opentelemetry import trace
+
+logger = structlog.get_logger(__name__)
+_tracer = trace.get_tracer("filegeek")
+
+_current: contextvars.ContextVar[Optional["Timings"]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+class Timings:
+    """Spans recorded during one request, in completion order."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[tuple] = []  # (name, duration_ms); list.append is thread-safe
+
+    def add(self, name: str, duration_ms: float) -> None:
+        self.spans.append((name, duration_ms))
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def summary(self) -> Dict[str, Dict]:
+        """``{name: {"ms": total, "count": n}}``. Nested spans overlap, so totals do not add up."""
+        out: Dict[str, Dict] = {}
+        for name, ms in self.spans:
+            entry = out.setdefault(name, {"ms": 0.0, "count": 0})
+            entry["ms"] += ms
+            entry["count"] += 1
+        for entry in out.values():
+            entry["ms"] = round(entry["ms"], 1)
+        return out
+
+    def server_timing(self) -> str:
+        """``Server-Timing`` header value: one metric per span name plus ``total``."""
+        parts = []
+        for name, entry in self.summary().items():
+            metric = re.sub(r"[^A-Za-z0-9_.\-]", "_", name)
+            desc = f';desc="x{entry["count"]}"' if entry["count"] > 1 else ""
+            parts.append(f"{metric};dur={entry['ms']}{desc}")
+        parts.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(parts)
+
+
+def current_timings() -> Optional[Timings]:
+    return _current.get()
+
+
+def start_request_timings() -> tuple:
+    """Open a ``Timings`` for the current request. Returns ``(timings, token)`` for ``end_request_timings``."""
+    timings = Timings()
+    return timings, _current.set(timings)
+
+
+def end_request_timings(token) -> None:
+    _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **fields):
+    """Time the block. The yielded dict can be filled with result fields to log."""
+    start = time.perf_counter()
+    with _tracer.start_as_current_span(name) as otel_span:
+        try:
+            yield fields
+        except BaseException:
+            fields["error"] = True
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            timings = _current.get()
+            if timings is not None:
+                timings.add(name, duration_ms)
+            if otel_span.is_recording():
+                otel_span.set_attributes(
+                    {k: v for k, v in fields.items() if isinstance(v, (str, bool, int, float))}
+                )
+            logger.debug("timing.span", span=name, duration_ms=round(duration_ms, 1), **fields)
+
+
+def timed(name: str, **fields):
+    """Decorator form of ``span`` for whole functions."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **fields):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def run_in_thread(fn, *args):
+    """``loop.run_in_executor(None, fn, *args)`` that keeps the caller's contextvars (and Timings)."""
+    ctx = contextvars.copy_context()
+    return await asyncio.get_event_loop().run_in_executor(None, functools.partial(ctx.run, fn, *args))
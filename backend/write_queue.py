@@ -0,0 +1,126 @@
+"""Single-writer queue that batches small API writes into one transaction.
+
+SQLite allows one writer at a time. Under many concurrent reviewers each
+flashcard-progress or feedback request opening its own write transaction
+queues on the database lock (and past ``busy_timeout`` fails with "database
+is locked"). Routing those writes through one asyncio consumer per process
+turns N contending transactions into one commit per batch.
+
+Jobs are ``async def job(db) -> result`` callables. A batch runs them in
+order on one session and commits once; if any job raises, the batch is
+rolled back and each job is re-run in its own transaction so only the
+failing one reports an error. Jobs must therefore be safe to re-run after a
+rollback (they only touch ``db``). On PostgreSQL, which handles concurrent
+writers itself, jobs run immediately in their own session.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, DATABASE_URL, is_sqlite_url
+
+logger = logging.getLogger(__name__)
+
+WriteJob = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class WriteQueue:
+    def __init__(self, session_factory=AsyncSessionLocal, enabled: bool = True,
+                 max_batch: int = 50, window_ms: float = 5.0):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.jobs = 0
+
+    async def submit(self, job: WriteJob) -> Any:
+        """Run ``job`` in a (possibly shared) write transaction and return its result once committed."""
+        if not self.enabled:
+            async with self.session_factory() as db:
+                result = await job(db)
+                await db.commit()
+                return result
+
+        if self._consumer is None or self._consumer.done():
+            self._queue = asyncio.Queue()
+            self._consumer = asyncio.create_task(self._consume(), name="sqlite-write-queue")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, future))
+        return await future
+
+    async def close(self) -> None:
+        """Drain pending jobs and stop the consumer (app shutdown)."""
+        if self._consumer is None:
+            return
+        await self._queue.put(None)
+        await self._consumer
+        self._consumer = None
+
+    async def _consume(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch: List[Tuple[WriteJob, asyncio.Future]] = [item]
+            stop = False
+            # Collect whatever else arrives within the batching window.
+            deadline = asyncio.get_running_loop().time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - asyncio.get_running_loop().time()
+                try:
+                    item = self._queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(
+                        self._queue.get(), timeout
+                    )
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._run_batch(batch)
+            if stop:
+                return
+
+    async def _run_batch(self, batch: List[Tuple[WriteJob, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.jobs += len(batch)
+        try:
+            async with self.session_factory() as db:
+                results = [await job(db) for job, _ in batch]
+                await db.commit()
+        except Exception as e:
+            if len(batch) > 1:
+                logger.warning(f"Write batch of {len(batch)} failed ({e}); retrying jobs individually")
+            for job, future in batch:
+                await self._run_single(job, future)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _run_single(self, job: WriteJob, future: asyncio.Future) -> None:
+        try:
+            async with self.session_factory() as db:
+                result = await job(db)
+                await db.commit()
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
+
+
+write_queue = WriteQueue(
+    enabled=is_sqlite_url(DATABASE_URL) and os.getenv("SQLITE_WRITE_QUEUE", "true").lower() == "true",
+    max_batch=int(os.getenv("SQLITE_WRITE_BATCH_MAX", "50")),
+    window_ms=float(os.getenv("SQLITE_WRITE_BATCH_WINDOW_MS", "5")),
+)
@@ -6,6 +6,8 @@ const PHASE_LABELS = {
   pending: 'QUEUED...',
   downloading: 'DOWNLOADING...',
   extracting: 'EXTRACTING_TEXT...',
+  embedding: 'EMBEDDING_CHUNKS...',
+  storing: 'BUILDING_INDEX...',
   indexing: 'BUILDING_INDEX...',
   completed: 'COMPLETE',
   success: 'COMPLETE',
@@ -7,7 +7,9 @@ const PHASE_PROGRESS = {
   queued: 5,
   pending: 5,
   downloading: 20,
-  extracting: 50,
+  extracting: 15,
+  embedding: 25,
+  storing: 92,
   indexing: 80,
   completed: 100,
   success: 100,
@@ -19,6 +21,8 @@ const PHASE_LABELS = {
   pending: 'Queued...',
   downloading: 'Downloading...',
   extracting: 'Extracting text...',
+  embedding: 'Embedding chunks...',
+  storing: 'Building index...',
   indexing: 'Building index...',
   completed: 'Complete',
   success: 'Complete',
@@ -1,10 +1,15 @@
-import React, { useEffect, useState, useCallback } from 'react';
+import React, { useEffect, useState, useCallback, useRef } from 'react';
 import { Box, Typography, CircularProgress } from '@mui/material';
 import { useNavigate } from 'react-router-dom';
 import { ArrowLeft, Clock, CheckCircle, RotateCcw } from 'lucide-react';
 import axios from 'axios';
 
 const API = process.env.REACT_APP_API_URL || 'http://localhost:5001';
+const FLUSH_EVERY = 25; // card results buffered before a bulk save
+const PAGE_SIZE = 100; // cards fetched from /flashcards/due at a time
+const PREFETCH_AT = 10; // fetch the next page when this few cards are left
+
+const cardKey = (c) => `${c.session_id}:${c.message_id}:${c.card_index}`;
 
 function FlipCard({ card, onKnow, onReview }) {
     const [flipped, setFlipped] = useState(false);
@@ -88,59 +93,131 @@ function FlipCard({ card, onKnow, onReview }) {
 export default function ReviewQueuePage() {
     const navigate = useNavigate();
     const [cards, setCards] = useState([]);
+    const [totalDue, setTotalDue] = useState(0);
     const [current, setCurrent] = useState(0);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
     const [done, setDone] = useState(false);
     const [stats, setStats] = useState({ known: 0, review: 0 });
+    const [hasMore, setHasMore] = useState(false);
+    const [loadingMore, setLoadingMore] = useState(false);
+    const seen = useRef(new Set());
+    const fetching = useRef(false);
+
+    // Card results are buffered and saved per session with one bulk request
+    // (every FLUSH_EVERY cards, at the end of the deck, and when leaving the page).
+    const pending = useRef([]);
 
-    const fetchDue = useCallback(async () => {
+    const flushProgress = useCallback((keepalive = false) => {
+        const batch = pending.current;
+        if (!batch.length) return Promise.resolve();
+        pending.current = [];
+        const token = localStorage.getItem('filegeek-token');
+        const bySession = {};
+        batch.forEach(({ session_id, ...result }) => {
+            (bySession[session_id] = bySession[session_id] || []).push(result);
+        });
+        return Promise.all(Object.entries(bySession).map(([session_id, results]) => {
+            const body = { session_id, results };
+            if (keepalive) {
+                // axios cannot outlive the page; fetch with keepalive can.
+                return fetch(`${API}/flashcards/progress/bulk`, {
+                    method: 'POST',
+                    keepalive: true,
+                    headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${token}` },
+                    body: JSON.stringify(body),
+                }).catch(() => { /* silent */ });
+            }
+            return axios.post(`${API}/flashcards/progress/bulk`, body, {
+                headers: { Authorization: `Bearer ${token}` },
+            }).catch(() => { /* silent */ });
+        }));
+    }, []);
+
+    // Reviewed cards leave the due list once their results are saved, so each
+    // page is read from the head of the list after a flush; cards already
+    // shown in this session are skipped.
+    const fetchDue = useCallback(async (initial = false) => {
         const token = localStorage.getItem('filegeek-token');
         if (!token) { navigate('/login'); return; }
+        if (fetching.current) return;
+        fetching.current = true;
+        if (!initial) setLoadingMore(true);
         try {
+            if (!initial) await flushProgress();
             const res = await axios.get(`${API}/flashcards/due`, {
                 headers: { Authorization: `Bearer ${token}` },
+                params: { limit: PAGE_SIZE },
             });
-            setCards(res.data.due || []);
+            const fresh = (res.data.due || []).filter(c => !seen.current.has(cardKey(c)));
+            fresh.forEach(c => seen.current.add(cardKey(c)));
+            setCards(prev => [...prev, ...fresh]);
+            setHasMore(Boolean(res.data.has_more) && fresh.length > 0);
+            if (initial) setTotalDue(res.data.total ?? fresh.length);
         } catch {
-            setError('Failed to load review queue.');
+            if (initial) setError('Failed to load review queue.');
+            setHasMore(false);
         } finally {
+            fetching.current = false;
             setLoading(false);
+            setLoadingMore(false);
         }
-    }, [navigate]);
+    }, [navigate, flushProgress]);
 
-    useEffect(() => { fetchDue(); }, [fetchDue]);
+    useEffect(() => { fetchDue(true); }, [fetchDue]);
 
-    const saveProgress = async (card, status) => {
-        const token = localStorage.getItem('filegeek-token');
-        try {
-            await axios.post(`${API}/flashcards/progress`, {
-                session_id: card.session_id,
-                message_id: card.message_id,
-                card_index: card.card_index,
-                card_front: card.card_front,
-                status,
-            }, { headers: { Authorization: `Bearer ${token}` } });
-        } catch { /* silent */ }
+    useEffect(() => {
+        if (!loading && !done && hasMore && cards.length - current <= PREFETCH_AT) fetchDue();
+    }, [loading, done, hasMore, cards.length, current, fetchDue]);
+
+    // Ran past the loaded cards and the next page brought nothing new.
+    useEffect(() => {
+        if (!loading && !done && !hasMore && !loadingMore && cards.length > 0 && current >= cards.length) {
+            setDone(true);
+        }
+    }, [loading, done, hasMore, loadingMore, cards.length, current]);
+
+    useEffect(() => {
+        const onPageHide = () => flushProgress(true);
+        window.addEventListener('pagehide', onPageHide);
+        return () => {
+            window.removeEventListener('pagehide', onPageHide);
+            flushProgress(true);
+        };
+    }, [flushProgress]);
+
+    const saveProgress = (card, status) => {
+        pending.current.push({
+            session_id: card.session_id,
+            message_id: card.message_id,
+            card_index: card.card_index,
+            card_front: card.card_front,
+            status,
+        });
+        if (pending.current.length >= FLUSH_EVERY) flushProgress();
     };
 
-    const handleKnow = async () => {
-        await saveProgress(cards[current], 'known');
+    const handleKnow = () => {
+        saveProgress(cards[current], 'known');
         setStats(s => ({ ...s, known: s.known + 1 }));
         advance();
     };
 
-    const handleReview = async () => {
-        await saveProgress(cards[current], 'reviewing');
+    const handleReview = () => {
+        saveProgress(cards[current], 'reviewing');
         setStats(s => ({ ...s, review: s.review + 1 }));
         advance();
     };
 
     const advance = () => {
-        if (current + 1 >= cards.length) setDone(true);
-        else setCurrent(c => c + 1);
+        if (current + 1 >= cards.length && !hasMore) {
+            flushProgress();
+            setDone(true);
+        } else setCurrent(c => c + 1);
     };
 
+    const deckSize = Math.max(totalDue, cards.length);
+
     return (
         <Box sx={{ minHeight: '100vh', bgcolor: '#000000', color: '#E5E5E5', fontFamily: 'monospace', display: 'flex', flexDirection: 'column' }}>
             {/* Header */}
@@ -154,7 +231,7 @@ export default function ReviewQueuePage() {
                 </Box>
                 {!loading && !error && (
                     <Typography sx={{ fontFamily: 'monospace', fontSize: '0.7rem', color: '#555', ml: 'auto' }}>
-                        {cards.length} card{cards.length !== 1 ? 's' : ''} due
+                        {totalDue} card{totalDue !== 1 ? 's' : ''} due
                     </Typography>
                 )}
             </Box>
@@ -170,16 +247,20 @@ export default function ReviewQueuePage() {
                     </Box>
                 )}
 
-                {!loading && !error && cards.length > 0 && !done && (
+                {!loading && !error && !done && current >= cards.length && cards.length > 0 && (
+                    <Box sx={{ display: 'flex', justifyContent: 'center', pt: 8 }}><CircularProgress size={24} sx={{ color: '#FFAA00' }} /></Box>
+                )}
+
+                {!loading && !error && current < cards.length && !done && (
                     <>
                         {/* Progress bar */}
                         <Box sx={{ mb: 3 }}>
                             <Box sx={{ display: 'flex', justifyContent: 'space-between', mb: 0.5 }}>
                                 <Typography sx={{ fontFamily: 'monospace', fontSize: '0.6rem', color: '#555', textTransform: 'uppercase' }}>Progress</Typography>
-                                <Typography sx={{ fontFamily: 'monospace', fontSize: '0.6rem', color: '#555' }}>{current}/{cards.length}</Typography>
+                                <Typography sx={{ fontFamily: 'monospace', fontSize: '0.6rem', color: '#555' }}>{current}/{deckSize}</Typography>
                             </Box>
                             <Box sx={{ height: 2, bgcolor: '#1A1A1A' }}>
-                                <Box sx={{ height: '100%', width: `${(current / cards.length) * 100}%`, bgcolor: '#FFAA00', transition: 'width 0.3s' }} />
+                                <Box sx={{ height: '100%', width: `${(current / deckSize) * 100}%`, bgcolor: '#FFAA00', transition: 'width 0.3s' }} />
                             </Box>
                         </Box>
                         <FlipCard card={cards[current]} onKnow={handleKnow} onReview={handleReview} />